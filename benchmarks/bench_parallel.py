@@ -0,0 +1,75 @@
+"""
+Scaling benchmark for the process pool pricing backend
+
+Prices the same straddle grid serially and with 1..N workers and prints the time, speedup and parallel efficiency
+of each run. Run from the repo root:
+
+    python -m benchmarks.bench_parallel --points 20000000 --workers 1,2,4,8,16,32
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from src.parallel import default_workers, get_pool, parallel_straddle
+from src.utils import black_scholes_straddle
+
+
+def worker_counts(max_workers: int):
+    counts, n = [], 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    return counts + [max_workers]
+
+
+def best_of(fn, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=5_000_000, help="Grid points to price (default: 5,000,000)")
+    parser.add_argument("--workers", type=lambda text: [int(v) for v in text.split(",")],
+                        help="Comma separated worker counts (default: powers of two up to the core count)")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    spots = rng.uniform(80.0, 120.0, args.points)
+    ivs = rng.uniform(0.1, 1.5, args.points)
+    T = rng.uniform(1, 60, args.points) / 365.0
+
+    serial = best_of(lambda: black_scholes_straddle(spots, 100.0, T, 0.05, ivs), args.repeats)
+    expected = black_scholes_straddle(spots, 100.0, T, 0.05, ivs)["straddle"]
+    print(f"{args.points:,} points on {default_workers()} cores")
+    print(f"{'workers':>8} {'seconds':>9} {'speedup':>8} {'efficiency':>10}")
+    print(f"{'serial':>8} {serial:9.3f} {1.0:8.2f} {1.0:10.0%}")
+
+    for workers in args.workers or worker_counts(default_workers()):
+        get_pool(workers)   # spin the pool up outside the timing
+
+        def run():
+            result = parallel_straddle(spots, 100.0, T, 0.05, ivs, workers=workers, min_parallel_size=0)
+            if hasattr(result, "close"):
+                result.close()
+
+        with_workers = best_of(run, args.repeats)
+
+        result = parallel_straddle(spots, 100.0, T, 0.05, ivs, workers=workers, min_parallel_size=0)
+        if not np.allclose(result["straddle"], expected, equal_nan=True):
+            raise SystemExit(f"{workers} workers disagree with the serial kernel")
+        del result
+
+        speedup = serial / with_workers
+        print(f"{workers:>8} {with_workers:9.3f} {speedup:8.2f} {speedup / workers:10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Offline load test of IBApp against the in-process TWS simulator
+
+Fires get_historical_data for many symbols from a thread pool and reports request and bar throughput, the error,
+timeout and pacing violation counts, whether every response carried its own symbol's bars (the simulated series
+starts at a per symbol base price, so crossed wires between concurrent requests show up as mismatches) and whether any
+IBApp callback raised. Either of the last two fails the run:
+
+    python -m benchmarks.bench_simulator --symbols 200 --threads 32 --latency 0.05 --jitter 0.05 --error-rate 0.02 --drop-rate 0.01
+"""
+
+import argparse
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src.exceptions import NoDataError
+from src.ib_client import bars_to_dataframe
+from src.metrics import METRICS
+from src.simulator import SimulatedIBApp, base_price
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--symbols", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--duration", default="3 D", help="durationStr of every request (default: 3 D)")
+    parser.add_argument("--bar-size", default="1 min")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--bars-per-second", type=float, help="Stream bars at this rate instead of all at once")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--pacing-violation-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=5.0, help="Per request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    app = SimulatedIBApp(latency=args.latency, jitter=args.jitter, bars_per_second=args.bars_per_second,
+                         error_rate=args.error_rate, drop_rate=args.drop_rate,
+                         pacing_violation_rate=args.pacing_violation_rate, seed=args.seed)
+    app.connect_ib("127.0.0.1", "7497")
+
+    def fetch(symbol):
+        contract = app.create_equity_contract(symbol)
+        started = time.perf_counter()
+        buffer = app.get_historical_data(app.next_request_id(), contract, "TRADES", timeout=args.timeout,
+                                         durationStr=args.duration, barSizeSetting=args.bar_size)
+        return bars_to_dataframe(buffer), time.perf_counter() - started
+
+    symbols = [f"SIM{i:04d}" for i in range(args.symbols)]
+    outcomes = Counter()
+    latencies = []
+    bars = 0
+    mismatched = []
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        futures = {pool.submit(fetch, symbol): symbol for symbol in symbols}
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                df, seconds = future.result()
+            except NoDataError as e:
+                outcomes["timeout" if "timed out" in e.message.lower() else "error"] += 1
+                continue
+
+            outcomes["ok"] += 1
+            latencies.append(seconds)
+            bars += len(df)
+            if abs(df["open"].iloc[0] - base_price(symbol, args.seed)) > 1e-9:
+                mismatched.append(symbol)
+    elapsed = time.perf_counter() - start
+    app.disconnect_ib()
+
+    latencies.sort()
+    print(f"\n{args.symbols} requests on {args.threads} threads in {elapsed:.2f}s "
+          f"({args.symbols / elapsed:.1f} req/s, {bars / elapsed:,.0f} bars/s)")
+    print(f"outcomes: {dict(outcomes)}")
+    if latencies:
+        print(f"latency: p50 {latencies[len(latencies) // 2] * 1e3:.1f} ms, p95 {latencies[int(len(latencies) * 0.95)] * 1e3:.1f} ms, "
+              f"max {latencies[-1] * 1e3:.1f} ms")
+    print(f"server: {app.stats}")
+    print(METRICS.summary())
+    print(f"responses with another symbol's bars: {len(mismatched)}")
+    print(f"IBApp callbacks that raised: {app.stats['callback_failures']}")
+    for failure in app.callback_failures[:3]:
+        print(failure)
+    if mismatched or app.stats["callback_failures"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Benchmark suite for the pricing, scenario and ingestion hot paths
+
+Every benchmark is timed (best of --repeats runs, reported as items per second) and then run once more under
+tracemalloc for its peak Python heap allocation. Results are written to benchmarks/results/<label>.json (not tracked, since timings are only
+comparable on the same machine) so a later version can be compared against them:
+
+    python -m benchmarks.run                              # saves benchmarks/results/<git short hash>.json
+    python -m benchmarks.run --label v0.2 --compare benchmarks/results/v0.1.json
+    python -m benchmarks.run --only grid --quick
+
+With --compare the run exits with status 1 if any benchmark's throughput dropped by more than --threshold; a --quick
+run and a full run price different sizes, so comparing one against the other is refused.
+"""
+
+import argparse
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from ibapi.common import BarData
+
+from src.bar_buffer import BarBuffer
+from src.ib_client import IBApp, bars_to_dataframe
+from src.implied_vol import implied_volatility
+from src.pacing import RequestPacer
+from src.scenarios import scenario_grid, spot_moves
+from src.utils import black_scholes_greeks, black_scholes_straddle
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, items: int, quick_items: int = None):
+    """
+    Registers a benchmark; the decorated function takes the number of items to process and returns a zero argument
+    callable that runs it (setup happens outside of the timing)
+    """
+
+    def register(fn):
+        BENCHMARKS[name] = (fn, items, quick_items or max(1, items // 10))
+        return fn
+    return register
+
+
+def _inputs(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(80.0, 120.0, n), rng.uniform(0.1, 1.5, n), rng.uniform(1, 60, n) / 365.0
+
+
+@benchmark("pricing.scalar_greeks", items=5_000)
+def scalar_greeks(n):
+    spots, ivs, T = _inputs(n)
+    spots, ivs, T = spots.tolist(), ivs.tolist(), T.tolist()
+
+    def run():
+        for S, sigma, t in zip(spots, ivs, T):
+            black_scholes_greeks(S, 100.0, t, 0.05, sigma)
+    return run
+
+
+@benchmark("pricing.batched_greeks", items=1_000_000)
+def batched_greeks(n):
+    spots, ivs, T = _inputs(n)
+    return lambda: black_scholes_greeks(spots, 100.0, T, 0.05, ivs)
+
+
+@benchmark("pricing.batched_straddle", items=1_000_000)
+def batched_straddle(n):
+    spots, ivs, T = _inputs(n)
+    return lambda: black_scholes_straddle(spots, 100.0, T, 0.05, ivs)
+
+
+def _grid_benchmark(n_dte: int):
+    def setup(n):
+        # n is side x side x n_dte grid points; --quick passes a smaller square
+        side = math.isqrt(n // n_dte)
+        spots = spot_moves(100.0, 0.25, side)
+        ivs = np.linspace(0.1, 1.2, side)
+        dtes = np.arange(n_dte)
+        # serial so the numbers do not depend on the core count and tracemalloc sees every allocation;
+        # the process pool has its own benchmark in bench_parallel
+        return lambda: scenario_grid(100.0, 8.0, spots, ivs, dtes, workers=1)
+    return setup
+
+
+for _side, _n_dte in ((50, 5), (200, 10), (500, 30)):
+    # a third of the side is about a tenth of the points, like the other benchmarks' quick runs
+    benchmark(f"grid.{_side}x{_side}x{_n_dte}", items=_side * _side * _n_dte, quick_items=(_side // 3) ** 2 * _n_dte)(
+        _grid_benchmark(_n_dte))
+
+
+@benchmark("iv.solve", items=100_000)
+def iv_solve(n):
+    spots, ivs, T = _inputs(n, seed=1)
+    prices = black_scholes_greeks(spots, 100.0, T, 0.05, ivs)["call"]
+    return lambda: implied_volatility(prices, spots, 100.0, T, 0.05, is_call=True)
+
+
+def _synthetic_bars(n: int):
+    """ 1 min bars over as many sessions as needed, as TWS sends them (formatDate=1 strings) """
+
+    bars = []
+    price = 100.0
+    for i in range(n):
+        day, minute = divmod(i, 390)
+        bar = BarData()
+        bar.date = f"2024{1 + day // 28 % 12:02d}{1 + day % 28:02d}  {9 + (30 + minute) // 60:02d}:{(30 + minute) % 60:02d}:00"
+        bar.open, bar.high, bar.low, bar.close = price, price + 0.1, price - 0.1, price + 0.05
+        bar.volume = 1000
+        bars.append(bar)
+    return bars
+
+
+class _ReplayApp(IBApp):
+    """ IBApp whose reqHistoricalData answers straight from a list of bars instead of going to TWS """
+
+    def __init__(self, bars):
+        super().__init__()
+        self.bars = bars
+        self.pacer = RequestPacer(max_requests=None, burst_requests=sys.maxsize, identical_seconds=0)
+
+    def reqHistoricalData(self, reqId, contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH,
+                          formatDate, keepUpToDate, chartOptions):
+        for bar in self.bars:
+            self.historicalData(reqId, bar)
+        self.historicalDataEnd(reqId, "", "")
+
+
+@benchmark("ingest.historical_data_callbacks", items=100_000)
+def ingest_callbacks(n):
+    app = IBApp()
+    bars = _synthetic_bars(n)
+
+    def run():
+        reqId = app.next_request_id()
+        app.historical_data[reqId] = BarBuffer()
+        for bar in bars:
+            app.historicalData(reqId, bar)
+        bars_to_dataframe(app.historical_data.pop(reqId))
+    return run
+
+
+@benchmark("ingest.request_to_frame", items=100_000)
+def ingest_request(n):
+    app = _ReplayApp(_synthetic_bars(n))
+    contract = app.create_equity_contract("TEST")
+
+    def run():
+        buffer = app.request_historical_data(app.next_request_id(), contract, "TRADES").result(timeout=60)
+        bars_to_dataframe(buffer)
+    return run
+
+
+def time_benchmark(run, repeats: int) -> float:
+    run()   # warm up caches and lazy imports
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(run) -> int:
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def git_label() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+def run_benchmarks(names, repeats: int, quick: bool):
+    results = {}
+    for name in names:
+        setup, items, quick_items = BENCHMARKS[name]
+        n = quick_items if quick else items
+        run = setup(n)
+
+        seconds = time_benchmark(run, repeats)
+        results[name] = {
+            "items": n,
+            "seconds": seconds,
+            "items_per_second": n / seconds,
+            "peak_memory_bytes": peak_memory(run),
+        }
+        print(f"{name:<40} {n:>10,} items {seconds * 1e3:10.2f} ms {n / seconds:14,.0f}/s "
+              f"{results[name]['peak_memory_bytes'] / 2**20:9.1f} MiB peak")
+    return results
+
+
+def check_comparable(baseline, quick: bool):
+    """ A --quick run prices different sizes than a full one, so the two cannot be compared """
+
+    if baseline.get("quick", False) != quick:
+        kinds = {True: "a --quick run", False: "a full run"}
+        raise SystemExit(f"Cannot compare {kinds[quick]} against {baseline['label']}, which was {kinds[not quick]}")
+
+
+def compare(results, baseline, threshold: float, quick: bool = False) -> bool:
+    """ Prints the throughput change against a baseline run; returns True if any benchmark regressed past threshold """
+
+    check_comparable(baseline, quick)
+    regressed = False
+    print(f"\nAgainst {baseline['label']} ({baseline['timestamp']}):")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<40} new")
+            continue
+
+        change = result["items_per_second"] / before["items_per_second"] - 1.0
+        memory_change = result["peak_memory_bytes"] / max(before["peak_memory_bytes"], 1) - 1.0
+        flag = ""
+        if change < -threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{name:<40} throughput {change:+8.1%}   peak memory {memory_change:+8.1%}{flag}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--label", help="Name of this run (default: the git short hash)")
+    parser.add_argument("--only", help="Only run benchmarks whose name contains this text")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="Run on about a tenth of the items (grids on a third of the side)")
+    parser.add_argument("--compare", type=Path, help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Throughput drop flagged as a regression (default: 0.10)")
+    parser.add_argument("--no-save", action="store_true", help="Do not write a results file")
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS if args.only is None or args.only in name]
+    if not names:
+        raise SystemExit(f"No benchmarks match {args.only}")
+
+    baseline = None
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())
+        check_comparable(baseline, args.quick)     # before spending the time on the run
+
+    label = args.label or git_label()
+    results = run_benchmarks(names, args.repeats, args.quick)
+
+    run = {
+        "label": label,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "quick": args.quick,
+        "results": results,
+    }
+    if not args.no_save:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        out = RESULTS_DIR / f"{label}.json"
+        out.write_text(json.dumps(run, indent=2))
+        print(f"\nSaved {out}")
+
+    if baseline is not None:
+        if compare(results, baseline, args.threshold, quick=args.quick):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
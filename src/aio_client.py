@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, AsyncIterator, Dict, NamedTuple, Optional
+
+from src.exceptions import NoDataError
+from src.ib_client import IBApp
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from ibapi.contract import Contract
+    from src.option_chain import OptionChain
+
+# IB allows 50 simultaneous open historical requests per client
+DEFAULT_MAX_CONCURRENCY = 50
+
+
+class Tick(NamedTuple):
+    tick_type: int
+    value: float
+    time: float         # time.time() when the tick reached the event loop
+
+
+class AsyncIBClient():
+    """
+    asyncio front end for IBApp (or a ConnectionPool, which has the same request API)
+
+    Every request still goes through the app's EWrapper callbacks, whose futures are resolved on the reader thread;
+    _bridge hands each result to the event loop with loop.call_soon_threadsafe, so any number of requests can be
+    awaited at once (eg. with asyncio.gather) without a thread per waiter. The only threads are the reader and a
+    small sender pool: sending a historical request can block while the pacer holds it back, so sends happen on
+    sender_threads threads instead of on the event loop. max_concurrency bounds the historical requests in flight
+    with a semaphore (IB's own limit is 50 per client).
+
+        async with AsyncIBClient(IBApp(bar_cache=BarCache())) as client:
+            await client.connect("127.0.0.1", 7497)
+            frames = await asyncio.gather(*(client.historical(client.app.create_equity_contract(s), "TRADES") for s in symbols))
+            async for tick in client.stream(contract):
+                ...
+    """
+
+    def __init__(self, app: IBApp = None, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, sender_threads: int = 4):
+        self.app = app if app is not None else IBApp()
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._senders = ThreadPoolExecutor(max_workers=sender_threads, thread_name_prefix="ib-send")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created on first use so it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _bridge(self, future: Future, on_cancel=None) -> asyncio.Future:
+        """
+        asyncio future that mirrors a concurrent future resolved on another thread
+
+        The result is copied over inside the event loop (call_soon_threadsafe); cancelling the asyncio side (eg. a
+        timeout in asyncio.wait_for) calls on_cancel so the IB request is cancelled too
+        """
+
+        loop = asyncio.get_running_loop()
+        bridged = loop.create_future()
+
+        def copy(done: Future):
+            if bridged.done():
+                return
+            if done.cancelled():
+                bridged.cancel()
+            elif done.exception() is not None:
+                bridged.set_exception(done.exception())
+            else:
+                bridged.set_result(done.result())
+
+        def cancelled(done: asyncio.Future):
+            if done.cancelled() and on_cancel is not None:
+                on_cancel()
+
+        future.add_done_callback(lambda done: loop.call_soon_threadsafe(copy, done))
+        bridged.add_done_callback(cancelled)
+        return bridged
+
+    async def _in_sender(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._senders, fn, *args)
+
+    async def connect(self, host: str, port, client_id: int = 1, timeout: float = 15):
+        """ Connects the app (IBApp.connect_ib, or ConnectionPool.connect) and returns its result """
+
+        if isinstance(self.app, IBApp):
+            return await self._in_sender(lambda: self.app.connect_ib(host, port, timeout=timeout, client_id=client_id))
+        return await self._in_sender(self.app.connect)
+
+    async def close(self):
+        """ Disconnects the app and stops the sender threads """
+
+        if isinstance(self.app, IBApp):
+            await self._in_sender(self.app.disconnect_ib)
+        else:
+            await self._in_sender(self.app.close)
+        self._senders.shutdown(wait=False)
+
+    async def historical(self, contract: Contract, whatToShow: str, durationStr: str = "3 D",
+                         barSizeSetting: str = "1 min", timeout: Optional[float] = 60) -> pd.DataFrame:
+        """
+        Historical bars as a df indexed by date (through the app's bar cache if it has one)
+
+        Waits for a semaphore slot, sends the request from the sender pool and then waits on the callbacks without
+        holding a thread. Raises NoDataError on an IB error or if the bars are not in within timeout seconds of sending.
+        """
+
+        async with self.semaphore:
+            reqId = self.app.next_request_id()
+            future = await self._in_sender(self.app.request_historical_frame, reqId, contract, whatToShow,
+                                           durationStr, barSizeSetting)
+            bridged = self._bridge(future, on_cancel=lambda: self.app.cancel_historical_data(reqId))
+            try:
+                return await asyncio.wait_for(bridged, timeout)
+            except asyncio.TimeoutError:
+                self.app.metrics.inc("ib_timeouts_total", kind="historical")
+                raise NoDataError(f"Timed out waiting for Historical Data for reqId {reqId}")
+
+    async def snapshot(self, contract: Contract, timeout: Optional[float] = 15) -> Dict[int, float]:
+        """
+        One-off market data snapshot as a dict of tickType -> price
+
+        On a timeout (or if the caller cancels) the snapshot is cancelled so its market data line and registry entry
+        are freed
+        """
+
+        reqId = self.app.next_request_id()
+        future = await self._in_sender(self.app.request_snapshot, reqId, contract)
+        bridged = self._bridge(future, on_cancel=lambda: self.app.cancel_snapshot(reqId))
+        try:
+            return await asyncio.wait_for(bridged, timeout)
+        except asyncio.TimeoutError:
+            self.app.metrics.inc("ib_timeouts_total", kind="snapshot")
+            raise NoDataError(f"Timed out waiting for a snapshot for reqId {reqId}")
+
+    async def option_chain(self, symbol: str, timeout: float = 15) -> OptionChain:
+        """ IBApp.get_option_chain (cached per underlying) run from the sender pool """
+        return await self._in_sender(self.app.get_option_chain, symbol, timeout)
+
+    async def straddle_quotes(self, chain: OptionChain, expiry: str, strike: float, timeout: float = 15) -> Dict[str, float]:
+        """ IBApp.get_straddle_quotes run from the sender pool """
+        return await self._in_sender(self.app.get_straddle_quotes, chain, expiry, strike, timeout)
+
+    async def stream(self, contract: Contract, genericTickList: str = "", max_queue: int = 1000) -> AsyncIterator[Tick]:
+        """
+        Streams market data ticks for a contract until the loop using it stops (the subscription is cancelled then)
+
+        Ticks are queued in the event loop as they arrive on the reader thread; if the consumer falls more than
+        max_queue ticks behind the oldest ones are dropped, since only the latest prices matter for repricing.
+        """
+
+        loop = asyncio.get_running_loop()
+        ticks: asyncio.Queue = asyncio.Queue()
+
+        def put(tick: Tick):
+            if ticks.qsize() >= max_queue:
+                ticks.get_nowait()
+            ticks.put_nowait(tick)
+
+        def on_tick(reqId, tickType, value):
+            # reader thread; hand the tick to the loop
+            loop.call_soon_threadsafe(put, Tick(tickType, value, time.time()))
+
+        reqId = self.app.subscribe_market_data(contract, on_tick, genericTickList)
+        try:
+            while True:
+                yield await ticks.get()
+        finally:
+            self.app.unsubscribe_market_data(reqId)
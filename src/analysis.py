@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Iterator, Optional, Sequence
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd     # only the screener tables need it, the dashboard prices without loading pandas
+
+from src.exceptions import NoDataError
+from src.metrics import METRICS
+from src.option_chain import select_atm_straddle
+from src.scenarios import scenario_grid, spot_moves
+from src.utils import black_scholes_straddle
+
+RISK_FREE_RATE = 0.05
+VOL_ANNUALIZATION = 252     # TWS sends the IV bars in daily units
+
+# grid the memoized pricer snaps its inputs to: cents for prices, 0.01 vol points for iv, 0.1bp for the rate, whole days
+PRICE_STEP = 0.01
+IV_STEP = 1e-4
+RATE_STEP = 1e-5
+PRICE_CACHE_SIZE = 8192
+
+
+# Nothing in here touches Tk; the dashboard callbacks and the headless CLI both run the same functions below
+
+@METRICS.timed("pricing_seconds", fn="price_straddle")
+def price_straddle(spot: float, strike: float, iv: float, days_to_expiry: int, r: float = RISK_FREE_RATE) -> Dict[str, float]:
+    """
+    Prices a straddle and its greeks; iv is an annualized decimal. Returns a dict of floats
+
+    At or past expiry the straddle is worth its intrinsic value with no time value greeks, the same as the
+    scenario grid values its expired slices
+    """
+
+    if days_to_expiry <= 0:
+        return {
+            "call": float(max(spot - strike, 0.0)),
+            "put": float(max(strike - spot, 0.0)),
+            "straddle": float(abs(spot - strike)),
+            "delta": float(np.sign(spot - strike)),
+            "gamma": 0.0,
+            "vega": 0.0,
+            "theta": 0.0,
+        }
+
+    T = days_to_expiry / 365.0
+    straddle = black_scholes_straddle(spot, strike, T, r, iv)
+    return {key: float(value) for key, value in straddle.items()}
+
+
+@lru_cache(maxsize=PRICE_CACHE_SIZE)
+def _quantized_straddle(spot_q: int, strike_q: int, iv_q: int, days_to_expiry: int, r_q: int):
+    straddle = price_straddle(spot_q * PRICE_STEP, strike_q * PRICE_STEP, iv_q * IV_STEP, days_to_expiry, r_q * RATE_STEP)
+    return tuple(straddle.items())
+
+
+@METRICS.timed("pricing_seconds", fn="cached_price_straddle")
+def cached_price_straddle(spot: float, strike: float, iv: float, days_to_expiry: int, r: float = RISK_FREE_RATE) -> Dict[str, float]:
+    """
+    price_straddle through a bounded LRU cache; inputs are snapped to PRICE_STEP / IV_STEP / RATE_STEP and whole days
+    first so nearby requests (eg. a slider passing over the same spot twice) share an entry
+    """
+
+    return dict(_quantized_straddle(round(spot / PRICE_STEP), round(strike / PRICE_STEP), round(iv / IV_STEP),
+                                    int(days_to_expiry), round(r / RATE_STEP)))
+
+
+def price_cache_info():
+    return _quantized_straddle.cache_info()
+
+
+@METRICS.timed("pricing_seconds", fn="analyze_scenario")
+def analyze_scenario(entry_price: float, new_spot: float, strike: float, new_iv: float, days_to_expiry: int,
+                     r: float = RISK_FREE_RATE, cached: bool = False) -> Dict[str, float]:
+    """
+    Reprices the straddle under a (new spot, new iv) scenario and returns its price, greeks and long/short PnL
+
+    With cached the price and greeks come from cached_price_straddle (inputs snapped to its grid)
+    """
+
+    result = (cached_price_straddle if cached else price_straddle)(new_spot, strike, new_iv, days_to_expiry, r)
+
+    # long pnl is what a straddle buyer makes; the short straddle is the other side of it
+    result["pnl_long"] = result["straddle"] - entry_price
+    result["pnl_short"] = -result["pnl_long"]
+    return result
+
+
+def market_snapshot(equity_df: pd.DataFrame, option_df: pd.DataFrame, vol_annualization: int = VOL_ANNUALIZATION) -> Dict:
+    """ Latest spot price and annualized IV (decimal) from the TRADES and OPTION_IMPLIED_VOLATILITY frames """
+
+    if len(equity_df) == 0 or len(option_df) == 0:
+        raise NoDataError("Need both price and IV bars for a market snapshot")
+
+    latest_bar = equity_df.iloc[-1]
+    latest_iv_bar = option_df.iloc[-1]
+
+    return {
+        "spot": float(latest_bar["close"]),
+        "spot_time": latest_bar.name,
+        "iv": float(latest_iv_bar["close"]) * np.sqrt(vol_annualization),
+        "iv_time": latest_iv_bar.name,
+    }
+
+
+@METRICS.timed("pricing_seconds", fn="pnl_map")
+def pnl_map(spot: float, strike: float, iv: float, days_to_expiry: int, entry_price: float, n_points: int = 200,
+            max_move: float = 0.25, max_slices: int = 31, r: float = RISK_FREE_RATE) -> Dict[str, np.ndarray]:
+    """
+    Long and short PnL over an n_points x n_points spot x IV grid for up to max_slices days-to-expiry slices
+
+    Spots span +/- max_move around spot and IVs run from 20% to 120% of iv. The DTE slices run from expiry (0) up to
+    days_to_expiry; only the axes and the PnL arrays of the scenario grid are kept so the cube stays small.
+    """
+
+    spots = spot_moves(spot, max_move, n_points)
+    ivs = iv * np.linspace(0.2, 1.2, n_points)
+    dtes = np.unique(np.round(np.linspace(0, max(days_to_expiry, 0), max_slices)))
+
+    grid = scenario_grid(strike, entry_price, spots, ivs, dtes, r)
+    return {key: grid[key] for key in ("spot", "iv", "dte", "pnl_long", "pnl_short")}
+
+
+class ScenarioSpec():
+    """
+    The scenarios to run for every symbol of a screen
+
+    spot_moves are decimal moves of the underlying (eg. -0.1 for -10%), iv_crushes are decimal drops in IV relative
+    to the entry IV (eg. 0.4 for a 40% crush) and hold_days is how many days pass between entry and the scenario
+    """
+
+    def __init__(self, spot_moves: Sequence[float], iv_crushes: Sequence[float], hold_days: Sequence[int] = (1,)):
+        self.spot_moves = np.asarray(spot_moves, dtype=np.float64)
+        self.iv_crushes = np.asarray(iv_crushes, dtype=np.float64)
+        self.hold_days = np.asarray(hold_days, dtype=np.int64)
+
+
+@METRICS.timed("pricing_seconds", fn="scenario_table")
+def scenario_table(symbol: str, spot: float, strike: float, iv: float, days_to_expiry: int, spec: ScenarioSpec,
+                   r: float = RISK_FREE_RATE) -> pd.DataFrame:
+    """ Runs every scenario of spec for one straddle through the scenario grid and flattens it into one row per scenario """
+
+    entry = price_straddle(spot, strike, iv, days_to_expiry, r)
+
+    spots = spot * (1.0 + spec.spot_moves)
+    ivs = iv * (1.0 - spec.iv_crushes)
+    dtes = np.maximum(days_to_expiry - spec.hold_days, 0)
+    grid = scenario_grid(strike, entry["straddle"], spots, ivs, dtes, r)
+
+    # the grid is (dte, iv, spot); build the matching scenario axes for every cell
+    hold, crush, move = np.meshgrid(spec.hold_days, spec.iv_crushes, spec.spot_moves, indexing="ij")
+    n = hold.size
+
+    import pandas as pd
+    return pd.DataFrame({
+        "symbol": np.full(n, symbol.upper()),
+        "spot": spot,
+        "strike": strike,
+        "iv": iv,
+        "days_to_expiry": days_to_expiry,
+        "entry_straddle": entry["straddle"],
+        "entry_theta": entry["theta"],
+        "entry_vega": entry["vega"],
+        "spot_move": move.ravel(),
+        "iv_crush": crush.ravel(),
+        "hold_days": hold.ravel(),
+        "new_spot": spot * (1.0 + move.ravel()),
+        "new_iv": iv * (1.0 - crush.ravel()),
+        "new_straddle": grid["straddle"].ravel(),
+        "pnl_long": grid["pnl_long"].ravel(),
+        "pnl_short": grid["pnl_short"].ravel(),
+        "new_delta": grid["delta"].ravel(),
+        "new_gamma": grid["gamma"].ravel(),
+        "new_vega": grid["vega"].ravel(),
+        "new_theta": grid["theta"].ravel(),
+    })
+
+
+def screen_symbols(ib_app, symbols: Sequence[str], spec: ScenarioSpec, days_to_expiry: Optional[int] = None,
+                   event_date: Optional[date] = None, use_chain: bool = True, r: float = RISK_FREE_RATE,
+                   max_workers: int = 8) -> Iterator[pd.DataFrame]:
+    """
+    Fetches and prices a list of symbols in parallel and yields one scenario table per symbol as soon as it is ready
+
+    Market data for the whole list is requested through IBApp.fetch_historical_batch. With use_chain the ATM straddle
+    for the first expiry after event_date is taken from the option chain (chain lookups run on a thread pool);
+    otherwise the strike is the spot price and days_to_expiry must be given. Symbols that fail are reported as a
+    one-row table with an 'error' column so a screen never stops on a single bad name.
+    """
+
+    if not use_chain and days_to_expiry is None:
+        raise ValueError("days_to_expiry is required when the option chain is not used")
+
+    def price_symbol(symbol, frames):
+        snapshot = market_snapshot(frames["TRADES"], frames["OPTION_IMPLIED_VOLATILITY"])
+        spot, iv = snapshot["spot"], snapshot["iv"]
+        strike, dte = spot, days_to_expiry
+
+        if use_chain:
+            chain = ib_app.get_option_chain(symbol)
+            _, strike, dte = select_atm_straddle(chain, spot, event_date)
+
+        return scenario_table(symbol, spot, strike, iv, dte, spec, r)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for symbol, frames, error in ib_app.fetch_historical_batch(symbols):
+            if error is not None:
+                yield _error_row(symbol, error)
+                continue
+            futures[symbol] = pool.submit(price_symbol, symbol, frames)
+
+            # hand back whatever has already finished so results stream out while the fetch continues
+            for done_symbol in [s for s, f in futures.items() if f.done()]:
+                yield _result_or_error(done_symbol, futures.pop(done_symbol))
+
+        symbol_of = {future: symbol for symbol, future in futures.items()}
+        for future in as_completed(symbol_of):
+            yield _result_or_error(symbol_of[future], future)
+
+
+def _result_or_error(symbol, future) -> pd.DataFrame:
+    try:
+        return future.result()
+    except Exception as e:
+        return _error_row(symbol, e)
+
+
+def _error_row(symbol: str, error: Exception) -> pd.DataFrame:
+    import pandas as pd
+    return pd.DataFrame({"symbol": [symbol.upper()], "error": [getattr(error, "message", str(error))]})
@@ -0,0 +1,174 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.analysis import RISK_FREE_RATE, VOL_ANNUALIZATION
+from src.exceptions import NoDataError
+from src.utils import black_scholes_straddle
+
+# event timing relative to the session: after the close (entry that close, exit next open) or before the open
+# (entry the previous close, exit that open)
+AFTER_CLOSE = "amc"
+BEFORE_OPEN = "bmo"
+
+
+def event_windows(session_dates: np.ndarray, event_dates: np.ndarray, timing: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the entry and exit session of every event in one vectorized pass
+
+    session_dates are the sorted trading dates (datetime64[D]) of a symbol. Returns (entry_idx, exit_idx) into
+    session_dates; events without a session on both sides get -1 for both.
+    """
+
+    after_close = timing == AFTER_CLOSE
+    right = np.searchsorted(session_dates, event_dates, side="right")
+    left = np.searchsorted(session_dates, event_dates, side="left")
+
+    # after the close: enter on the last session <= event date and exit on the first session after it
+    # before the open: enter on the last session < event date and exit on the first session >= it
+    entry_idx = np.where(after_close, right, left) - 1
+    exit_idx = np.where(after_close, right, left)
+
+    valid = (entry_idx >= 0) & (exit_idx < len(session_dates))
+    return np.where(valid, entry_idx, -1), np.where(valid, exit_idx, -1)
+
+
+def align_daily_bars(price_df: pd.DataFrame, iv_df: pd.DataFrame, vol_annualization: int = VOL_ANNUALIZATION) -> pd.DataFrame:
+    """ Joins daily TRADES and OPTION_IMPLIED_VOLATILITY bars on session date; IVs are annualized decimals """
+
+    price = price_df[["open", "close"]].copy()
+    iv = iv_df[["open", "close"]] * np.sqrt(vol_annualization)
+    price.index = price.index.normalize()
+    iv.index = iv.index.normalize()
+
+    joined = price.join(iv, how="inner", lsuffix="_spot", rsuffix="_iv")
+    return joined[~joined.index.duplicated(keep="last")].sort_index()
+
+
+def backtest_events(bars: Dict[str, pd.DataFrame], events: pd.DataFrame, days_to_expiry: int = 7,
+                    r: float = RISK_FREE_RATE) -> pd.DataFrame:
+    """
+    Realized straddle PnL for every event, priced with the same Black-Scholes straddle as the dashboard
+
+    bars maps symbol -> aligned daily bars (see align_daily_bars). events has columns symbol, event_date and
+    optionally timing ('amc' or 'bmo', default 'amc'). Each event enters an ATM straddle with days_to_expiry days left
+    at the pre-event close (spot and IV close) and marks it at the post-event open (spot and IV open).
+
+    Entry/exit lookup is vectorized per symbol with searchsorted and every event across every symbol is then priced
+    in a single batched kernel call. Events without bars on both sides are dropped.
+    """
+
+    events = events.copy()
+    events["symbol"] = events["symbol"].str.upper()
+    if "timing" not in events.columns:
+        events["timing"] = AFTER_CLOSE
+    events["event_date"] = pd.to_datetime(events["event_date"]).dt.normalize()
+
+    pieces = []
+    for symbol, group in events.groupby("symbol", sort=False):
+        df = bars.get(symbol)
+        if df is None or len(df) == 0:
+            continue
+
+        session_dates = df.index.values.astype("datetime64[D]")
+        entry_idx, exit_idx = event_windows(session_dates, group["event_date"].values.astype("datetime64[D]"),
+                                            group["timing"].str.lower().values)
+        ok = entry_idx >= 0
+        if not ok.any():
+            continue
+        entry_idx, exit_idx = entry_idx[ok], exit_idx[ok]
+
+        pieces.append(pd.DataFrame({
+            "symbol": symbol,
+            "event_date": group["event_date"].values[ok],
+            "timing": group["timing"].values[ok],
+            "entry_date": df.index.values[entry_idx],
+            "exit_date": df.index.values[exit_idx],
+            "entry_spot": df["close_spot"].values[entry_idx],
+            "entry_iv": df["close_iv"].values[entry_idx],
+            "exit_spot": df["open_spot"].values[exit_idx],
+            "exit_iv": df["open_iv"].values[exit_idx],
+        }))
+
+    columns = ["symbol", "event_date", "timing", "entry_date", "exit_date", "entry_spot", "entry_iv", "exit_spot",
+               "exit_iv", "strike", "entry_straddle", "exit_straddle", "pnl_long", "pnl_short", "pnl_short_pct",
+               "realized_move", "implied_move"]
+    if not pieces:
+        return pd.DataFrame(columns=columns)
+
+    result = pd.concat(pieces, ignore_index=True)
+
+    # price every entry and every exit of every symbol in one kernel call each
+    strike = result["entry_spot"].to_numpy()
+    held_days = (result["exit_date"] - result["entry_date"]).dt.days.to_numpy()
+    T_entry = np.full(len(result), days_to_expiry / 365.0)
+    T_exit = np.maximum(days_to_expiry - held_days, 0) / 365.0
+
+    entry = black_scholes_straddle(result["entry_spot"].to_numpy(), strike, T_entry, r, result["entry_iv"].to_numpy())
+    with np.errstate(divide="ignore", invalid="ignore"):
+        exit_ = black_scholes_straddle(result["exit_spot"].to_numpy(), strike, np.maximum(T_exit, 1e-10), r,
+                                       result["exit_iv"].to_numpy())
+    exit_price = np.where(T_exit > 0, exit_["straddle"], np.abs(result["exit_spot"].to_numpy() - strike))
+
+    result["strike"] = strike
+    result["entry_straddle"] = entry["straddle"]
+    result["exit_straddle"] = exit_price
+    result["pnl_long"] = exit_price - entry["straddle"]
+    result["pnl_short"] = -result["pnl_long"]
+    result["pnl_short_pct"] = result["pnl_short"] / result["entry_straddle"]
+    result["realized_move"] = np.abs(result["exit_spot"] / result["entry_spot"] - 1.0)
+    result["implied_move"] = result["entry_straddle"] / result["entry_spot"]
+
+    return result[columns]
+
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    """ Per symbol summary of a backtest: event count, average and total short PnL, win rate and move ratios """
+
+    grouped = results.groupby("symbol")
+    return pd.DataFrame({
+        "events": grouped.size(),
+        "avg_pnl_short": grouped["pnl_short"].mean(),
+        "total_pnl_short": grouped["pnl_short"].sum(),
+        "avg_pnl_short_pct": grouped["pnl_short_pct"].mean(),
+        "win_rate_short": grouped["pnl_short"].apply(lambda pnl: (pnl > 0).mean()),
+        "avg_implied_move": grouped["implied_move"].mean(),
+        "avg_realized_move": grouped["realized_move"].mean(),
+    })
+
+
+def load_daily_bars(ib_app, symbols: Sequence[str], durationStr: str = "2 Y", max_workers: int = 8,
+                    timeout: float = 60, on_error: Optional[Callable[[str, Exception], None]] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Fetches daily TRADES and IV bars for many symbols in parallel (through the bar cache when the app has one)
+    and returns symbol -> aligned daily bars. Symbols without data are left out and passed to on_error with the error.
+    """
+
+    def load(symbol):
+        contract = ib_app.create_equity_contract(symbol)
+        price = ib_app.get_historical_frame(ib_app.next_request_id(), contract, "TRADES", timeout=timeout,
+                                            durationStr=durationStr, barSizeSetting="1 day")
+        iv = ib_app.get_historical_frame(ib_app.next_request_id(), contract, "OPTION_IMPLIED_VOLATILITY", timeout=timeout,
+                                         durationStr=durationStr, barSizeSetting="1 day")
+        return align_daily_bars(price, iv)
+
+    bars = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(load, symbol.upper()): symbol.upper() for symbol in dict.fromkeys(symbols)}
+        for future in as_completed(futures):
+            try:
+                bars[futures[future]] = future.result()
+            except NoDataError as e:
+                if on_error is not None:
+                    on_error(futures[future], e)
+    return bars
+
+
+def run_backtest(ib_app, events: pd.DataFrame, days_to_expiry: int = 7, durationStr: str = "2 Y",
+                 r: float = RISK_FREE_RATE, on_error: Optional[Callable[[str, Exception], None]] = None) -> pd.DataFrame:
+    """ Loads the bars for every symbol in events and backtests all of the events (see load_daily_bars for on_error) """
+
+    bars = load_daily_bars(ib_app, events["symbol"].unique(), durationStr, on_error=on_error)
+    return backtest_events(bars, events, days_to_expiry, r)
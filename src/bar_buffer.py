@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd     # only needed once a finished request is turned into a df
+
+from ibapi.common import BarData
+
+_NS_PER_SECOND = 1_000_000_000
+
+BAR_FIELDS = ("open", "high", "low", "close", "volume")
+
+
+class BarBuffer():
+    """
+    Append-only columnar buffer for the bars of one historical data request
+
+    Bars are written straight into preallocated numpy arrays (timestamp, OHLC and volume) which grow by doubling, so
+    ingesting a long 1 min or 5 sec history does not create a python object per bar. Dates are parsed as the bars
+    arrive, and to_frame hands the finished request over as a df whose columns are views on the buffer (no copy).
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._size = 0
+        self._dates = np.empty(capacity, dtype=np.int64)        # datetime64[ns] as int64
+        self._cols: Dict[str, np.ndarray] = {field: np.empty(capacity, dtype=np.float64) for field in BAR_FIELDS}
+
+        # IB sends the same session date on every intraday bar so we parse each date string once
+        self._day_cache: Dict[str, int] = {}
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self):
+        capacity = max(1, 2 * len(self._dates))
+        self._dates = np.resize(self._dates, capacity)
+        for field in BAR_FIELDS:
+            self._cols[field] = np.resize(self._cols[field], capacity)
+
+    def _parse_date(self, date: str) -> int:
+        """
+        Parses an IB bar date (formatDate=1) into nanoseconds since the epoch
+
+        Intraday bars look like '20240105  09:30:00' (optionally followed by a time zone name, which is dropped so the
+        timestamps stay naive exchange times) and daily bars look like '20240105'
+        """
+
+        day = date[:8]
+        day_ns = self._day_cache.get(day)
+        if day_ns is None:
+            day_ns = int(np.datetime64(f"{day[:4]}-{day[4:6]}-{day[6:8]}", "ns").astype(np.int64))
+            self._day_cache[day] = day_ns
+
+        clock = date[8:].strip()
+        if not clock:
+            return day_ns
+        clock = clock[:8]
+        seconds = int(clock[0:2]) * 3600 + int(clock[3:5]) * 60 + int(clock[6:8])
+        return day_ns + seconds * _NS_PER_SECOND
+
+    def append(self, bar: BarData):
+        i = self._size
+        if i == len(self._dates):
+            self._grow()
+
+        self._dates[i] = self._parse_date(bar.date)
+        cols = self._cols
+        cols["open"][i] = bar.open
+        cols["high"][i] = bar.high
+        cols["low"][i] = bar.low
+        cols["close"][i] = bar.close
+        cols["volume"][i] = bar.volume
+        self._size = i + 1
+
+    def update_last(self, bar: BarData):
+        """ Used for keepUpToDate streams: replaces the last bar if it has the same date, otherwise appends """
+
+        if self._size > 0 and self._dates[self._size - 1] == self._parse_date(bar.date):
+            self._size -= 1
+        self.append(bar)
+
+    @property
+    def dates(self) -> np.ndarray:
+        return self._dates[:self._size].view("datetime64[ns]")
+
+    def column(self, field: str) -> np.ndarray:
+        return self._cols[field][:self._size]
+
+    def to_frame(self) -> pd.DataFrame:
+        """ Returns the bars as a df indexed by date; the columns are views on the buffer arrays """
+
+        import pandas as pd
+
+        index = pd.DatetimeIndex(self.dates, name="date", copy=False)
+        return pd.DataFrame({field: self.column(field) for field in BAR_FIELDS}, index=index, copy=False)
+
+    def to_records(self) -> np.ndarray:
+        """ Returns the bars as a numpy structured array (date, open, high, low, close, volume) """
+
+        records = np.empty(self._size, dtype=[("date", "datetime64[ns]")] + [(field, "f8") for field in BAR_FIELDS])
+        records["date"] = self.dates
+        for field in BAR_FIELDS:
+            records[field] = self.column(field)
+        return records
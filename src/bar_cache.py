@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import math
+import os
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd     # imported where the frames are built so the cache can be set up before pandas loads
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "iv_crush" / "bars"
+
+# IB stamps bars in the TWS time zone (naive), which for US listings is normally the exchange's
+DEFAULT_BAR_TIMEZONE = "America/New_York"
+
+# on-disk layout of a cached series; timestamps are datetime64[ns] stored as int64
+BAR_DTYPE = np.dtype([
+    ("date", "i8"),
+    ("open", "f8"),
+    ("high", "f8"),
+    ("low", "f8"),
+    ("close", "f8"),
+    ("volume", "f8"),
+])
+
+_BAR_SECONDS = {"sec": 1, "secs": 1, "min": 60, "mins": 60, "hour": 3600, "hours": 3600, "day": 86400, "days": 86400,
+                "week": 7 * 86400, "weeks": 7 * 86400, "month": 31 * 86400, "months": 31 * 86400}
+
+_DURATION_SECONDS = {"S": 1, "D": 86400, "W": 7 * 86400, "M": 31 * 86400, "Y": 365 * 86400}
+
+
+def bar_size_seconds(barSizeSetting: str) -> int:
+    """ Length of one bar in seconds for an IB bar size setting such as '1 min' or '5 secs' """
+    count, unit = barSizeSetting.split()
+    return int(count) * _BAR_SECONDS[unit]
+
+
+def parse_duration(durationStr: str) -> Tuple[int, str]:
+    """ Splits an IB duration string such as '3 D' into (3, 'D') """
+    match = re.fullmatch(r"\s*(\d+)\s*([SDWMY])\s*", durationStr)
+    if match is None:
+        raise ValueError(f"Invalid IB duration string: {durationStr}")
+    return int(match.group(1)), match.group(2)
+
+
+def duration_seconds(durationStr: str) -> int:
+    """ Length of an IB duration string in seconds (months and years are approximated as 31 and 365 days) """
+    count, unit = parse_duration(durationStr)
+    return count * _DURATION_SECONDS[unit]
+
+
+class BarCache():
+    """
+    Local on-disk cache of historical bars keyed by (symbol, whatToShow, bar size)
+
+    IBApp passes ib_client.cache_symbol(contract) as the symbol, so a stock's series is stored under its ticker and
+    options or other listings of the same underlying get their own series.
+
+    Each series is stored as a numpy structured array (.npy) and memory-mapped on load, so reading a cached series
+    does not go through any parsing. top_up_duration works out how much history actually needs to be requested from
+    IB to bring a series up to date, and update merges the new bars into the stored series (bars that overlap the
+    cached tail, such as a partial last bar, are replaced by the newer values).
+
+    tz is the time zone the bar timestamps are in (the TWS time zone); the wall clock is read in it so the age of
+    the cached tail comes out right on a machine in a different zone.
+    """
+
+    def __init__(self, root: Optional[os.PathLike] = None, tz: str = DEFAULT_BAR_TIMEZONE):
+        self.root = Path(root) if root is not None else DEFAULT_CACHE_DIR
+        self.tz = ZoneInfo(tz)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._locks: Dict[tuple, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def _path(self, symbol: str, whatToShow: str, barSizeSetting: str) -> Path:
+        bar = barSizeSetting.replace(" ", "")
+        return self.root / f"{symbol.upper()}_{whatToShow}_{bar}.npy"
+
+    def _lock(self, key: tuple) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def load(self, symbol: str, whatToShow: str, barSizeSetting: str) -> Optional[pd.DataFrame]:
+        """ Returns the cached bars as a df indexed by date, or None if nothing is cached """
+
+        path = self._path(symbol, whatToShow, barSizeSetting)
+        if not path.exists():
+            return None
+
+        try:
+            data = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None     # a corrupt file is treated as a cache miss and rewritten on the next update
+
+        if data.dtype != BAR_DTYPE or len(data) == 0:
+            return None
+
+        import pandas as pd
+        df = pd.DataFrame({name: data[name] for name in BAR_DTYPE.names if name != "date"},
+                          index=pd.DatetimeIndex(data["date"].astype("datetime64[ns]"), name="date"))
+        return df
+
+    def last_timestamp(self, symbol: str, whatToShow: str, barSizeSetting: str) -> Optional[pd.Timestamp]:
+        path = self._path(symbol, whatToShow, barSizeSetting)
+        if not path.exists():
+            return None
+        try:
+            data = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if data.dtype != BAR_DTYPE or len(data) == 0:
+            return None
+
+        import pandas as pd
+        return pd.Timestamp(int(data["date"][-1]))
+
+    def now(self) -> datetime:
+        """ Current wall time in the bars' time zone, naive like the cached timestamps """
+        return datetime.now(self.tz).replace(tzinfo=None)
+
+    def top_up_duration(self, symbol: str, whatToShow: str, barSizeSetting: str, durationStr: str,
+                        now: Optional[datetime] = None) -> Optional[str]:
+        """
+        Returns the IB duration string needed to bring the cached series up to date for a request of durationStr
+
+        Returns durationStr itself on a cache miss (or when the cached tail is older than the whole window) and
+        None when the cache already holds the last completed bar, judged by the end of the last cached bar and the
+        time the series was written (a bar cached before it ended is partial). The top-up window starts at the last
+        cached bar so a partial last bar is refreshed. A naive now is taken to be in the bars' time zone (tz), an aware one is
+        converted to it.
+        """
+
+        last = self.last_timestamp(symbol, whatToShow, barSizeSetting)
+        if last is None:
+            return durationStr
+
+        import pandas as pd
+        if now is None:
+            now = self.now()
+        elif now.tzinfo is not None:
+            now = now.astimezone(self.tz).replace(tzinfo=None)
+        now = pd.Timestamp(now)
+        bar_seconds = bar_size_seconds(barSizeSetting)
+        end = last + pd.Timedelta(seconds=bar_seconds)
+
+        if now < end:
+            # an intraday bar that is still forming has nothing newer behind it yet. a daily (or longer) bar dated
+            # today is the session in progress, or one that closed a few hours ago, so it is always refreshed
+            if bar_seconds < 86400:
+                return None
+        else:
+            # the last bar is over; it is current if it was cached after it ended and the next one has not ended yet
+            try:
+                written = datetime.fromtimestamp(self._path(symbol, whatToShow, barSizeSetting).stat().st_mtime, self.tz)
+            except OSError:
+                return durationStr
+            if pd.Timestamp(written.replace(tzinfo=None)) >= end and now < end + pd.Timedelta(seconds=bar_seconds):
+                return None
+
+        # the window runs from the start of the last cached bar so it is fetched again too
+        gap = max((now - last).total_seconds(), 0.0)
+        count, unit = parse_duration(durationStr)
+        if gap >= count * _DURATION_SECONDS[unit]:
+            return durationStr
+
+        # IB accepts second durations up to a day, past that we have to ask in whole days
+        seconds = int(math.ceil(gap)) + bar_seconds
+        if seconds <= 86400:
+            return f"{seconds} S"
+        return f"{int(math.ceil(seconds / 86400))} D"
+
+    def update(self, symbol: str, whatToShow: str, barSizeSetting: str, bars: pd.DataFrame) -> pd.DataFrame:
+        """ Merges new bars (a df indexed by date) into the cached series, persists it and returns the full series """
+
+        key = (symbol.upper(), whatToShow, barSizeSetting)
+        with self._lock(key):
+            cached = self.load(*key)
+            if cached is not None and len(bars) > 0:
+                import pandas as pd
+                merged = pd.concat([cached, bars[cached.columns]])
+                merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+            elif cached is not None:
+                return cached
+            else:
+                merged = bars.sort_index()
+
+            self._write(self._path(*key), merged)
+            return merged
+
+    def _write(self, path: Path, df: pd.DataFrame):
+        data = np.empty(len(df), dtype=BAR_DTYPE)
+        data["date"] = df.index.values.astype("datetime64[ns]").view("i8")
+        for name in BAR_DTYPE.names:
+            if name != "date":
+                data[name] = df[name].to_numpy(dtype=np.float64)
+
+        # write to a temp file and swap it in so readers never see a half written series
+        tmp = path.with_suffix(".tmp.npy")
+        np.save(tmp, data)
+        os.replace(tmp, path)
+
+    def clear(self, symbol: Optional[str] = None):
+        """ Deletes every cached series (or only the series for one symbol) """
+        pattern = f"{symbol.upper()}_*.npy" if symbol is not None else "*.npy"
+        for path in self.root.glob(pattern):
+            path.unlink(missing_ok=True)
+
+
+def trim_to_duration(df: pd.DataFrame, durationStr: str) -> pd.DataFrame:
+    """
+    Cuts a cached series down to the window a request of durationStr would have returned
+
+    IB counts 'D' durations in trading sessions, so those keep the last N distinct session dates; the other units
+    are measured back from the last bar in calendar time
+    """
+
+    if len(df) == 0:
+        return df
+
+    count, unit = parse_duration(durationStr)
+    if unit == "D":
+        dates = df.index.normalize()
+        keep = dates.unique()[-count:]
+        return df[dates >= keep[0]]
+
+    import pandas as pd
+    start = df.index[-1] - pd.Timedelta(seconds=count * _DURATION_SECONDS[unit])
+    return df[df.index > start]
@@ -0,0 +1,129 @@
+import argparse
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from src.analysis import ScenarioSpec, screen_symbols
+from src.bar_cache import BarCache
+from src.exceptions import ConnectionError
+from src.connection_pool import ConnectionPool
+from src.ib_client import IBApp
+from src.metrics import METRICS
+
+
+def parse_floats(text: str):
+    return [float(value) for value in text.split(",") if value.strip()]
+
+
+def parse_ints(text: str):
+    return [int(value) for value in text.split(",") if value.strip()]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless IV crush screen: fetches, prices and runs scenarios for a list of tickers")
+    parser.add_argument("tickers", nargs="*", help="Tickers to screen")
+    parser.add_argument("--tickers-file", type=Path, help="File with one ticker per line (added to any tickers given)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default="7497")
+    parser.add_argument("--clients", type=int, default=1,
+                        help="Number of TWS client sessions (clientIds 1..N) to spread the requests over (default: 1)")
+    parser.add_argument("--moves", type=parse_floats, default=[-0.10, -0.05, 0.0, 0.05, 0.10],
+                        help="Comma separated spot moves as decimals (default: -0.1,-0.05,0,0.05,0.1)")
+    parser.add_argument("--crushes", type=parse_floats, default=[0.3, 0.4, 0.5],
+                        help="Comma separated IV drops relative to the entry IV as decimals (default: 0.3,0.4,0.5)")
+    parser.add_argument("--hold-days", type=parse_ints, default=[1],
+                        help="Comma separated days between entry and the scenario (default: 1)")
+    parser.add_argument("--event-date", type=lambda text: datetime.strptime(text, "%Y-%m-%d").date(),
+                        help="Earnings/event date (YYYY-MM-DD); the straddle uses the first expiry after it")
+    parser.add_argument("--dte", type=int, help="Days to expiry; with --no-chain the strike is the spot price")
+    parser.add_argument("--no-chain", action="store_true", help="Do not look up option chains (needs --dte)")
+    parser.add_argument("--out", type=Path, default=Path("crush_screen.csv"), help="Output file (.csv or .parquet)")
+    parser.add_argument("--metrics", type=Path, help="Write request latency / throughput / pricing metrics here (.json or .prom)")
+    return parser
+
+
+def write_results(frames, out: Path):
+    results = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    if out.suffix == ".parquet":
+        try:
+            results.to_parquet(out, index=False)
+        except ImportError:
+            raise SystemExit("Writing parquet needs pyarrow installed; use a .csv output instead")
+    else:
+        results.to_csv(out, index=False)
+    return results
+
+
+def connect_app(host: str, port, clients: int = 1):
+    """ Connects one IBApp, or a ConnectionPool of clients sessions, with a bar cache; exits on failure """
+
+    if clients > 1:
+        # sessions that drop mid screen reconnect on their own and their requests are sent again
+        ib_app = ConnectionPool(size=clients, endpoints=[(host, int(port))], bar_cache=BarCache())
+        try:
+            ib_app.connect()
+        except ConnectionError as e:
+            raise SystemExit(e.message)
+        return ib_app
+
+    ib_app = IBApp(bar_cache=BarCache())
+    try:
+        server_version = ib_app.connect_ib(host, port)
+    except ConnectionError as e:
+        raise SystemExit(e.message)
+    if server_version is None:
+        raise SystemExit("Failed to Connect to IB TWS")
+    return ib_app
+
+
+def close_app(ib_app):
+    if isinstance(ib_app, ConnectionPool):
+        ib_app.close()
+    else:
+        ib_app.disconnect_ib()
+
+
+def write_metrics(path: Path):
+    if path is None:
+        return
+    path.write_text(METRICS.to_prometheus() if path.suffix == ".prom" else METRICS.to_json())
+    print(METRICS.summary())
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    tickers = list(args.tickers)
+    if args.tickers_file is not None:
+        tickers += [line.strip() for line in args.tickers_file.read_text().splitlines() if line.strip() and not line.startswith("#")]
+    if not tickers:
+        raise SystemExit("No tickers given")
+    if args.no_chain and args.dte is None:
+        raise SystemExit("--no-chain needs --dte")
+
+    spec = ScenarioSpec(args.moves, args.crushes, args.hold_days)
+    ib_app = connect_app(args.host, args.port, args.clients)
+
+    frames = []
+    try:
+        for table in screen_symbols(ib_app, tickers, spec, days_to_expiry=args.dte, event_date=args.event_date,
+                                    use_chain=not args.no_chain):
+            symbol = table["symbol"].iloc[0]
+            if "error" in table.columns:
+                print(f"{symbol}: {table['error'].iloc[0]}", file=sys.stderr)
+            else:
+                print(f"{symbol}: {len(table)} scenarios, entry straddle ${table['entry_straddle'].iloc[0]:.2f}")
+            frames.append(table)
+    finally:
+        close_app(ib_app)
+
+    results = write_results(frames, args.out)
+    print(f"Wrote {len(results)} rows to {args.out}")
+    write_metrics(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
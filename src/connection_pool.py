@@ -0,0 +1,526 @@
+from __future__ import annotations
+
+import itertools
+import math
+import random
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple
+
+from ibapi.contract import Contract
+
+from src.bar_cache import BarCache
+from src.exceptions import ConnectionError, NoDataError, RequestCancelledError
+from src.ib_client import IBApp
+from src.metrics import METRICS, Metrics
+from src.option_chain import OptionChain, OptionChainCache
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+DEFAULT_ENDPOINTS = (("127.0.0.1", 7497),)
+
+# session states; only connected sessions are handed requests
+CONNECTING = "connecting"
+CONNECTED = "connected"
+DEGRADED = "degraded"           # socket is up but TWS lost its connection to IB (1100)
+RECONNECTING = "reconnecting"
+FAILED = "failed"               # gave up after max_attempts reconnects
+CLOSED = "closed"
+
+
+class Session():
+    """ One client connection of the pool: an IBApp with its own clientId on one TWS / gateway """
+
+    def __init__(self, app: IBApp, host: str, port: int, client_id: int):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.state = CONNECTING
+        self.outstanding = 0
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+
+    def usable(self) -> bool:
+        return self.state == CONNECTED and self.app.connected
+
+
+class _Pending():
+    """ A request the caller is waiting on, with everything needed to send it again on another session """
+
+    def __init__(self, reqId: int, method: str, args: tuple):
+        self.reqId = reqId
+        self.method = method
+        self.args = args
+        self.future = Future()
+        self.session: Optional[Session] = None
+        self.session_req_id: Optional[int] = None
+        self.attempts = 0
+
+
+class ConnectionPool():
+    """
+    Several TWS client sessions used as one client, with automatic reconnect
+
+    Every session is its own IBApp with a distinct clientId (first_client_id, first_client_id + 1, ...), spread
+    round-robin over endpoints so a pool can span several gateways. IB's pacing limits are per client, so spreading
+    requests over sessions raises the throughput ceiling; each request goes to the connected session with the fewest
+    outstanding requests.
+
+    A session is marked down as soon as its connection closes (connectionClosed) and TWS's 1100 connectivity error
+    takes it out of rotation until 1101/1102. Dropped sessions reconnect on their own with exponential backoff
+    (initial_backoff doubling up to max_backoff, with jitter). Historical requests that fail because their connection
+    went away are sent again on whichever session is up, up to max_resubmits times, so the caller's future only sees
+    the failure if no session comes back; streaming subscriptions are moved the same way.
+
+    The pool exposes the same request API as IBApp (next_request_id, request_historical_frame, get_historical_frame,
+    fetch_historical_batch, request_snapshot, get_option_chain, get_straddle_quotes, subscribe_market_data, ...) so it can be passed
+    anywhere an IBApp is used. reqIds are the pool's own and are mapped to each session's reqIds internally.
+    """
+
+    def __init__(self, size: int = 2, endpoints: Sequence[Tuple[str, int]] = DEFAULT_ENDPOINTS, first_client_id: int = 1,
+                 app_factory: Callable[[], IBApp] = None, bar_cache: BarCache = None, metrics: Metrics = None,
+                 connect_timeout: float = 15, initial_backoff: float = 1.0, max_backoff: float = 60.0,
+                 max_attempts: Optional[int] = None, max_resubmits: int = 3, wait_timeout: float = 30):
+        if size < 1:
+            raise ValueError("A connection pool needs at least one session")
+
+        self.metrics = metrics if metrics is not None else METRICS
+        self.bar_cache = bar_cache
+        self.connect_timeout = connect_timeout
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.max_resubmits = max_resubmits
+        self.wait_timeout = wait_timeout        # how long a request waits for any session to be up before failing
+
+        # chain definitions are shared so a chain looked up on one session is not looked up again on another
+        self.option_chain_cache = OptionChainCache(ttl=3600)
+
+        factory = app_factory or (lambda: IBApp(bar_cache=self.bar_cache, metrics=self.metrics))
+        self.sessions: List[Session] = []
+        for i in range(size):
+            host, port = endpoints[i % len(endpoints)]
+            app = factory()
+            app.option_chain_cache = self.option_chain_cache
+            session = Session(app, host, int(port), first_client_id + i)
+            app.on_connection_closed = lambda _app, session=session: self._on_closed(session)
+            app.on_connectivity = lambda _app, code, session=session: self._on_connectivity(session, code)
+            self.sessions.append(session)
+
+        self._cond = threading.Condition()
+        self._closed = threading.Event()
+        self._req_id_counter = itertools.count(1)
+        self._req_id_lock = threading.Lock()
+        self._pending: Dict[int, _Pending] = {}
+        self._subscriptions: Dict[int, list] = {}       # pool reqId -> [contract, on_tick, genericTickList, session, session reqId]
+
+        # requests and subscriptions that lost their session wait here as (deadline, send, give_up) until a session is
+        # up; the dispatcher sends them from its own thread, off the reader threads, and never blocks waiting for one
+        self._retries: List[Tuple[float, Callable[[Session], None], Optional[Callable[[], None]]]] = []
+        self._dispatcher = threading.Thread(target=self._dispatch_retries, daemon=True)
+        self._dispatcher.start()
+
+    # ---- connection management ----
+
+    @property
+    def connected(self) -> bool:
+        return any(session.usable() for session in self.sessions)
+
+    def connect(self) -> int:
+        """
+        Connects every session in parallel and returns how many came up
+
+        Sessions that fail to connect keep retrying in the background with backoff; raises ConnectionError only if no
+        session could connect at all
+        """
+
+        threads = [threading.Thread(target=self._connect_session, args=(session,), daemon=True) for session in self.sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        up = sum(session.usable() for session in self.sessions)
+        if up == 0:
+            raise ConnectionError(_func="connect", _file="connection_pool",
+                                  message=f"None of the {len(self.sessions)} sessions could connect")
+        return up
+
+    def _connect_session(self, session: Session):
+        try:
+            server_version = session.app.connect_ib(session.host, session.port, timeout=self.connect_timeout,
+                                                    client_id=session.client_id)
+        except ConnectionError as e:
+            session.last_error = e.message
+            self.metrics.inc("ib_connect_failures_total", client_id=session.client_id)
+            server_version = None
+
+        if server_version is not None and session.app.connected:
+            self._set_state(session, CONNECTED)
+        else:
+            self._start_reconnect(session)
+
+    def _set_state(self, session: Session, state: str):
+        with self._cond:
+            if session.state == CLOSED:
+                return
+            session.state = state
+            self._cond.notify_all()
+
+    def _on_closed(self, session: Session):
+        """ connectionClosed of a session (reader thread): take it out of rotation and start reconnecting """
+
+        if self._closed.is_set() or session.state in (CLOSED, RECONNECTING):
+            return
+        self.metrics.inc("ib_disconnects_total", client_id=session.client_id)
+        self._move_subscriptions(session)
+        self._start_reconnect(session)
+
+    def _on_connectivity(self, session: Session, code: int):
+        if code == 1100:
+            self._set_state(session, DEGRADED)
+        elif session.state == DEGRADED:
+            self._set_state(session, CONNECTED)
+            if code == 1101:
+                # connectivity is back but TWS dropped the market data subscriptions
+                self._move_subscriptions(session)
+
+    def _start_reconnect(self, session: Session):
+        with self._cond:
+            if self._closed.is_set() or session.state in (CLOSED, RECONNECTING):
+                return
+            session.state = RECONNECTING
+            self._cond.notify_all()
+        threading.Thread(target=self._reconnect, args=(session,), daemon=True).start()
+
+    def _reconnect(self, session: Session):
+        attempt = 0
+        while not self._closed.is_set():
+            delay = min(self.max_backoff, self.initial_backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+            if self._closed.wait(delay):
+                return
+            attempt += 1
+
+            try:
+                server_version = session.app.connect_ib(session.host, session.port, timeout=self.connect_timeout,
+                                                        client_id=session.client_id)
+            except ConnectionError as e:
+                session.last_error = e.message
+                self.metrics.inc("ib_connect_failures_total", client_id=session.client_id)
+                server_version = None
+
+            if server_version is not None and session.app.connected:
+                session.reconnects += 1
+                session.last_error = None
+                self.metrics.inc("ib_reconnects_total", client_id=session.client_id)
+                self._set_state(session, CONNECTED)
+
+                # a drop right after the handshake was ignored while we were still reconnecting, so check again
+                if session.app.connected:
+                    return
+                self._set_state(session, RECONNECTING)
+                attempt = 0
+                continue
+
+            if self.max_attempts is not None and attempt >= self.max_attempts:
+                session.last_error = f"Gave up reconnecting after {attempt} attempts"
+                self.metrics.inc("ib_session_failures_total", client_id=session.client_id)
+                self._set_state(session, FAILED)
+                return
+
+    def _pick(self, wait: bool = True) -> Optional[Session]:
+        """
+        The connected session with the fewest outstanding requests; waits up to wait_timeout for one to be up, or
+        with wait=False returns None straight away if none is
+        """
+
+        with self._cond:
+            if self._closed.is_set():
+                raise ConnectionError(_func="_pick", _file="connection_pool", message="Connection pool is closed")
+            if not wait and not any(s.usable() for s in self.sessions):
+                return None
+            if not self._cond.wait_for(lambda: self._closed.is_set() or any(s.usable() for s in self.sessions),
+                                       timeout=self.wait_timeout):
+                raise ConnectionError(_func="_pick", _file="connection_pool",
+                                      message=f"No session connected within {self.wait_timeout}s")
+            if self._closed.is_set():
+                raise ConnectionError(_func="_pick", _file="connection_pool", message="Connection pool is closed")
+
+            session = min((s for s in self.sessions if s.usable()), key=lambda s: s.outstanding)
+            session.outstanding += 1
+            return session
+
+    def _release(self, session: Session):
+        with self._cond:
+            session.outstanding -= 1
+
+    def close(self):
+        """ Disconnects every session; anything still outstanding fails with a ConnectionError """
+
+        self._closed.set()
+        with self._cond:
+            for session in self.sessions:
+                session.state = CLOSED
+            self._cond.notify_all()
+
+        for session in self.sessions:
+            try:
+                session.app.disconnect_ib()
+            except ConnectionError:
+                pass
+
+        for pending in list(self._pending.values()):
+            self._finish(pending, error=ConnectionError(_func="close", _file="connection_pool",
+                                                        message=f"Connection pool closed with reqId {pending.reqId} outstanding"))
+
+    def status(self) -> List[Dict]:
+        return [{"client_id": s.client_id, "host": s.host, "port": s.port, "state": s.state,
+                 "outstanding": s.outstanding, "reconnects": s.reconnects, "last_error": s.last_error}
+                for s in self.sessions]
+
+    # ---- historical data ----
+
+    def next_request_id(self) -> int:
+        with self._req_id_lock:
+            return next(self._req_id_counter)
+
+    def create_equity_contract(self, symbol: str) -> Contract:
+        return self.sessions[0].app.create_equity_contract(symbol)
+
+    def create_option_contract(self, symbol: str, expiry: str, strike: float, right: str, trading_class: str = "",
+                               multiplier: str = "100") -> Contract:
+        return self.sessions[0].app.create_option_contract(symbol, expiry, strike, right, trading_class, multiplier)
+
+    def request_historical_data(self, reqId: int, contract: Contract, whatToShow: str,
+                                durationStr: str = "3 D", barSizeSetting: str = "1 min") -> Future:
+        """ IBApp.request_historical_data on the least busy session; the future survives a dropped connection """
+        return self._submit(reqId, "request_historical_data", (contract, whatToShow, durationStr, barSizeSetting))
+
+    def request_historical_frame(self, reqId: int, contract: Contract, whatToShow: str,
+                                 durationStr: str = "3 D", barSizeSetting: str = "1 min") -> Future:
+        """ IBApp.request_historical_frame on the least busy session; the future survives a dropped connection """
+        return self._submit(reqId, "request_historical_frame", (contract, whatToShow, durationStr, barSizeSetting))
+
+    def get_historical_data(self, reqId: int, contract: Contract, whatToShow: str, timeout: float = 15,
+                            durationStr: str = "3 D", barSizeSetting: str = "1 min"):
+        bars = self._result(reqId, self.request_historical_data(reqId, contract, whatToShow, durationStr, barSizeSetting), timeout)
+        if len(bars) == 0:
+            raise NoDataError(f"No Historical Data Recieved for reqId {reqId}")
+        return bars
+
+    def get_historical_frame(self, reqId: int, contract: Contract, whatToShow: str, timeout: float = 15,
+                             durationStr: str = "3 D", barSizeSetting: str = "1 min") -> pd.DataFrame:
+        return self._result(reqId, self.request_historical_frame(reqId, contract, whatToShow, durationStr, barSizeSetting), timeout)
+
+    # same generator as IBApp's; it only uses the request API above, so the batch is spread over every session
+    fetch_historical_batch = IBApp.fetch_historical_batch
+
+    def cancel_historical_data(self, reqId: int):
+        pending = self._pending.get(reqId)
+        if pending is None:
+            return
+        if pending.session is not None:
+            pending.session.app.cancel_historical_data(pending.session_req_id)
+        self._finish(pending, error=RequestCancelledError(f"Historical Data request {reqId} was cancelled"))
+
+    def _result(self, reqId: int, future: Future, timeout: float):
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            self.metrics.inc("ib_timeouts_total", kind="historical")
+            self.cancel_historical_data(reqId)
+            raise NoDataError(f"Timed out waiting for Historical Data for reqId {reqId}")
+
+    def _submit(self, reqId: int, method: str, args: tuple) -> Future:
+        pending = _Pending(reqId, method, args)
+        if reqId in self._pending:
+            raise ValueError(f"reqId {reqId} is already in use by an outstanding request")
+        self._pending[reqId] = pending
+
+        try:
+            self._send(pending)
+        except ConnectionError as e:
+            self._finish(pending, error=e)
+        return pending.future
+
+    def _send(self, pending: _Pending, session: Optional[Session] = None):
+        """
+        Sends a pending request on a session, picking one if none is given (blocks while that session's pacer holds it
+        back, like IBApp). A given session must already be counted as outstanding by _pick
+        """
+
+        session = session if session is not None else self._pick()
+        pending.session = session
+        pending.session_req_id = session.app.next_request_id()
+        try:
+            inner = getattr(session.app, pending.method)(pending.session_req_id, *pending.args)
+        except Exception:
+            self._release(session)
+            raise
+        inner.add_done_callback(lambda done: self._on_done(pending, session, done))
+
+    def _on_done(self, pending: _Pending, session: Session, done: Future):
+        self._release(session)
+        if pending.future.done() or pending.session is not session:
+            return      # cancelled or already moved to another session
+
+        if done.cancelled():
+            self._finish(pending, error=RequestCancelledError(f"Request {pending.reqId} was cancelled"))
+            return
+
+        error = done.exception()
+        if error is None:
+            self._finish(pending, result=done.result())
+        elif isinstance(error, ConnectionError) and pending.attempts < self.max_resubmits and not self._closed.is_set():
+            # the connection went away under the request; send it again once a session is up
+            pending.attempts += 1
+            pending.session = None
+            self.metrics.inc("ib_resubmits_total", kind=pending.method)
+            self._retry(lambda session: self._resend(pending, session), give_up=lambda: self._finish(
+                pending, error=ConnectionError(_func="_resend", _file="connection_pool",
+                                               message=f"No session connected within {self.wait_timeout}s to resend reqId {pending.reqId}")))
+        else:
+            self._finish(pending, error=error)
+
+    def _resend(self, pending: _Pending, session: Session):
+        if pending.future.done():
+            self._release(session)
+            return
+        try:
+            self._send(pending, session)
+        except ConnectionError as e:
+            self._finish(pending, error=e)
+
+    def _finish(self, pending: _Pending, result=None, error: Exception = None):
+        self._pending.pop(pending.reqId, None)
+        if pending.future.done():
+            return
+        if error is not None:
+            pending.future.set_exception(error)
+        else:
+            pending.future.set_result(result)
+
+    def _retry(self, send: Callable[[Session], None], give_up: Optional[Callable[[], None]] = None):
+        """
+        Queues send(session) for the dispatcher; give_up is called instead if no session is up within wait_timeout
+        (without one the retry waits for as long as it takes, which is what streams want)
+        """
+
+        deadline = time.monotonic() + self.wait_timeout if give_up is not None else math.inf
+        with self._cond:
+            self._retries.append((deadline, send, give_up))
+            self._cond.notify_all()
+
+    def _dispatch_retries(self):
+        """
+        Sends queued retries whenever a session is up. Nothing here waits on a session: with none up the retries stay
+        queued and the thread sleeps until a state change (a reconnect finishing) or new retry wakes it, so an outage
+        costs every queued retry the same wait instead of wait_timeout each, one after the other.
+        """
+
+        while not self._closed.is_set():
+            with self._cond:
+                # the timeout wakes the loop to expire retries that have waited longer than wait_timeout
+                self._cond.wait_for(lambda: self._closed.is_set() or
+                                    (self._retries and any(s.usable() for s in self.sessions)), timeout=0.5)
+                retries, self._retries = self._retries, []
+
+            waiting = []
+            for deadline, send, give_up in retries:
+                try:
+                    session = self._pick(wait=False)
+                except ConnectionError:
+                    session = None      # closed; close() fails whatever is still pending
+                if session is None:
+                    if time.monotonic() >= deadline:
+                        give_up()
+                    elif not self._closed.is_set():
+                        waiting.append((deadline, send, give_up))
+                    continue
+                try:
+                    send(session)
+                except Exception:
+                    self.metrics.inc("ib_retry_failures_total")
+
+            if waiting:
+                with self._cond:
+                    self._retries[:0] = waiting
+
+    # ---- snapshots, option chains and quotes ----
+
+    def request_snapshot(self, reqId: int, contract: Contract) -> Future:
+        """ IBApp.request_snapshot on the least busy session; the future survives a dropped connection """
+        return self._submit(reqId, "request_snapshot", (contract,))
+
+    def cancel_snapshot(self, reqId: int):
+        pending = self._pending.get(reqId)
+        if pending is None:
+            return
+        if pending.session is not None:
+            pending.session.app.cancel_snapshot(pending.session_req_id)
+        self._finish(pending, error=RequestCancelledError(f"Snapshot request {reqId} was cancelled"))
+
+    def _call(self, method: str, *args):
+        """ Runs a blocking IBApp call on a session, moving to another session if its connection drops mid call """
+
+        for attempt in range(self.max_resubmits + 1):
+            session = self._pick()
+            try:
+                return getattr(session.app, method)(*args)
+            except ConnectionError:
+                if attempt == self.max_resubmits or self._closed.is_set():
+                    raise
+                self.metrics.inc("ib_resubmits_total", kind=method)
+            finally:
+                self._release(session)
+
+    def get_option_chain(self, symbol: str, timeout: float = 15) -> OptionChain:
+        return self._call("get_option_chain", symbol, timeout)
+
+    def get_straddle_quotes(self, chain: OptionChain, expiry: str, strike: float, timeout: float = 15) -> Dict[str, float]:
+        return self._call("get_straddle_quotes", chain, expiry, strike, timeout)
+
+    # ---- streaming ----
+
+    def subscribe_market_data(self, contract: Contract, on_tick: Callable, genericTickList: str = "") -> int:
+        """
+        Streams market data for a contract on one of the sessions and returns the pool reqId of the subscription
+
+        on_tick(reqId, tickType, value) gets the pool reqId; if the session drops, the subscription is moved to
+        another session (or back to the same one once it reconnects)
+        """
+
+        reqId = self.next_request_id()
+        self._subscriptions[reqId] = [contract, on_tick, genericTickList, None, None]
+        self._subscribe(reqId)
+        return reqId
+
+    def _subscribe(self, reqId: int, session: Optional[Session] = None):
+        session = session if session is not None else self._pick()
+        self._release(session)      # streams are not counted as outstanding requests
+
+        subscription = self._subscriptions.get(reqId)
+        if subscription is None:
+            return
+        contract, on_tick, genericTickList = subscription[:3]
+
+        subscription[3] = session
+        subscription[4] = session.app.subscribe_market_data(contract, lambda _reqId, tickType, value: on_tick(reqId, tickType, value),
+                                                            genericTickList)
+
+    def _move_subscriptions(self, session: Session):
+        for reqId, subscription in list(self._subscriptions.items()):
+            if subscription[3] is not session:
+                continue
+            session.app.unsubscribe_market_data(subscription[4])
+            subscription[3] = None
+            self._retry(lambda session, reqId=reqId: self._subscribe(reqId, session))
+
+    def unsubscribe_market_data(self, reqId: int):
+        subscription = self._subscriptions.pop(reqId, None)
+        if subscription is None or subscription[3] is None:
+            return
+        subscription[3].app.unsubscribe_market_data(subscription[4])
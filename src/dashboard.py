@@ -1,18 +1,28 @@
 import tkinter as tk
-from tkinter import messagebox, ttk, scrolledtext
+from tkinter import filedialog, messagebox, ttk, scrolledtext
 
 from datetime import datetime
+from pathlib import Path
 
-import pandas as pd
 import numpy as np
 
+# ibapi, pandas and matplotlib are not imported here; they load the first time a connect, fetch or P/L map needs them
+# so the window comes up without waiting on them
 from src.exceptions import ConnectionError, NoDataError
-from src.ib_client import IBApp
-from src.utils import black_scholes_call, black_scholes_put, calculate_delta, calculate_gamma, calculate_theta, calculate_vega
+from src.option_chain import select_atm_straddle
+from src.implied_vol import chain_implied_volatility
+from src.monte_carlo import run_monte_carlo, NormalMove, LognormalCrush, implied_move_sd
+from src.streaming import TickCoalescer, mid_from_ticks, OPTION_IMPLIED_VOL
+from src.analysis import price_straddle, analyze_scenario as run_scenario, market_snapshot, pnl_map
+from src.workers import TkExecutor
+from src.metrics import METRICS, Profiler
 
 import warnings
 warnings.filterwarnings('ignore')
 
+# where the Profile button saves its reports
+PROFILE_DIR = Path.home() / ".cache" / "iv_crush" / "profiles"
+
 
 class IVCrushAnalyzer():
 
@@ -21,13 +31,40 @@ class IVCrushAnalyzer():
         self.root = root
         self.root.title("Volatility Crush Trade Analyzer")
         self.root.geometry("1200x800")
-        self.ib_app = IBApp()
+        self.ib_app = None                  # created on the first connect
         self.connected = False
 
         # Market data values
         self.current_spot_price = None
         self.current_iv = None
         self.ticker = None
+        self.fetch_req_ids = ()
+        self.selected_straddle = None       # (chain, expiry, strike) picked from the option chain
+
+        # streaming state; ticks from the reader thread are coalesced and the panels repriced at stream_refresh_ms
+        self.stream_ids = {}
+        self.stream_ticks = {}
+        self.tick_coalescer = TickCoalescer()
+        self.stream_refresh_ms = 100        # 10 Hz
+        self.stream_after_id = None
+
+        # slider driven scenarios are coalesced into at most one reprice per scenario_debounce_ms
+        self.scenario_debounce_ms = 30
+        self.scenario_after_id = None
+        self.syncing_sliders = False
+
+        # status lines are buffered and written to the log widget at most once per log_flush_ms
+        self.log_lines = []
+        self.log_flush_ms = 100
+        self.log_after_id = None
+        self.profiler = Profiler()
+
+        # at most one p/l map is built at a time; a request made while one is running waits in pnl_map_next (newest
+        # wins). Streaming reprices only rebuild the map once the strike or dte changes or IV moves pnl_map_iv_step
+        self.pnl_map_task = None
+        self.pnl_map_next = None
+        self.pnl_map_inputs = None
+        self.pnl_map_iv_step = 0.01
 
         # Option Parameters
         self.risk_free_rate = 0.05
@@ -35,6 +72,10 @@ class IVCrushAnalyzer():
 
         self.setup_ui()
 
+        # IB requests run on worker threads and post their results back to the Tk event loop
+        self.executor = TkExecutor(self.root, on_progress=self.update_progress)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
     def setup_ui(self):
         
         # Configure the mainframe
@@ -72,7 +113,8 @@ class IVCrushAnalyzer():
         self.setup_scenario_section(right_frame, row=0)         # Scenario analysis widget
         self.setup_pnl_section(right_frame, row=1)              # PnL widget
         self.setup_new_greeks_section(right_frame, row=2)       # New greeks widget
-        # Add some more functionality here for time decay and term slopes and stuff
+        self.setup_heatmap_section(right_frame, row=3)          # PnL heatmap widget
+        # Add some more functionality here for term slopes and stuff
 
 
     def setup_connection_section(self, parent_frame, row):
@@ -161,8 +203,23 @@ class IVCrushAnalyzer():
         ttk.Entry(market_frame, textvariable=self.days_to_expiry_var, width=15, font=("Arial", 10, "bold")).grid(
             row=4, column=1, sticky=(tk.E, tk.W), pady=(0,8))
         
-        self.price_straddle_btn = ttk.Button(market_frame, text="Price Straddle", command=self.price_current_straddle, state="disabled")
-        self.price_straddle_btn.grid(row=5, column=0, columnspan=2, pady=(10, 0))
+        # earnings/event date row; used to pick the first expiry after the event when selecting the ATM straddle
+        ttk.Label(market_frame, text="Event Date:").grid(row=5, column=0, 
+                                                         padx=(0,10), pady=(0,8), 
+                                                         sticky=(tk.W))
+        self.event_date_var = tk.StringVar()
+        ttk.Entry(market_frame, textvariable=self.event_date_var, width=15, font=("Arial", 10, "bold")).grid(
+            row=5, column=1, sticky=(tk.E, tk.W), pady=(0,8))
+        
+        # buttons for pricing once and for live repricing off streaming data
+        pricing_btn_frame = ttk.Frame(market_frame)
+        pricing_btn_frame.grid(row=6, column=0, columnspan=2, pady=(10, 0))
+
+        self.price_straddle_btn = ttk.Button(pricing_btn_frame, text="Price Straddle", command=self.price_current_straddle, state="disabled")
+        self.price_straddle_btn.pack(side=tk.LEFT, padx=(0, 10))
+
+        self.stream_btn = ttk.Button(pricing_btn_frame, text="Start Streaming", command=self.toggle_stream, state="disabled")
+        self.stream_btn.pack(side=tk.LEFT)
 
 
     def setup_current_straddle_section(self, parent_frame, row):
@@ -221,7 +278,23 @@ class IVCrushAnalyzer():
         status_frame = ttk.LabelFrame(parent_frame, text="Status", padding="5")
         status_frame.grid(row=row, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
         self.status_text = scrolledtext.ScrolledText(status_frame, height=6, width=40)
-        self.status_text.grid(row=0, column=0, sticky=(tk.E, tk.W))
+        self.status_text.grid(row=0, column=0, columnspan=2, sticky=(tk.E, tk.W))
+
+        # progress row for background work (IB requests) along with a button to cancel it
+        self.progress_label = ttk.Label(status_frame, text="Idle")
+        self.progress_label.grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+        self.progress_bar = ttk.Progressbar(status_frame, mode="indeterminate", length=120)
+        self.progress_bar.grid(row=1, column=1, sticky=tk.E, pady=(5, 0))
+        self.cancel_btn = ttk.Button(status_frame, text="Cancel", command=self.cancel_tasks, state="disabled")
+        self.cancel_btn.grid(row=2, column=1, sticky=tk.E, pady=(5, 0))
+
+        # request latency / throughput / pricing timings recorded in src.metrics, plus a profiler for the main thread
+        metrics_frame = ttk.Frame(status_frame)
+        metrics_frame.grid(row=2, column=0, sticky=tk.W, pady=(5, 0))
+        ttk.Button(metrics_frame, text="Metrics", command=self.show_metrics).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(metrics_frame, text="Export...", command=self.export_metrics).grid(row=0, column=1, padx=(0, 5))
+        self.profile_btn = ttk.Button(metrics_frame, text="Profile", command=self.toggle_profiler)
+        self.profile_btn.grid(row=0, column=2)
 
         # Configure the frame to expand with window 
         status_frame.columnconfigure(0, weight=1)
@@ -230,21 +303,44 @@ class IVCrushAnalyzer():
     def setup_scenario_section(self, parent_frame, row):
         scenario_frame = ttk.LabelFrame(parent_frame, text="Scenario Analysis", padding="10")
         scenario_frame.grid(row=row, column=0, sticky=(tk.W, tk.E), pady=(0, 15))
-        scenario_frame.columnconfigure(1, weight=1)
+        scenario_frame.columnconfigure(2, weight=1)
         
         # new spot price (where you think price might be in the future for testing purposes)
         ttk.Label(scenario_frame, text="New Spot Price:").grid(row=0, column=0, padx=(0, 10), pady=(0, 8), sticky=tk.W)
         self.new_spot_var = tk.StringVar()
-        ttk.Entry(scenario_frame, textvariable=self.new_spot_var, width=15, font=("Arial", 10, "bold")).grid(row=0, column=1, sticky=(tk.W, tk.E), pady=(0, 8))
+        ttk.Entry(scenario_frame, textvariable=self.new_spot_var, width=10, font=("Arial", 10, "bold")).grid(row=0, column=1, sticky=(tk.W, tk.E), pady=(0, 8))
         
         # new IV in percentage (where you think the change in IV will be)
         ttk.Label(scenario_frame, text="New IV (%):").grid(row=1, column=0, padx=(0, 10), pady=(0, 8), sticky=tk.W)
         self.new_iv_var = tk.StringVar()
-        ttk.Entry(scenario_frame, textvariable=self.new_iv_var, width=15, font=("Arial", 10, "bold")).grid(row=1, column=1, sticky=(tk.W, tk.E), pady=(0, 8))
+        ttk.Entry(scenario_frame, textvariable=self.new_iv_var, width=10, font=("Arial", 10, "bold")).grid(row=1, column=1, sticky=(tk.W, tk.E), pady=(0, 8))
+
+        # days to expiry left at the scenario; blank means the same as the straddle's days to expiry
+        ttk.Label(scenario_frame, text="Scenario DTE:").grid(row=2, column=0, padx=(0, 10), pady=(0, 8), sticky=tk.W)
+        self.new_dte_var = tk.StringVar()
+        ttk.Entry(scenario_frame, textvariable=self.new_dte_var, width=10, font=("Arial", 10, "bold")).grid(row=2, column=1, sticky=(tk.W, tk.E), pady=(0, 8))
+
+        # sliders next to each input reprice the scenario live while they are dragged (ranges are set once a straddle is priced)
+        self.new_spot_scale = ttk.Scale(scenario_frame, orient=tk.HORIZONTAL, from_=0, to=1,
+                                        command=lambda value: self.on_scenario_slider(self.new_spot_var, f"{float(value): .2f}"))
+        self.new_iv_scale = ttk.Scale(scenario_frame, orient=tk.HORIZONTAL, from_=0, to=1,
+                                      command=lambda value: self.on_scenario_slider(self.new_iv_var, f"{float(value): .2f}"))
+        self.new_dte_scale = ttk.Scale(scenario_frame, orient=tk.HORIZONTAL, from_=0, to=1,
+                                       command=lambda value: self.on_scenario_slider(self.new_dte_var, str(round(float(value)))))
+        self.scenario_scales = (self.new_spot_scale, self.new_iv_scale, self.new_dte_scale)
+        for i, scale in enumerate(self.scenario_scales):
+            scale.grid(row=i, column=2, sticky=(tk.W, tk.E), padx=(10, 0), pady=(0, 8))
+            scale.state(["disabled"])
         
-        # button for analyzing the new scenario
-        self.analyze_btn = ttk.Button(scenario_frame, text="Analyze Scenario", command=self.analyze_scenario, state="disabled")
-        self.analyze_btn.grid(row=2, column=0, columnspan=2, pady=(10, 0))
+        # buttons for analyzing the new scenario and for simulating a distribution of scenarios around it
+        scenario_btn_frame = ttk.Frame(scenario_frame)
+        scenario_btn_frame.grid(row=3, column=0, columnspan=3, pady=(10, 0))
+
+        self.analyze_btn = ttk.Button(scenario_btn_frame, text="Analyze Scenario", command=self.analyze_scenario, state="disabled")
+        self.analyze_btn.pack(side=tk.LEFT, padx=(0, 10))
+
+        self.monte_carlo_btn = ttk.Button(scenario_btn_frame, text="Monte Carlo", command=self.run_monte_carlo, state="disabled")
+        self.monte_carlo_btn.pack(side=tk.LEFT)
         
 
     def setup_pnl_section(self, parent, row):
@@ -296,43 +392,163 @@ class IVCrushAnalyzer():
         self.new_theta_label.grid(row=1, column=3, pady=(0, 5), sticky=tk.W)
 
 
+    def setup_heatmap_section(self, parent_frame, row):
+        """ PnL across spot and IV for the priced straddle, with a slider to step through the days to expiry """
+
+        heatmap_frame = ttk.LabelFrame(parent_frame, text="P/L Map", padding="10")
+        heatmap_frame.grid(row=row, column=0, sticky=(tk.W, tk.E), pady=(0, 15))
+        heatmap_frame.columnconfigure(1, weight=1)
+
+        # the plot itself (and matplotlib) is only created when the first grid comes back
+        self.heatmap = None
+        self.heatmap_frame = heatmap_frame
+        self.heatmap_placeholder = ttk.Label(heatmap_frame, text="Price a straddle to see its P/L map", foreground="gray")
+        self.heatmap_placeholder.grid(row=0, column=0, columnspan=4, pady=(10, 10))
+
+        # dragging the slider only swaps the slice being shown, the grid is computed once per priced straddle
+        ttk.Label(heatmap_frame, text="Days to Expiry:").grid(row=1, column=0, padx=(0, 10), pady=(8, 0), sticky=tk.W)
+        self.heatmap_dte_scale = ttk.Scale(heatmap_frame, from_=0, to=0, orient=tk.HORIZONTAL, command=self.on_heatmap_dte)
+        self.heatmap_dte_scale.grid(row=1, column=1, sticky=(tk.W, tk.E), pady=(8, 0))
+        self.heatmap_dte_label = ttk.Label(heatmap_frame, text="-", width=4, font=("Arial", 10, "bold"))
+        self.heatmap_dte_label.grid(row=1, column=2, padx=(5, 10), pady=(8, 0), sticky=tk.W)
+
+        self.heatmap_side_var = tk.StringVar(value="Short")
+        side_box = ttk.Combobox(heatmap_frame, textvariable=self.heatmap_side_var, values=("Short", "Long"), width=6, state="readonly")
+        side_box.grid(row=1, column=3, pady=(8, 0), sticky=tk.E)
+        side_box.bind("<<ComboboxSelected>>", self.on_heatmap_side)
+
+
     def log_message(self, message):
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.status_text.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.status_text.see(tk.END)
+        self.log_lines.append(f"[{timestamp}] {message}\n")
+
+        # a burst of messages (eg. a batch of requests finishing) becomes one insert and one redraw
+        if self.log_after_id is None:
+            self.log_after_id = self.root.after(self.log_flush_ms, self.flush_log)
+
+    def flush_log(self):
+        self.log_after_id = None
+        lines, self.log_lines = self.log_lines, []
+        if lines:
+            self.status_text.insert(tk.END, "".join(lines))
+            self.status_text.see(tk.END)
+
+    def show_metrics(self):
+        for line in METRICS.summary().splitlines():
+            self.log_message(line)
+
+    def export_metrics(self):
+        path = filedialog.asksaveasfilename(title="Export metrics", defaultextension=".json",
+                                            filetypes=[("JSON", "*.json"), ("Prometheus text", "*.prom"), ("All files", "*.*")])
+        if not path:
+            return
 
-        # Update the UI immediately after a change in the status text area
-        self.root.update_idletasks()
+        text = METRICS.to_prometheus() if path.endswith((".prom", ".txt")) else METRICS.to_json()
+        try:
+            with open(path, "w") as f:
+                f.write(text)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not write {path}: {e}")
+            return
+        self.log_message(f"Metrics written to {path}")
 
+    def toggle_profiler(self):
+        """ Profiles everything the main thread runs (callbacks, pricing, redraws) until pressed again """
 
-    def connect_ib(self):   
+        report = self.profiler.toggle()
+        if report is None:
+            self.profile_btn.config(text="Stop Profile")
+            self.log_message("Profiling the main thread...")
+            return
+
+        self.profile_btn.config(text="Profile")
+
+        # the report is too long for the status log, so it goes to a file and the log says where
+        path = PROFILE_DIR / f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
         try:
-            host = self.host_var.get()
-            port = self.port_var.get()
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            path.write_text(report)
+        except OSError as e:
+            self.log_message(f"Could not write {path} ({e}); profile follows")
+            for line in report.splitlines():
+                self.log_message(line)
+            return
+        self.log_message(f"Profile written to {path} (top functions by cumulative time)")
 
-            self.log_message("Connecting to IB...")
 
-            server_version = self.ib_app.connect_ib(host, port)
+    def update_progress(self, pending):
+        """ Called by the executor on the main thread whenever the set of running background tasks changes """
 
-            if self.ib_app.connected:
-                self.connected = True
-                self.connect_btn.config(state="disabled")
-                self.disconnect_btn.config(state="normal")
-                self.status_label.config(text="● Connected", foreground="green")
-                self.fetch_data_btn.config(state="normal")
-                self.price_straddle_btn.config(state="normal")
+        if pending:
+            self.progress_label.config(text=f"Working: {', '.join(pending)}")
+            self.progress_bar.start(10)
+            self.cancel_btn.config(state="normal")
+        else:
+            self.progress_label.config(text="Idle")
+            self.progress_bar.stop()
+            self.cancel_btn.config(state="disabled")
 
-                # Log successful connection
-                self.log_message(f"Successfully connected to IB (Server: {server_version})")
-            else:
-                self.log_message("Failed to Connect to IB TWS")
+    def cancel_tasks(self):
+        self.executor.cancel_all()
+        self.log_message("Cancelled pending requests")
 
-        except ConnectionError as e:
-            self.log_message(e.message)
+    def on_close(self):
+        self.stop_stream()
+        self.executor.shutdown()
+        self.root.destroy()
+
+    def create_ib_app(self):
+        """ Imports the IB client (and with it ibapi) and builds the app; runs on the worker that makes the first connection """
+
+        from src.ib_client import IBApp
+        from src.bar_cache import BarCache
+        return IBApp(bar_cache=BarCache())
+
+    def connect_ib(self):   
+        host = self.host_var.get()
+        port = self.port_var.get()
+
+        self.log_message("Connecting to IB...")
+        self.connect_btn.config(state="disabled")
+
+        def connect():
+            if self.ib_app is None:
+                self.ib_app = self.create_ib_app()
+            return self.ib_app.connect_ib(host, port)
+
+        # connecting can block for up to the connection timeout so we do it on a worker
+        self.executor.submit(connect,
+                             on_success=self.on_connected, on_error=self.on_connect_error,
+                             on_cancel=lambda: self.connect_btn.config(state="normal"),
+                             description="connect")
+
+    def on_connected(self, server_version):
+        if self.ib_app.connected:
+            self.connected = True
+            self.connect_btn.config(state="disabled")
+            self.disconnect_btn.config(state="normal")
+            self.status_label.config(text="● Connected", foreground="green")
+            self.fetch_data_btn.config(state="normal")
+            self.price_straddle_btn.config(state="normal")
+            self.stream_btn.config(state="normal")
+
+            # Log successful connection
+            self.log_message(f"Successfully connected to IB (Server: {server_version})")
+        else:
+            self.connect_btn.config(state="normal")
+            self.log_message("Failed to Connect to IB TWS")
+
+    def on_connect_error(self, e):
+        self.connect_btn.config(state="normal")
+        self.log_message(getattr(e, "message", str(e)))
 
     def disconnect_ib(self):
         
         try:
+            # drop anything still waiting on the connection
+            self.executor.cancel_all()
+            self.stop_stream()
+
             # disconnect
             self.ib_app.disconnect_ib()
             self.connected = False
@@ -342,7 +558,9 @@ class IVCrushAnalyzer():
             self.connect_btn.config(state="normal")
             self.fetch_data_btn.config(state="disabled")
             self.price_straddle_btn.config(state="disabled")
+            self.stream_btn.config(state="disabled")
             self.analyze_btn.config(state="disabled")
+            self.monte_carlo_btn.config(state="disabled")
 
             # reset labels
             self.status_label.config(text="● Disconnected", foreground="red")
@@ -368,6 +586,16 @@ class IVCrushAnalyzer():
         self.iv_var.set("")
         self.new_spot_var.set("")
         self.new_iv_var.set("")
+        self.new_dte_var.set("")
+        for scale in self.scenario_scales:
+            scale.state(["disabled"])
+        if self.scenario_after_id is not None:
+            self.root.after_cancel(self.scenario_after_id)
+            self.scenario_after_id = None
+        if self.heatmap is not None:
+            self.heatmap.clear()
+        self.heatmap_dte_scale.config(to=0)
+        self.heatmap_dte_label.config(text="-")
 
         # reset all of these display labels
         labels_to_reset = [
@@ -390,58 +618,207 @@ class IVCrushAnalyzer():
     def fetch_market_data(self):
         if not self.connected:
             messagebox.showerror("Error", "Not Connected to IB TWS")
+            return
 
         ticker = self.ticker_var.get()
         self.log_message(f"Fetching Historical Data for {ticker}")
 
-        # clear any historical data from previous queries
-        self.ib_app.historical_data.clear()
+        # create a contract to query hist data
+        contract = self.ib_app.create_equity_contract(symbol=ticker)
+
+        # every request gets its own reqId so a new fetch never collides with one that is still in flight
+        self.fetch_req_ids = (self.ib_app.next_request_id(), self.ib_app.next_request_id())
+
+        # both requests run concurrently on workers so the GUI stays responsive while IB responds
+        self.fetch_data_btn.config(state="disabled")
+        self.executor.gather(
+            [(self.load_bars, self.fetch_req_ids[0], contract, "TRADES"),
+             (self.load_bars, self.fetch_req_ids[1], contract, "OPTION_IMPLIED_VOLATILITY")],
+            on_success=self.on_market_data,
+            on_error=self.on_market_data_error,
+            on_cancel=self.on_market_data_cancel,
+            description=f"fetch {ticker.upper()}",
+        )
+
+    def load_bars(self, reqId, contract, whatToShow):
+        """ Runs on a worker thread: returns a df of historical bars indexed by date (topped up from the bar cache) """
+        return self.ib_app.get_historical_frame(reqId=reqId, contract=contract, whatToShow=whatToShow)
+
+    def on_market_data(self, results):
+        self.fetch_data_btn.config(state="normal")
+        self.equity_df, self.option_df = results
+        self.log_message(f"Historical Data has been recieved for reqIDs {self.fetch_req_ids[0]}, {self.fetch_req_ids[1]}")
+
+        # the latest bars give the current spot price of the equity and its IV
+        snapshot = market_snapshot(self.equity_df, self.option_df, self.vol_annualization)
+        self.current_spot_price = snapshot["spot"]
+        self.current_iv = snapshot["iv"]
+        self.log_message(f"Latest closing price: ${self.current_spot_price:.2f} from {snapshot['spot_time']}")
+        self.log_message(f"Latest IV: {self.current_iv: .4f} from {snapshot['iv_time']}")
+
+        # update the input fields
+        self.spot_price_var.set(f"{self.current_spot_price: .2f}")
+        self.strike_price_var.set(f"{self.current_spot_price: .2f}")        # default to the spot price until the chain lookup picks the listed ATM strike
+        self.iv_var.set(f"{self.current_iv*100: .2f}")                      # Convert to percentage
+
+        # look up the option chain and pick the ATM straddle for the first expiry after the event
+        try:
+            event_date = self.parse_event_date()
+        except ValueError:
+            messagebox.showerror("Error", "Event date must be in YYYY-MM-DD format")
+            return
+
+        ticker = self.ticker_var.get()
+        self.executor.submit(self.select_straddle, ticker, self.current_spot_price, event_date,
+                             on_success=self.on_straddle_selected, on_error=self.on_straddle_select_error,
+                             description=f"option chain {ticker.upper()}")
+
+    def parse_event_date(self):
+        text = self.event_date_var.get().strip()
+        if not text:
+            return None
+        return datetime.strptime(text, "%Y-%m-%d").date()
+
+    def select_straddle(self, ticker, spot_price, event_date):
+        """ Runs on a worker thread: picks the ATM straddle from the option chain and snapshots its market price """
 
-        # fetch new historical data
+        chain = self.ib_app.get_option_chain(ticker)
+        expiry, strike, days_to_expiry = select_atm_straddle(chain, spot_price, event_date)
+
+        # quotes need a market data subscription; without them we still have the selected straddle
         try:
-            # create a contract to query hist data
-            contract = self.ib_app.create_equity_contract(symbol=ticker)
-
-            # recieve data
-            market_data = self.ib_app.get_historical_data(reqId=99, contract=contract, whatToShow="TRADES")
-            self.log_message(f"Historical Data has been recieved for reqID {99}")
-
-            option_data = self.ib_app.get_historical_data(reqId=100, contract=contract, whatToShow="OPTION_IMPLIED_VOLATILITY")
-            self.log_message(f"Historical Data has been recieved for reqID {100}")
-
-            # make a df with data and organize it properly
-            self.equity_df = pd.DataFrame(market_data)
-            self.equity_df['date'] = pd.to_datetime(self.equity_df['date'])
-            self.equity_df.set_index('date', inplace=True)
-
-            # fetch the latest bar to get the current spot price of the equity
-            latest_bar = self.equity_df.iloc[-1]
-            self.current_spot_price = latest_bar['close']
-            self.log_message(f"Latest closing price: ${self.current_spot_price:.2f} from {latest_bar.index}")
-
-            # make a df with all options data
-            self.option_df = pd.DataFrame(option_data)
-            self.option_df['date'] = pd.to_datetime(self.option_df['date'])
-            self.option_df.set_index('date', inplace=True)
-
-            # fetch the latest IV
-            latest_iv_bar = self.option_df.iloc[-1]
-            self.current_iv = latest_iv_bar['close']
-            self.current_iv = self.current_iv * np.sqrt(self.vol_annualization)
-            self.log_message(f"Latest IV: {self.current_iv: .4f} from {latest_iv_bar.index}")
-
-            # update the input fields
-            self.spot_price_var.set(f"{self.current_spot_price: .2f}")
-            self.strike_price_var.set(f"{self.current_spot_price: .2f}")        # Will need to manually set this from looking at option chains; for now default to ATM spot price
-            self.iv_var.set(f"{self.current_iv*100: .2f}")                      # Convert to percentage
-
-            # calculate the straddle price
+            quotes = self.ib_app.get_straddle_quotes(chain, expiry, strike)
+        except NoDataError:
+            quotes = None
+
+        return chain, expiry, strike, days_to_expiry, quotes
+
+    def on_straddle_selected(self, selection):
+        chain, expiry, strike, days_to_expiry, quotes = selection
+        self.selected_straddle = (chain, expiry, strike)
+
+        self.strike_price_var.set(f"{strike: .2f}")
+        self.days_to_expiry_var.set(str(days_to_expiry))
+        self.log_message(f"Selected ATM straddle: {expiry} {strike:.2f} ({days_to_expiry} DTE)")
+
+        # back the IV out of the quoted straddle so we price off the actual chain rather than the index level IV
+        if quotes is not None and np.isfinite(quotes["call"]) and np.isfinite(quotes["put"]):
+            T = max(days_to_expiry, 1) / 365.0
+            call_iv, put_iv = chain_implied_volatility(quotes["call"], quotes["put"], self.current_spot_price, strike, T, self.risk_free_rate)
+            ivs = [float(iv) for iv in (call_iv, put_iv) if np.isfinite(iv)]
+            self.log_message(f"Market straddle: ${quotes['call'] + quotes['put']:.2f} (call ${quotes['call']:.2f}, put ${quotes['put']:.2f})")
+            if ivs:
+                self.iv_var.set(f"{np.mean(ivs)*100: .2f}")
+
+        # calculate the straddle price
+        self.price_current_straddle()
+
+    def on_straddle_select_error(self, e):
+        self.log_message(f"Could not select the ATM straddle: {getattr(e, 'message', str(e))}")
+
+        # fall back to the manually entered strike and days to expiry if there are any
+        if self.days_to_expiry_var.get().strip():
             self.price_current_straddle()
 
-        except NoDataError as e:
-            self.log_message(e.message)
+    def on_market_data_cancel(self):
+        # stop IB from streaming bars for requests nobody is waiting on anymore
+        for reqId in self.fetch_req_ids:
+            self.ib_app.cancel_historical_data(reqId)
+        self.fetch_data_btn.config(state="normal" if self.connected else "disabled")
+
+    def on_market_data_error(self, e):
+        self.fetch_data_btn.config(state="normal" if self.connected else "disabled")
+        self.log_message(getattr(e, "message", str(e)))
+
+    def toggle_stream(self):
+        if self.stream_ids:
+            self.stop_stream()
+            self.log_message("Stopped streaming")
+        else:
+            self.start_stream()
+
+    def start_stream(self):
+        if not self.connected:
+            messagebox.showerror("Error", "Not Connected to IB TWS")
+            return
+
+        ticker = self.ticker_var.get().upper()
+        put_tick = self.tick_coalescer.put
+        on_tick = lambda reqId, tickType, value: put_tick((reqId, tickType), value)
+
+        # underlying with generic tick 106 for its implied vol, plus the straddle legs if one was selected for this ticker
+        self.stream_ids = {"spot": self.ib_app.subscribe_market_data(self.ib_app.create_equity_contract(ticker), on_tick, "106")}
+        if self.selected_straddle is not None and self.selected_straddle[0].symbol == ticker:
+            chain, expiry, strike = self.selected_straddle
+            for right, leg in (("C", "call"), ("P", "put")):
+                contract = self.ib_app.create_option_contract(ticker, expiry, strike, right, chain.trading_class, chain.multiplier)
+                self.stream_ids[leg] = self.ib_app.subscribe_market_data(contract, on_tick)
+
+        self.stream_ticks = {reqId: {} for reqId in self.stream_ids.values()}
+        self.stream_btn.config(text="Stop Streaming")
+        self.log_message(f"Streaming {ticker} ({', '.join(self.stream_ids)})")
+        self.stream_after_id = self.root.after(self.stream_refresh_ms, self.refresh_stream)
+
+    def stop_stream(self):
+        for reqId in self.stream_ids.values():
+            self.ib_app.unsubscribe_market_data(reqId)
+        self.stream_ids = {}
+        self.tick_coalescer.drain()
+
+        if self.stream_after_id is not None:
+            self.root.after_cancel(self.stream_after_id)
+            self.stream_after_id = None
+        self.stream_btn.config(text="Start Streaming")
+
+    def refresh_stream(self):
+        """ Runs at the stream refresh rate: applies the latest coalesced ticks and reprices the straddle once """
+
+        self.stream_after_id = None
+        if not self.stream_ids:
+            return
+
+        latest = self.tick_coalescer.drain()
+        for (reqId, tickType), value in latest.items():
+            if reqId in self.stream_ticks:
+                self.stream_ticks[reqId][tickType] = value
+
+        if latest:
+            self.apply_stream_ticks()
+
+        self.stream_after_id = self.root.after(self.stream_refresh_ms, self.refresh_stream)
+
+    def apply_stream_ticks(self):
+        spot_ticks = self.stream_ticks[self.stream_ids["spot"]]
+        spot = mid_from_ticks(spot_ticks)
+        if spot is None:
+            return
+        self.spot_price_var.set(f"{spot: .2f}")
+
+        try:
+            strike = float(self.strike_price_var.get())
+            days_to_expiry = int(self.days_to_expiry_var.get())
+        except ValueError:
+            return      # nothing to reprice until the straddle is set up
+
+        # the IV of the quoted straddle legs is the best estimate; otherwise use the underlying's implied vol tick
+        iv = None
+        if "call" in self.stream_ids:
+            call = mid_from_ticks(self.stream_ticks[self.stream_ids["call"]])
+            put = mid_from_ticks(self.stream_ticks[self.stream_ids["put"]])
+            if call is not None and put is not None:
+                T = max(days_to_expiry, 1) / 365.0
+                ivs = [float(v) for v in chain_implied_volatility(call, put, spot, strike, T, self.risk_free_rate) if np.isfinite(v)]
+                iv = np.mean(ivs) if ivs else None
+        if iv is None and spot_ticks.get(OPTION_IMPLIED_VOL, -1) > 0:
+            iv = spot_ticks[OPTION_IMPLIED_VOL]
+        if iv is not None:
+            self.iv_var.set(f"{iv*100: .2f}")
+        elif not self.iv_var.get().strip():
+            return
+
+        self.price_current_straddle(rebuild_map=False)
 
-    def price_current_straddle(self):
+    def price_current_straddle(self, rebuild_map=True):
 
         # get all variables needed to calc straddle price; we retrieve them from the input fields incase any have changed at all
         try:
@@ -455,21 +832,16 @@ class IVCrushAnalyzer():
         
         iv_decimal = iv_percent/100
 
-        T = days_to_expiry/365.0
-        r = self.risk_free_rate
-
-        # calculate prices using black scholes
-        call_price = black_scholes_call(spot_price, strike_price, T, r, iv_decimal)
-        put_price = black_scholes_put(spot_price, strike_price, T, r, iv_decimal)
-        straddle_price = call_price + put_price
-
-        # calculate the greeks
-        gamma = calculate_gamma(spot_price, strike_price, T, r, iv_decimal)
-        vega = calculate_vega(spot_price, strike_price, T, r, iv_decimal) * 2  # call + put vega for straddle
-
-        # delta and theta exposures are the sum of the exposure of the call contract and the put contract for a straddle
-        delta = calculate_delta(spot_price, strike_price, T, r, iv_decimal, 'call') + calculate_delta(spot_price, strike_price, T, r, iv_decimal, 'put')        
-        theta = calculate_theta(spot_price, strike_price, T, r, iv_decimal, 'call') + calculate_theta(spot_price, strike_price, T, r, iv_decimal, 'put')
+        # calculate prices and greeks using black scholes in one pass
+        # greek exposures are the sum of the exposure of the call contract and the put contract for a straddle
+        straddle = price_straddle(spot_price, strike_price, iv_decimal, days_to_expiry, self.risk_free_rate)
+        call_price = straddle["call"]
+        put_price = straddle["put"]
+        straddle_price = straddle["straddle"]
+        delta = straddle["delta"]
+        gamma = straddle["gamma"]
+        vega = straddle["vega"]
+        theta = straddle["theta"]
         
         # update the pricing displays and the greeks displays
         self.call_price_label.config(text=f"${call_price:.2f}", foreground="green")
@@ -482,46 +854,169 @@ class IVCrushAnalyzer():
 
         # allow the user to now analyze a scenario
         self.analyze_btn.config(state="normal")
+        self.monte_carlo_btn.config(state="normal")
 
         # for the scenario variables, we are going to defaulty set them to the market data values
-        if not self.new_spot_var:
+        if not self.new_spot_var.get():
             self.new_spot_var.set(f"{spot_price: .2f}")
-        if not self.new_iv_var:
+        if not self.new_iv_var.get():
             self.new_iv_var.set(f"{iv_percent: .2f}")
+        if not self.new_dte_var.get():
+            self.new_dte_var.set(str(days_to_expiry))
+        # the slider ranges belong to the loaded straddle; respanning them on every stream refresh would yank a
+        # slider out from under the user mid drag
+        if rebuild_map:
+            self.setup_scenario_sliders(spot_price, iv_percent, days_to_expiry)
+
+        if rebuild_map or self.pnl_map_stale(strike_price, iv_decimal, days_to_expiry):
+            self.request_pnl_map(spot_price, strike_price, iv_decimal, days_to_expiry, straddle_price)
+
+    def pnl_map_stale(self, strike_price, iv_decimal, days_to_expiry):
+        """ True if the map on screen (or being built) is for another strike or dte, or an IV more than a step away """
+
+        if self.pnl_map_inputs is None:
+            return True
+        strike, iv, dte = self.pnl_map_inputs
+        return strike != strike_price or dte != days_to_expiry or abs(iv - iv_decimal) >= self.pnl_map_iv_step
+
+    def request_pnl_map(self, spot_price, strike_price, iv_decimal, days_to_expiry, straddle_price):
+        """ Builds the pnl map (a few million grid points) off the main thread, superseding any build that is queued """
+
+        self.pnl_map_inputs = (strike_price, iv_decimal, days_to_expiry)
+        args = (spot_price, strike_price, iv_decimal, days_to_expiry, straddle_price)
+
+        task = self.pnl_map_task
+        if task is not None and not task.done():
+            if task.future.running():
+                self.pnl_map_next = args
+                return
+            self.executor.cancel(task, notify=False)
+        self.start_pnl_map(*args)
+
+    def start_pnl_map(self, spot_price, strike_price, iv_decimal, days_to_expiry, straddle_price):
+        def on_success(grid):
+            if self.finish_pnl_map(handle):
+                self.on_pnl_map(grid, spot_price, iv_decimal)
+
+        def on_error(e):
+            if self.finish_pnl_map(handle):
+                self.log_message(f"P/L map failed: {e}")
+
+        handle = self.executor.submit(self.build_pnl_map, spot_price, strike_price, iv_decimal, days_to_expiry, straddle_price,
+                                      r=self.risk_free_rate, on_success=on_success, on_error=on_error, description="p/l map")
+        self.pnl_map_task = handle
+
+    def finish_pnl_map(self, handle):
+        """ Called when a build finishes; starts the waiting request if there is one and says whether to show the result """
+
+        if handle is not self.pnl_map_task:
+            return False    # superseded
+        self.pnl_map_task = None
+        if self.pnl_map_next is not None:
+            args, self.pnl_map_next = self.pnl_map_next, None
+            self.start_pnl_map(*args)
+            return False
+        return True
+
+    def build_pnl_map(self, *args, **kwargs):
+        """ Worker side of the P/L map; the first call also pays for the matplotlib import here instead of on the main thread """
+
+        import src.heatmap
+        return pnl_map(*args, **kwargs)
+
+    def on_pnl_map(self, grid, spot_price, iv_decimal):
+        if self.heatmap is None:
+            from src.heatmap import PnLHeatmap
+
+            self.heatmap_placeholder.destroy()
+            self.heatmap = PnLHeatmap(self.heatmap_frame)
+            self.heatmap.set_side(self.heatmap_side_var.get().lower())
+            self.heatmap.widget.grid(row=0, column=0, columnspan=4, sticky=(tk.W, tk.E))
+
+        self.heatmap.set_grid(grid, spot_price, iv_decimal)
+        last = len(grid["dte"]) - 1
+        self.heatmap_dte_scale.config(to=last)
+        self.heatmap_dte_scale.set(last)
+        self.heatmap_dte_label.config(text=f"{grid['dte'][last]:.0f}")
+
+    def on_heatmap_side(self, event):
+        if self.heatmap is not None:
+            self.heatmap.set_side(self.heatmap_side_var.get().lower())
+
+    def on_heatmap_dte(self, value):
+        if self.heatmap is None or self.heatmap.grid is None:
+            return
+        self.heatmap.show(round(float(value)))
+        self.heatmap_dte_label.config(text=f"{self.heatmap.grid['dte'][self.heatmap.dte_index]:.0f}")
+
+    def setup_scenario_sliders(self, spot_price, iv_percent, days_to_expiry):
+        """ Spans the scenario sliders over the same ranges as the P/L map and moves them to the current scenario inputs """
+
+        ranges = (
+            (self.new_spot_scale, self.new_spot_var, spot_price * 0.75, spot_price * 1.25),
+            (self.new_iv_scale, self.new_iv_var, iv_percent * 0.2, iv_percent * 1.2),
+            (self.new_dte_scale, self.new_dte_var, 0, max(days_to_expiry, 1)),
+        )
+
+        # moving the sliders here would fire their callbacks, so they are ignored until everything is in place
+        self.syncing_sliders = True
+        for scale, var, low, high in ranges:
+            scale.config(from_=low, to=high)
+            try:
+                scale.set(float(var.get()))
+            except ValueError:
+                pass
+            scale.state(["!disabled"])
+        self.syncing_sliders = False
+
+    def on_scenario_slider(self, var, text):
+        """
+        Slider moved: show the value and reprice at most once per scenario_debounce_ms. Motion events that arrive while
+        a reprice is pending just update the inputs it will read, so a drag reprices continuously without queueing
+        one evaluation per pixel
+        """
+
+        if self.syncing_sliders or str(self.analyze_btn.cget("state")) == "disabled":
+            return
+        var.set(text)
+
+        if self.scenario_after_id is None:
+            self.scenario_after_id = self.root.after(self.scenario_debounce_ms, self.live_scenario)
 
-    def analyze_scenario(self):
+    def live_scenario(self):
+        self.scenario_after_id = None
+        self.analyze_scenario(live=True)
+
+    def analyze_scenario(self, live=False):
+        """ Prices the scenario inputs; live runs come from the sliders so they stay quiet and go through the price cache """
         
         # get the new scenario vars
         try:
             new_spot = float(self.new_spot_var.get())
             new_iv_dec = float(self.new_iv_var.get())/100.0     # because it is in percent and we need in decimal
         except ValueError:
-            messagebox.showerror("Error", "Invalid spot price or IV values")
+            if not live:
+                messagebox.showerror("Error", "Invalid spot price or IV values")
             return
         
-        # get the strike price and days to expiry from market data fields
+        # get the strike price and days to expiry from market data fields, the scenario dte overrides the days to expiry
         try:
             strike_price = float(self.strike_price_var.get())
-            days_to_expiry = int(self.days_to_expiry_var.get())
+            days_to_expiry = int(self.new_dte_var.get() or self.days_to_expiry_var.get())
         except ValueError:
-            messagebox.showerror("Error", "Invalid strike price or days to expiry")
+            if not live:
+                messagebox.showerror("Error", "Invalid strike price or days to expiry")
             return
         
-        T = days_to_expiry / 365.0
-        r = self.risk_free_rate
-
-        # calc new option prices
-        new_call_price = black_scholes_call(new_spot, strike_price, T, r, new_iv_dec)
-        new_put_price = black_scholes_put(new_spot, strike_price, T, r, new_iv_dec)
-        new_straddle_price = new_call_price + new_put_price
-
         # get the og straddle price for pnl calc
         og_straddle_price = float(self.straddle_price_label.cget("text").replace("$", "").strip())
 
-        # calc pnl
+        # calc new option prices, greeks and pnl
         # rmr our position is short straddle so we want new straddle price to be lower than og straddle price which makes pnl long negative and pnl short positive
-        pnl_long = new_straddle_price - og_straddle_price
-        pnl_short = -pnl_long
+        new_straddle = run_scenario(og_straddle_price, new_spot, strike_price, new_iv_dec, days_to_expiry, self.risk_free_rate, cached=live)
+        new_straddle_price = new_straddle["straddle"]
+        pnl_long = new_straddle["pnl_long"]
+        pnl_short = new_straddle["pnl_short"]
 
         long_color = "green" if pnl_long > 0 else "red"
         short_color = "green" if pnl_short > 0 else "red" 
@@ -531,23 +1026,69 @@ class IVCrushAnalyzer():
         self.pnl_long_label.config(text=f"${pnl_long:+.2f}", foreground=long_color)
         self.pnl_short_label.config(text=f"${pnl_short:+.2f}", foreground=short_color)
 
-        # calc new greeks 
-        new_delta = calculate_delta(new_spot, strike_price, T, r, new_iv_dec, 'call') + calculate_delta(new_spot, strike_price, T, r, new_iv_dec, 'put')
-        new_theta = calculate_theta(new_spot, strike_price, T, r, new_iv_dec, 'call') + calculate_theta(new_spot, strike_price, T, r, new_iv_dec, 'put')
-        new_vega = calculate_vega(new_spot, strike_price, T, r, new_iv_dec) * 2  # call + put vega
-        new_gamma = calculate_gamma(new_spot, strike_price, T, r, new_iv_dec)
+        # new greeks
+        new_delta = new_straddle["delta"]
+        new_theta = new_straddle["theta"]
+        new_vega = new_straddle["vega"]
+        new_gamma = new_straddle["gamma"]
 
         # adjust greek labels
         self.new_delta_label.config(text=f"{new_delta:.3f}")
         self.new_gamma_label.config(text=f"{new_gamma:.3f}")
         self.new_vega_label.config(text=f"{new_vega:.2f}")
         self.new_theta_label.config(text=f"{new_theta:.2f}")
+        if self.heatmap is not None:
+            self.heatmap.mark_scenario(new_spot, new_iv_dec)
+        if self.heatmap is not None and self.heatmap.grid is not None:
+            self.heatmap.show(np.searchsorted(self.heatmap.grid["dte"], days_to_expiry))
 
+        if live:
+            return
         self.log_message(f"Scenario complete: New price ${new_straddle_price:.2f}, Long P/L ${pnl_long:.2f}, Short P/L ${pnl_short:.2f}")
 
+    def run_monte_carlo(self):
+        """
+        Simulates the post-event PnL distribution around the scenario: the move is normal with the size implied by the
+        current straddle and the post-event IV is lognormal around the scenario IV
+        """
 
+        try:
+            spot_price = float(self.spot_price_var.get())
+            strike_price = float(self.strike_price_var.get())
+            iv_decimal = float(self.iv_var.get())/100.0
+            days_to_expiry = int(self.days_to_expiry_var.get())
+            new_iv_dec = float(self.new_iv_var.get())/100.0
+            entry_price = float(self.straddle_price_label.cget("text").replace("$", "").strip())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter valid numeric values for all parameters")
+            return
 
+        # the crush is relative to the current IV and the move is sized off the straddle, so both have to be positive
+        if iv_decimal <= 0 or new_iv_dec < 0:
+            messagebox.showerror("Error", "IV must be greater than 0 and the new IV can not be negative")
+            return
+        if entry_price <= 0:
+            messagebox.showerror("Error", "Price the straddle before running Monte Carlo")
+            return
 
-
-
-        
+        move_dist = NormalMove(implied_move_sd(entry_price, spot_price))
+        iv_dist = LognormalCrush(median_crush=1.0 - new_iv_dec / iv_decimal)
+
+        self.monte_carlo_btn.config(state="disabled")
+        self.executor.submit(run_monte_carlo, spot_price, strike_price, iv_decimal, days_to_expiry, entry_price, move_dist, iv_dist,
+                             r=self.risk_free_rate,
+                             on_success=self.on_monte_carlo, on_error=self.on_monte_carlo_error,
+                             on_cancel=lambda: self.monte_carlo_btn.config(state="normal"),
+                             description="monte carlo")
+
+    def on_monte_carlo(self, stats):
+        self.monte_carlo_btn.config(state="normal")
+        short = stats["short"]
+        pct = short["percentiles"]
+        self.log_message(f"Monte Carlo ({stats['n_samples']:,} samples) short straddle: E[P/L] ${short['expected']:+.2f}, "
+                         f"P(profit) {short['prob_profit']*100:.1f}%, CVaR {stats['cvar_level']*100:.0f}% ${short['cvar']:+.2f}")
+        self.log_message(f"Short P/L percentiles: 5% ${pct[5]:+.2f} | 50% ${pct[50]:+.2f} | 95% ${pct[95]:+.2f}")
+
+    def on_monte_carlo_error(self, e):
+        self.monte_carlo_btn.config(state="normal")
+        self.log_message(f"Monte Carlo failed: {e}")
@@ -9,4 +9,9 @@ class ConnectionError(Exception):
 
     def __init__(self, _func: str, _file: str, message="Could not connect to IB TWS"):
         self.message = f"Connection Error | loc: ({_func}, {_file}) | {message}"
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+class RequestCancelledError(NoDataError):
+    """ Raised when an outstanding IB request is cancelled (by the user or a timeout) before it completes """
+    def __init__(self, message="Request Cancelled"):
+        super().__init__(message)
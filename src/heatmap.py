@@ -0,0 +1,114 @@
+import numpy as np
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+
+
+class PnLHeatmap():
+    """
+    Embedded straddle PnL heatmap over spot (x) and IV (y) for one days-to-expiry slice of a scenario grid
+
+    The figure, image, colorbar and markers are built once. The image and markers are animated artists, so changing
+    the slice (show) or the scenario marker only swaps their data and blits them over a cached background of the axes;
+    the full figure is only redrawn when a new grid changes the axes (set_grid) or the window is resized.
+    """
+
+    def __init__(self, parent):
+        self.grid = None
+        self.side = "short"
+        self.dte_index = 0
+        self.background = None
+
+        # fixed margins instead of a layout engine; a layout pass on every draw costs more than the whole blit
+        self.figure = Figure(figsize=(5, 3.2), dpi=100)
+        self.figure.subplots_adjust(left=0.13, right=0.97, bottom=0.15, top=0.9)
+        self.ax = self.figure.add_subplot()
+        self.image = self.ax.imshow(np.zeros((2, 2)), origin="lower", aspect="auto", cmap="RdYlGn",
+                                    interpolation="nearest", extent=(0, 1, 0, 1), animated=True)
+        self.colorbar = self.figure.colorbar(self.image, ax=self.ax, pad=0.02)
+        self.colorbar.set_label("P/L ($)")
+        self.entry_marker, = self.ax.plot([], [], marker="o", color="black", markersize=5, linestyle="", animated=True)
+        self.scenario_marker, = self.ax.plot([], [], marker="x", color="blue", markersize=7, linestyle="", animated=True)
+        self.ax.set_xlabel("Spot ($)")
+        self.ax.set_ylabel("IV (%)")
+        self.title = self.ax.set_title("Price a straddle to see its P/L map", fontsize=10)
+
+        self.canvas = FigureCanvasTkAgg(self.figure, master=parent)
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        self.widget = self.canvas.get_tk_widget()
+
+    def on_draw(self, event):
+        """ Every full redraw leaves out the animated artists; grab the clean axes as the blit background and put them back """
+
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.draw_animated()
+
+    def draw_animated(self):
+        for artist in (self.image, self.entry_marker, self.scenario_marker):
+            self.ax.draw_artist(artist)
+
+    def blit(self):
+        if self.background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_animated()
+        self.canvas.blit(self.ax.bbox)
+
+    def set_grid(self, grid, entry_spot, entry_iv):
+        """ Takes a scenario_grid result (iv and spot axes, any number of DTE slices) and shows the last DTE slice """
+
+        self.grid = grid
+        spots, ivs = grid["spot"], grid["iv"] * 100
+
+        # one symmetric colour scale for the whole cube so slices compare by colour and zero P/L is always the middle
+        limit = float(np.nanmax(np.abs(grid["pnl_long"]))) or 1.0
+        self.image.set_clim(-limit, limit)
+        self.image.set_extent((spots[0], spots[-1], ivs[0], ivs[-1]))
+        self.ax.set_xlim(spots[0], spots[-1])
+        self.ax.set_ylim(ivs[0], ivs[-1])
+        self.entry_marker.set_data([entry_spot], [entry_iv * 100])
+        self.scenario_marker.set_data([], [])
+        self.set_title()
+
+        self.dte_index = len(grid["dte"]) - 1
+        self.image.set_data(grid[f"pnl_{self.side}"][self.dte_index])
+
+        # the axes changed so the background has to be redrawn once; blits wait for that redraw
+        self.background = None
+        self.canvas.draw_idle()
+
+    def set_side(self, side):
+        """ 'long' or 'short' straddle P/L """
+
+        self.side = side
+        if self.grid is not None:
+            self.set_title()
+            self.image.set_data(self.grid[f"pnl_{self.side}"][self.dte_index])
+            self.canvas.draw_idle()
+
+    def set_title(self):
+        self.title.set_text(f"{self.side.capitalize()} straddle P/L (o entry, x scenario)")
+
+    def show(self, dte_index):
+        """ Shows the DTE slice at dte_index; only the image buffer changes so this is cheap enough to call while dragging """
+
+        if self.grid is None:
+            return
+
+        self.dte_index = int(np.clip(dte_index, 0, len(self.grid["dte"]) - 1))
+        self.image.set_data(self.grid[f"pnl_{self.side}"][self.dte_index])
+        self.blit()
+
+    def mark_scenario(self, spot, iv):
+        """ Moves the scenario marker to (spot, iv decimal) """
+
+        self.scenario_marker.set_data([spot], [iv * 100])
+        self.blit()
+
+    def clear(self):
+        self.grid = None
+        self.image.set_data(np.zeros((2, 2)))
+        self.entry_marker.set_data([], [])
+        self.scenario_marker.set_data([], [])
+        self.title.set_text("Price a straddle to see its P/L map")
+        self.canvas.draw_idle()
@@ -1,32 +1,255 @@
+from __future__ import annotations
+
 from ibapi.client import EClient
 from ibapi.wrapper import EWrapper
 from ibapi.contract import Contract
 from ibapi.common import BarData
-from typing import Dict, List
-import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, Sequence, Tuple
+from concurrent.futures import Future, TimeoutError, wait, FIRST_EXCEPTION
+import itertools
+import logging
+import queue
+import re
 import threading
+import time
 from datetime import datetime
 
-from src.exceptions import NoDataError, ConnectionError
+if TYPE_CHECKING:
+    import pandas as pd     # the frames are built by BarBuffer.to_frame, pandas loads with the first fetch
+
+from src.exceptions import NoDataError, ConnectionError, RequestCancelledError
+from src.metrics import METRICS, Metrics
+from src.pacing import RequestPacer
+from src.bar_cache import BarCache, trim_to_duration
+from src.bar_buffer import BarBuffer
+from src.option_chain import OptionChain, OptionChainCache
+from src.streaming import mid_from_ticks, CLOSE, DELAYED_CLOSE
+
+# nothing is printed, the app embedding the client decides where (and whether) these go
+logger = logging.getLogger(__name__)
+
+# error codes that mean the socket connection itself failed or dropped
+CONNECTION_ERROR_CODES = {502, 504, 1100, 1300}
+
+# TWS <-> IB server connectivity: 1100 lost, 1101 restored with market data subscriptions lost, 1102 restored with data kept
+CONNECTIVITY_CODES = {1100, 1101, 1102}
+
+
+def is_warning_code(errorCode: int) -> bool:
+    """ IB sends informational messages and warnings through error() as well; none of these end a request """
+    return 2100 <= errorCode < 2200 or errorCode in (1101, 1102, 10167)
+
+
+def contract_key(contract: Contract) -> tuple:
+    """ Hashable identity of a contract used for pacing (IB paces by contract, exchange and tick type) """
+    return (contract.symbol, contract.secType, contract.exchange, contract.currency,
+            contract.lastTradeDateOrContractMonth, contract.strike, contract.right)
+
+
+def cache_symbol(contract: Contract) -> str:
+    """
+    Name a contract's series is stored under in the bar cache
+
+    SMART routed USD stocks keep the plain symbol; anything else (options, other exchanges or currencies) gets the
+    rest of contract_key appended so contracts on the same underlying never share a series
+    """
+
+    key = contract_key(contract)
+    if key[1:4] == ("STK", "SMART", "USD"):
+        return key[0]
+    name = "_".join(str(part) for part in key if part not in ("", None, 0, 0.0))
+    return re.sub(r"[^A-Za-z0-9_.-]", "-", name)
+
+
+def bars_to_dataframe(bars: BarBuffer) -> pd.DataFrame:
+    """ Organizes the bars of a finished historical data request into a df indexed by date """
+
+    if len(bars) == 0:
+        raise NoDataError("Historical Data request returned no bars")
+
+    return bars.to_frame()
+
+
+def _chain(future: Future, fn, on_error=None) -> Future:
+    """
+    Returns a future that resolves with fn(result) of future
+
+    If future fails, the chained future fails with the same exception, unless on_error is given in which case it
+    resolves with on_error(exception) (on_error may re-raise)
+    """
+
+    chained = Future()
+
+    def _done(done: Future):
+        if done.cancelled():
+            chained.cancel()
+            return
+        try:
+            error = done.exception()
+            if error is None:
+                chained.set_result(fn(done.result()))
+            elif on_error is not None:
+                chained.set_result(on_error(error))
+            else:
+                chained.set_exception(error)
+        except Exception as e:
+            chained.set_exception(e)
+
+    future.add_done_callback(_done)
+    return chained
+
+
+def _mid_price(ticks: Dict[int, float]) -> float:
+    """ Mid price from snapshot ticks (live or delayed bid/ask, then last, then close); nan if none are usable """
+
+    mid = mid_from_ticks(ticks)
+    if mid is not None:
+        return mid
+    for tick_type in (CLOSE, DELAYED_CLOSE):
+        price = ticks.get(tick_type, -1)
+        if price > 0:
+            return price
+    return float("nan")
+
 
 class IBApp(EClient, EWrapper):
-    def __init__(self):
+    def __init__(self, bar_cache: BarCache = None, metrics: Metrics = None):
         # We want to initialize the EClient with the self meaning current instance of IBApp because we need to give it access to our instance of EWrapper
         # This is because EClient is responsible for sending requests to the IB Server over the TCP Socket and the IB Server needs to know where to send the response to (ie EWrapper)
         EClient.__init__(self, self)
 
         self.connected = False
-        self.historical_data: Dict[int, List]= {}
+        self.historical_data: Dict[int, BarBuffer] = {}
+
+        # every outstanding request gets a future keyed by its reqId which is resolved by the EWrapper callbacks
+        # (historicalDataEnd / error) so callers wake up as soon as the request is complete instead of polling
+        self._requests: Dict[int, Future] = {}
+        self._requests_lock = threading.Lock()
+
+        # request latency, bar throughput and error counts; reqId -> (kind, send time) for the latency histograms
+        self.metrics = metrics if metrics is not None else METRICS
+        self._request_started: Dict[int, Tuple[str, float]] = {}
+
+        # optional hooks for whatever manages this connection (eg. ConnectionPool); on_connection_closed(app) runs after
+        # the socket is gone and on_connectivity(app, errorCode) on TWS's 1100/1101/1102 connectivity messages, both on
+        # the reader thread
+        self.on_connection_closed: Callable = None
+        self.on_connectivity: Callable = None
+        self._connect_future = None
+
+        # reqIds are handed out by the app so concurrent requests never collide
+        self._req_id_counter = itertools.count(1000)
+        self._req_id_lock = threading.Lock()
+
+        # historical requests wait here until they can be sent without breaking IB's pacing limits
+        # (our 1 min bars are exempt from the 60 requests per 10 minutes rule which only covers bars of 30 secs or less)
+        self.pacer = RequestPacer(max_requests=None)
+
+        # optional local bar cache; when set, frame requests only ask IB for bars newer than the cached tail
+        self.bar_cache = bar_cache
+
+        # responses for option chain discovery and market data snapshots, collected per reqId until the End callback
+        self._contract_details: Dict[int, list] = {}
+        self._option_params: Dict[int, list] = {}
+        self.market_data: Dict[int, Dict[int, float]] = {}
+
+        # streaming market data subscriptions; reqId -> callback(reqId, tickType, value) called on the reader thread
+        self._subscriptions: Dict[int, Callable] = {}
+
+        # chain definitions are expensive to discover and rarely change, so they are reused for an hour
+        self.option_chain_cache = OptionChainCache(ttl=3600)
+
+    def next_request_id(self) -> int:
+        """ Allocates a reqId that is unique for the lifetime of this app """
+        with self._req_id_lock:
+            return next(self._req_id_counter)
 
     def nextValidId(self, orderId):
         self.connected = True
-        print(f"Connected to IB TWS")
+        if self._connect_future is not None and not self._connect_future.done():
+            self._connect_future.set_result(orderId)
+        logger.info("Connected to IB TWS")
 
     def error(self, reqId, errorCode, errorString, *args):
         # Filter out irrelevant warnings
         if errorCode == 2176 and "fractional share" in errorString.lower():
             return
-        print(f"Error reqId: {reqId} | {errorCode}: {errorString}")
+        self.metrics.inc("ib_errors_total", code=errorCode)
+        logger.log(logging.DEBUG if is_warning_code(errorCode) else logging.INFO,
+                   "Error reqId: %s | %s: %s", reqId, errorCode, errorString)
+
+        if errorCode in CONNECTIVITY_CODES and self.on_connectivity is not None:
+            self.on_connectivity(self, errorCode)
+
+        # warnings and info messages (eg. market data farm connection is OK) do not end a request
+        if is_warning_code(errorCode):
+            return
+
+        if reqId in self._requests:
+            # a request that could not reach TWS (eg. 504 not connected) failed because of the connection, not the data
+            if errorCode in CONNECTION_ERROR_CODES:
+                error = ConnectionError(_func="error", _file="ib_client", message=f"Request {reqId} failed | {errorCode}: {errorString}")
+            else:
+                error = NoDataError(f"Request {reqId} failed | {errorCode}: {errorString}")
+            self._fail_request(reqId, error)
+        elif errorCode in CONNECTION_ERROR_CODES and self._connect_future is not None and not self._connect_future.done():
+            self._connect_future.set_exception(ConnectionError(_func="error", _file="ib_client", message=f"{errorCode}: {errorString}"))
+
+    def connectionClosed(self):
+        self.connected = False
+        logger.info("Connection to IB TWS closed")
+
+        if self.on_connection_closed is not None:
+            self.on_connection_closed(self)
+
+        # nothing outstanding can complete anymore
+        for reqId in list(self._requests):
+            self._fail_request(reqId, ConnectionError(_func="connectionClosed", _file="ib_client",
+                                                      message=f"Connection closed with reqId {reqId} outstanding"))
+
+    def _register_request(self, reqId: int, kind: str) -> Future:
+        """ Creates the future for a new request; reqIds must be unique among the outstanding requests """
+
+        with self._requests_lock:
+            if reqId in self._requests and not self._requests[reqId].done():
+                raise ValueError(f"reqId {reqId} is already in use by an outstanding request")
+            future = Future()
+            self._requests[reqId] = future
+            self._request_started[reqId] = (kind, time.perf_counter())
+        return future
+
+    def _resolve_request(self, reqId: int, result):
+        with self._requests_lock:
+            future = self._requests.pop(reqId, None)
+            started = self._request_started.pop(reqId, None)
+        if started is not None:
+            kind, sent = started
+            self.metrics.observe("ib_request_seconds", time.perf_counter() - sent, kind=kind)
+            self.metrics.inc("ib_requests_total", kind=kind, outcome="ok")
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def _fail_request(self, reqId: int, exception: Exception):
+        with self._requests_lock:
+            future = self._requests.pop(reqId, None)
+            started = self._request_started.pop(reqId, None)
+        # whatever the request had buffered so far is never going to be handed out
+        self.historical_data.pop(reqId, None)
+        self._contract_details.pop(reqId, None)
+        if started is not None:
+            if isinstance(exception, RequestCancelledError):
+                outcome = "cancelled"
+            elif isinstance(exception, ConnectionError):
+                outcome = "disconnected"
+            else:
+                outcome = "error"
+            self.metrics.inc("ib_requests_total", kind=started[0], outcome=outcome)
+        if future is not None and not future.done():
+            future.set_exception(exception)
+
+    def wait_for_requests(self, futures: Iterable[Future], timeout: float = None):
+        """ Blocks until every future is done (or one fails, or the timeout passes); returns the (done, not_done) sets """
+        return wait(list(futures), timeout=timeout, return_when=FIRST_EXCEPTION)
 
     def create_equity_contract(self, symbol: str):
         """ Function for creating a contract for a given equity symbol with all required params """
@@ -39,40 +262,234 @@ class IBApp(EClient, EWrapper):
 
         return contract
 
-    def get_historical_data(self, reqId: int, contract: Contract, whatToShow:str):
-        """ This is our request function for historical data """
-        
-        if reqId not in self.historical_data:
-            self.historical_data[reqId] = []
+    def create_option_contract(self, symbol: str, expiry: str, strike: float, right: str, trading_class: str = "",
+                               multiplier: str = "100"):
+        """ Function for creating an equity option contract; right is 'C' or 'P' and expiry is YYYYMMDD """
+
+        contract = Contract()
+        contract.symbol = symbol.upper()
+        contract.secType = "OPT"    # Option
+        contract.exchange = "SMART"
+        contract.currency = "USD"
+        contract.lastTradeDateOrContractMonth = expiry
+        contract.strike = strike
+        contract.right = right
+        contract.tradingClass = trading_class
+        contract.multiplier = multiplier
+
+        return contract
+
+    def request_historical_data(self, reqId: int, contract: Contract, whatToShow: str,
+                                durationStr: str = "3 D", barSizeSetting: str = "1 min") -> Future:
+        """
+        Sends a historical data request without waiting for the response
+
+        The call only blocks while the pacer holds the request back to stay under IB's limits. The returned future
+        resolves with the BarBuffer of the request once historicalDataEnd fires for reqId, or fails with a NoDataError
+        if IB reports an error for the request
+        """
+
+        key = (contract_key(contract), whatToShow)
+        held = time.perf_counter()
+        self.pacer.acquire(key=key, signature=(key, durationStr, barSizeSetting))
+        self.metrics.observe("ib_pacing_wait_seconds", time.perf_counter() - held)
+
+        try:
+            future = self._register_request(reqId, "historical")
+        except Exception:
+            # the slot was taken for a request that never went out; hand it back or the pacer fills up with leaks
+            self.pacer.release()
+            raise
+        future.add_done_callback(lambda _future: self.pacer.release())
+        self.historical_data[reqId] = BarBuffer()
 
         end_date = datetime.now()
 
-        self.reqHistoricalData(
-            reqId=reqId,
-            contract=contract,
-            endDateTime=end_date.strftime("%Y%m%d %H:%M:%S"),
-            durationStr="3 D",
-            barSizeSetting="1 min",
-            whatToShow=whatToShow,
-            useRTH=1,
-            formatDate=1,
-            keepUpToDate=False,
-            chartOptions=[]
-        )
-
-        # Wait for the data | 15 seconds
-        timeout = 15
-        start_time = time.time()
-
-        while self.historical_data[reqId] == [] and (time.time() - start_time) < timeout:
-            time.sleep(0.1)
-
-        if len(self.historical_data[reqId]) > 0:
-            # Note that if the server responds, the only way this reqId key will be populated is if historicalData overriden method is called by the server
-            return self.historical_data[reqId]
+        try:
+            self.reqHistoricalData(
+                reqId=reqId,
+                contract=contract,
+                endDateTime=end_date.strftime("%Y%m%d %H:%M:%S"),
+                durationStr=durationStr,
+                barSizeSetting=barSizeSetting,
+                whatToShow=whatToShow,
+                useRTH=1,
+                formatDate=1,
+                keepUpToDate=False,
+                chartOptions=[]
+            )
+        except Exception as e:
+            self._fail_request(reqId, NoDataError(f"Could not send Historical Data request {reqId} | {e}"))
+
+        return future
+
+    def get_historical_data(self, reqId: int, contract: Contract, whatToShow:str, timeout: float = 15,
+                            durationStr: str = "3 D", barSizeSetting: str = "1 min"):
+        """ This is our request function for historical data; blocks until the request is complete """
+
+        future = self.request_historical_data(reqId, contract, whatToShow, durationStr, barSizeSetting)
+
+        try:
+            bars = future.result(timeout=timeout)
+        except TimeoutError:
+            self.metrics.inc("ib_timeouts_total", kind="historical")
+            self.cancel_historical_data(reqId)
+            raise NoDataError(f"Timed out waiting for Historical Data for reqId {reqId}")
+
+        if len(bars) > 0:
+            return bars
         else:
             raise NoDataError(f"No Historical Data Recieved for reqId {reqId}")
-        
+
+    def request_historical_frame(self, reqId: int, contract: Contract, whatToShow: str,
+                                 durationStr: str = "3 D", barSizeSetting: str = "1 min") -> Future:
+        """
+        Like request_historical_data but the future resolves with a df of the bars
+
+        With a bar cache set, only the bars after the last cached bar are requested and merged into the cache; if the
+        cache is already current no request is sent at all. The df always covers the window of durationStr.
+        """
+
+        if self.bar_cache is None:
+            future = self.request_historical_data(reqId, contract, whatToShow, durationStr, barSizeSetting)
+            return _chain(future, bars_to_dataframe)
+
+        symbol = cache_symbol(contract)
+        cache = self.bar_cache
+        top_up = cache.top_up_duration(symbol, whatToShow, barSizeSetting, durationStr)
+
+        if top_up is None:
+            cached = Future()
+            cached.set_result(trim_to_duration(cache.load(symbol, whatToShow, barSizeSetting), durationStr))
+            return cached
+
+        def merge(bars):
+            if len(bars) > 0:
+                frame = cache.update(symbol, whatToShow, barSizeSetting, bars_to_dataframe(bars))
+            else:
+                frame = cache.load(symbol, whatToShow, barSizeSetting)
+                if frame is None:
+                    raise NoDataError(f"No Historical Data Recieved for reqId {reqId}")
+            return trim_to_duration(frame, durationStr)
+
+        def fall_back(error):
+            # IB answers a top-up window with no new bars (eg. outside trading hours) with an error, in which case the
+            # cached series is still the latest data; cancellations and connection errors are passed through
+            frame = cache.load(symbol, whatToShow, barSizeSetting)
+            if frame is None or not isinstance(error, NoDataError) or isinstance(error, RequestCancelledError):
+                raise error
+            return trim_to_duration(frame, durationStr)
+
+        future = self.request_historical_data(reqId, contract, whatToShow, top_up, barSizeSetting)
+        return _chain(future, merge, on_error=fall_back)
+
+    def get_historical_frame(self, reqId: int, contract: Contract, whatToShow: str, timeout: float = 15,
+                             durationStr: str = "3 D", barSizeSetting: str = "1 min") -> pd.DataFrame:
+        """ Blocking version of request_historical_frame """
+
+        future = self.request_historical_frame(reqId, contract, whatToShow, durationStr, barSizeSetting)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            self.metrics.inc("ib_timeouts_total", kind="historical")
+            self.cancel_historical_data(reqId)
+            raise NoDataError(f"Timed out waiting for Historical Data for reqId {reqId}")
+
+    def fetch_historical_batch(self, symbols: Sequence[str],
+                               what_to_show: Sequence[str] = ("TRADES", "OPTION_IMPLIED_VOLATILITY"),
+                               timeout: float = 60, durationStr: str = "3 D",
+                               barSizeSetting: str = "1 min") -> Iterator[Tuple[str, Dict[str, pd.DataFrame], Exception]]:
+        """
+        Fetches historical data for many symbols in parallel and yields (symbol, frames, error) as each symbol completes
+
+        frames maps each whatToShow to a df of its bars (durationStr of barSizeSetting bars). Every request gets its own reqId and all of them go through the
+        pacer, so a large universe is sent as fast as IB allows and results stream back in completion order rather than
+        in the order of the input. If any request for a symbol fails or takes longer than timeout seconds once sent,
+        the symbol is yielded with an empty frames dict and the error.
+        """
+
+        symbols = list(dict.fromkeys(s.upper() for s in symbols))
+        done_queue = queue.Queue()
+        stop = threading.Event()
+
+        # per symbol: what -> future, plus the reqIds and send times so we can time out stuck requests
+        pending: Dict[str, Dict[str, Future]] = {symbol: {} for symbol in symbols}
+        sent_at: Dict[int, float] = {}
+        req_symbol: Dict[int, str] = {}
+        remaining = set(symbols)
+
+        def submit_all():
+            # pacing can hold requests back for a long time so sending happens off the caller's thread
+            for symbol in symbols:
+                contract = self.create_equity_contract(symbol)
+                for what in what_to_show:
+                    if stop.is_set():
+                        return
+                    if symbol not in remaining:
+                        break   # an earlier request for this symbol already failed
+                    reqId = self.next_request_id()
+                    req_symbol[reqId] = symbol
+                    future = self.request_historical_frame(reqId, contract, what, durationStr, barSizeSetting)
+                    sent_at[reqId] = time.monotonic()
+                    pending[symbol][what] = future
+                    future.add_done_callback(lambda _future, symbol=symbol: done_queue.put(symbol))
+
+        submitter = threading.Thread(target=submit_all, daemon=True)
+        submitter.start()
+
+        try:
+            while remaining:
+                try:
+                    symbol = done_queue.get(timeout=0.25)
+                except queue.Empty:
+                    symbol = None
+
+                # cancel anything that has been outstanding too long; its done callback queues the symbol again
+                now = time.monotonic()
+                for reqId, started in list(sent_at.items()):
+                    if now - started > timeout:
+                        sent_at.pop(reqId, None)
+                        self.metrics.inc("ib_timeouts_total", kind="historical")
+                        self.cancel_historical_data(reqId)
+
+                if symbol is None or symbol not in remaining:
+                    continue
+
+                futures = pending[symbol]
+                failed = next((f for f in futures.values() if f.done() and f.exception() is not None), None)
+                if failed is not None:
+                    remaining.discard(symbol)
+                    for reqId in [r for r, s in req_symbol.items() if s == symbol]:
+                        sent_at.pop(reqId, None)
+                        self.cancel_historical_data(reqId)
+                    yield symbol, {}, failed.exception()
+                    continue
+
+                if len(futures) < len(what_to_show) or not all(f.done() for f in futures.values()):
+                    continue
+
+                remaining.discard(symbol)
+                for reqId in [r for r, s in req_symbol.items() if s == symbol]:
+                    sent_at.pop(reqId, None)
+
+                yield symbol, {what: future.result() for what, future in futures.items()}, None
+        finally:
+            # if the caller stops early we stop sending and drop whatever is still outstanding
+            stop.set()
+            for reqId in list(sent_at):
+                self.cancel_historical_data(reqId)
+
+    def cancel_historical_data(self, reqId: int):
+        """ Cancels an outstanding historical data request and fails its future """
+
+        if reqId not in self._requests:
+            return
+        try:
+            self.cancelHistoricalData(reqId)
+        except Exception:
+            pass    # the request is dropped locally either way
+        self._fail_request(reqId, RequestCancelledError(f"Historical Data request {reqId} was cancelled"))
+
 
     def historicalData(self, reqId: int, bar: BarData):
         """ 
@@ -83,39 +500,199 @@ class IBApp(EClient, EWrapper):
         This function will not be directly called ever; if you want historical data, you call the get_historical_data function
         """
 
-        self.historical_data[reqId].append({
-            "date": bar.date ,
-            "open": bar.open,
-            "close": bar.close,
-            "high": bar.high,
-            "low": bar.low,
-            "volume": bar.volume
-        })
+        buffer = self.historical_data.get(reqId)
+        if buffer is None:
+            return    # a bar arriving after its request failed, timed out or was cancelled
+        buffer.append(bar)
 
     def historicalDataEnd(self, reqId, start, end):
-        print(f"Historical Data has been recieved for reqID {reqId}")
+        bars = self.historical_data.pop(reqId, BarBuffer(0))
+        self.metrics.inc("ib_bars_total", len(bars))
+        self.metrics.mark("ib_bars_per_second", len(bars))
+        self._resolve_request(reqId, bars)
+
+    def contractDetails(self, reqId, contractDetails):
+        details = self._contract_details.get(reqId)
+        if details is not None:
+            details.append(contractDetails)
+
+    def contractDetailsEnd(self, reqId):
+        self._resolve_request(reqId, self._contract_details.pop(reqId, []))
+
+    def securityDefinitionOptionParameter(self, reqId, exchange, underlyingConId, tradingClass, multiplier, expirations, strikes):
+        self._option_params.setdefault(reqId, []).append({
+            "exchange": exchange,
+            "underlying_con_id": underlyingConId,
+            "trading_class": tradingClass,
+            "multiplier": multiplier,
+            "expirations": set(expirations),
+            "strikes": set(strikes),
+        })
+
+    def securityDefinitionOptionParameterEnd(self, reqId):
+        self._resolve_request(reqId, self._option_params.pop(reqId, []))
+
+    def tickPrice(self, reqId, tickType, price, attrib):
+        on_tick = self._subscriptions.get(reqId)
+        if on_tick is not None:
+            on_tick(reqId, tickType, price)
+            return
+
+        ticks = self.market_data.get(reqId)
+        if ticks is not None:
+            ticks[tickType] = price
+
+    def tickGeneric(self, reqId, tickType, value):
+        # the underlying's implied vol (generic tick 106) arrives here rather than through tickPrice
+        on_tick = self._subscriptions.get(reqId)
+        if on_tick is not None:
+            on_tick(reqId, tickType, value)
+
+    def tickSnapshotEnd(self, reqId):
+        self._resolve_request(reqId, self.market_data.pop(reqId, {}))
+
+    def request_contract_details(self, reqId: int, contract: Contract) -> Future:
+        """ Future resolves with the list of ContractDetails matching the contract """
+
+        future = self._register_request(reqId, "contract_details")
+        self._contract_details[reqId] = []
+        self.reqContractDetails(reqId, contract)
+        return future
+
+    def request_option_params(self, reqId: int, symbol: str, underlying_con_id: int) -> Future:
+        """ Future resolves with one dict of expirations/strikes per exchange and trading class (reqSecDefOptParams) """
+
+        future = self._register_request(reqId, "option_params")
+        self._option_params[reqId] = []
+        self.reqSecDefOptParams(reqId, symbol.upper(), "", "STK", underlying_con_id)
+        return future
+
+    def request_snapshot(self, reqId: int, contract: Contract) -> Future:
+        """ Future resolves with a dict of tickType -> price from a one-off market data snapshot """
+
+        future = self._register_request(reqId, "snapshot")
+        self.market_data[reqId] = {}
+        self.reqMktData(reqId, contract, "", True, False, [])
+        return future
+
+    def cancel_snapshot(self, reqId: int):
+        """ Cancels an outstanding snapshot: frees its market data line and fails its future """
+
+        if reqId not in self._requests:
+            return
+        try:
+            self.cancelMktData(reqId)
+        except Exception:
+            pass    # the request is dropped locally either way
+        self.market_data.pop(reqId, None)
+        self._fail_request(reqId, RequestCancelledError(f"Snapshot request {reqId} was cancelled"))
+
+    def subscribe_market_data(self, contract: Contract, on_tick: Callable, genericTickList: str = "") -> int:
+        """
+        Starts streaming market data for a contract and returns the reqId of the subscription
+
+        on_tick(reqId, tickType, value) is called on the reader thread for every price and generic tick, so it must
+        be cheap and thread-safe (eg. TickCoalescer.put)
+        """
+
+        reqId = self.next_request_id()
+        self._subscriptions[reqId] = on_tick
+        self.reqMktData(reqId, contract, genericTickList, False, False, [])
+        return reqId
+
+    def unsubscribe_market_data(self, reqId: int):
+        if self._subscriptions.pop(reqId, None) is None:
+            return
+        try:
+            self.cancelMktData(reqId)
+        except Exception:
+            pass    # already disconnected; the subscription is gone either way
+
+    def get_option_chain(self, symbol: str, timeout: float = 15) -> OptionChain:
+        """
+        Returns the option chain definition (expiries and strikes) for an underlying
+
+        Chains are cached per underlying for option_chain_cache.ttl seconds so repeated lookups skip the contract
+        details and reqSecDefOptParams round trips
+        """
+
+        chain = self.option_chain_cache.get(symbol)
+        if chain is not None:
+            return chain
+
+        reqId = self.next_request_id()
+        details = self._wait(reqId, self.request_contract_details(reqId, self.create_equity_contract(symbol)), timeout)
+        if not details:
+            raise NoDataError(f"No contract details for {symbol.upper()}")
+        con_id = details[0].contract.conId
+
+        reqId = self.next_request_id()
+        params = self._wait(reqId, self.request_option_params(reqId, symbol, con_id), timeout)
+
+        # SMART lists every expiry and strike; fall back to whichever exchange lists the most expiries
+        params = [p for p in params if p["trading_class"] == symbol.upper()] or params
+        if not params:
+            raise NoDataError(f"No option chain for {symbol.upper()}")
+        best = next((p for p in params if p["exchange"] == "SMART"), None) or max(params, key=lambda p: len(p["expirations"]))
+
+        chain = OptionChain(symbol, con_id, best["exchange"], best["trading_class"], best["multiplier"],
+                            best["expirations"], best["strikes"])
+        self.option_chain_cache.put(chain)
+        return chain
+
+    def get_straddle_quotes(self, chain: OptionChain, expiry: str, strike: float, timeout: float = 15) -> Dict[str, float]:
+        """
+        Snapshots the call and put of a straddle and returns their mid prices as {'call': ..., 'put': ...}
+
+        Uses bid/ask when both are there and falls back to last and then close (delayed ticks are accepted too)
+        """
+
+        requests = {}
+        for right, name in (("C", "call"), ("P", "put")):
+            contract = self.create_option_contract(chain.symbol, expiry, strike, right, chain.trading_class, chain.multiplier)
+            reqId = self.next_request_id()
+            requests[name] = (reqId, self.request_snapshot(reqId, contract))
+
+        return {name: _mid_price(self._wait(reqId, future, timeout)) for name, (reqId, future) in requests.items()}
+
+    def _wait(self, reqId: int, future: Future, timeout: float):
+        """ Waits for a request; on timeout the request is dropped from the registry and a NoDataError is raised """
+
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            kind = self._request_started.get(reqId, ("request",))[0]
+            self.metrics.inc("ib_timeouts_total", kind=kind)
+            self._fail_request(reqId, RequestCancelledError(f"Request {reqId} timed out"))
+            raise NoDataError(f"Timed out waiting for reqId {reqId}")
 
         
-    def connect_ib(self, host: str, port: str):
+    def connect_ib(self, host: str, port: str, timeout: float = 15, client_id: int = 1):
         
         try:
             port = int(port)
 
+            # resolved by nextValidId once the handshake is done, or failed by connect errors
+            self._connect_future = Future()
+            connect_future = self._connect_future
+
             def connect_thread():
                 try:
-                    self.connect(host, port, clientId=1)
+                    self.connect(host, port, clientId=client_id)
                     self.run()
                 except Exception as e:
-                    raise ConnectionError(_func="connect_ib", _file="ib_client")
+                    # nobody can catch an exception raised in this thread so hand it to the waiting caller instead
+                    if not connect_future.done():
+                        connect_future.set_exception(ConnectionError(_func="connect_ib", _file="ib_client", message=f"{e}"))
                 
             thread = threading.Thread(target=connect_thread, daemon=True)
             thread.start()
 
             # Wait for connection
-            timeout = 15
-            start_time = time.time()
-            while not self.connected and (time.time() - start_time) < timeout:
-                time.sleep(0.1)
+            try:
+                connect_future.result(timeout=timeout)
+            except TimeoutError:
+                pass
 
             if self.connected:
                 try:
@@ -127,6 +704,8 @@ class IBApp(EClient, EWrapper):
             else:
                 return None
 
+        except ConnectionError:
+            raise
         except Exception as e:
             raise ConnectionError(_func="connect_ib", _file="ib_client", message=f"{e}")
 
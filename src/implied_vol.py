@@ -0,0 +1,99 @@
+import numpy as np
+
+from src.metrics import METRICS
+from src.utils import black_scholes_greeks
+
+# search bracket for the volatility (decimal, annualized)
+IV_LOWER = 1e-4
+IV_UPPER = 10.0
+
+
+def implied_volatility(price, S, K, T, r, is_call=True, tol=1e-8, max_iter=100):
+    """
+    Backs out Black-Scholes implied volatility for a whole chain of option prices at once
+
+    All inputs broadcast against each other (eg. a strikes x expiries grid of prices). is_call is a bool or a bool
+    array (True for calls, False for puts). Each point is solved with Newton's method on vega, safeguarded by a
+    bracket: whenever a Newton step would leave the bracket (or vega is too small to trust) the point takes a
+    bisection step instead, so every point converges. Only points that have not converged yet are repriced on each
+    iteration.
+
+    Prices outside the no-arbitrage bounds (below intrinsic or above the upper bound) have no implied volatility
+    and come back as nan.
+    """
+
+    price, S, K, T, r, is_call = np.broadcast_arrays(
+        np.asarray(price, dtype=np.float64), np.asarray(S, dtype=np.float64), np.asarray(K, dtype=np.float64),
+        np.asarray(T, dtype=np.float64), np.asarray(r, dtype=np.float64), np.asarray(is_call, dtype=bool))
+    shape = price.shape
+
+    price, S, K, T, r, is_call = (a.ravel() for a in (price, S, K, T, r, is_call))
+    iv = np.full(price.shape, np.nan)
+
+    # no-arbitrage bounds; calls live in [max(S - K*df, 0), S] and puts in [max(K*df - S, 0), K*df]
+    disc_K = K * np.exp(-r * T)
+    lower = np.where(is_call, np.maximum(S - disc_K, 0.0), np.maximum(disc_K - S, 0.0))
+    upper = np.where(is_call, S, disc_K)
+    valid = (T > 0) & (price > lower) & (price < upper) & np.isfinite(price)
+
+    idx = np.flatnonzero(valid)
+    if len(idx) == 0:
+        return iv.reshape(shape)
+
+    p, s, k, t, rr, call = price[idx], S[idx], K[idx], T[idx], r[idx], is_call[idx]
+    lo = np.full(len(idx), IV_LOWER)
+    hi = np.full(len(idx), IV_UPPER)
+
+    # Brenner-Subrahmanyam ATM approximation is a good starting point for most of the chain
+    sigma = np.clip(np.sqrt(2 * np.pi / t) * p / s, 0.05, 3.0)
+
+    active = np.arange(len(idx))
+    for _ in range(max_iter):
+        g = black_scholes_greeks(s[active], k[active], t[active], rr[active], sigma[active])
+        model = np.where(call[active], g["call"], g["put"])
+        diff = model - p[active]
+        vega = g["vega"] * 100      # kernel vega is per vol point
+
+        converged = np.abs(diff) < tol
+        active = active[~converged]
+        if len(active) == 0:
+            break
+
+        diff, vega, sig = diff[~converged], vega[~converged], sigma[active]
+
+        # price is increasing in vol so the sign of the error tells us which side of the root we are on
+        too_high = diff > 0
+        hi[active] = np.where(too_high, sig, hi[active])
+        lo[active] = np.where(too_high, lo[active], sig)
+
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            newton = sig - diff / vega
+        bisect = 0.5 * (lo[active] + hi[active])
+        use_newton = (vega > 1e-12) & (newton > lo[active]) & (newton < hi[active])
+        sigma[active] = np.where(use_newton, newton, bisect)
+
+        # a collapsed bracket is as converged as the point can get
+        collapsed = (hi[active] - lo[active]) < tol
+        active = active[~collapsed]
+        if len(active) == 0:
+            break
+
+    iv[idx] = sigma
+    return iv.reshape(shape)
+
+
+@METRICS.timed("pricing_seconds", fn="chain_implied_volatility")
+def chain_implied_volatility(call_prices, put_prices, S, K, T, r):
+    """
+    Solves the calls and puts of a chain in a single batched call
+
+    Returns (call_iv, put_iv) with the broadcast shape of the inputs
+    """
+
+    call_prices, put_prices = np.broadcast_arrays(np.asarray(call_prices, dtype=np.float64),
+                                                  np.asarray(put_prices, dtype=np.float64))
+    prices = np.stack([call_prices, put_prices])
+    is_call = np.array([True, False]).reshape((2,) + (1,) * call_prices.ndim)
+
+    iv = implied_volatility(prices, S, K, T, r, is_call=is_call)
+    return iv[0], iv[1]
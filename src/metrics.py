@@ -0,0 +1,316 @@
+import io
+import importlib.util
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from functools import wraps
+from typing import Deque, Dict, Optional, Sequence, Tuple
+
+# latency buckets in seconds, roughly log spaced from 100 us to 2 minutes (anything slower lands in +Inf)
+LATENCY_BUCKETS = (1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0, 60.0, 120.0)
+
+# window the bars per second rate is measured over
+RATE_WINDOW_SECONDS = 60.0
+
+HELP = {
+    "ib_request_seconds": "Time from sending an IB request to its End callback, by request kind",
+    "ib_pacing_wait_seconds": "Time historical requests were held back by the pacer before being sent",
+    "ib_requests_total": "Finished IB requests by kind and outcome",
+    "ib_errors_total": "Error callbacks from TWS by IB error code",
+    "ib_timeouts_total": "Requests the caller gave up on after its timeout",
+    "ib_bars_total": "Historical bars ingested",
+    "ib_bars_per_second": f"Historical bars ingested per second over the last {RATE_WINDOW_SECONDS:.0f} seconds",
+    "pricing_seconds": "Wall time of pricing calls by function",
+    "ib_disconnects_total": "Dropped connections per pool session",
+    "ib_reconnects_total": "Successful reconnects per pool session",
+    "ib_resubmits_total": "Requests sent again after their connection dropped",
+    "ib_connect_failures_total": "Failed connect and reconnect attempts per pool session",
+    "ib_session_failures_total": "Pool sessions that gave up reconnecting after max_attempts",
+    "ib_retry_failures_total": "Resubmits that raised while being sent again",
+}
+
+# labels are stored as a sorted tuple of (name, value) pairs so they can be used as dict keys
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Histogram():
+    """ Cumulative bucket counts plus the sum and count of every observation, the same shape Prometheus uses """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)     # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """ Upper bound of the bucket holding the q-th observation (the observed max for the +Inf bucket) """
+
+        if self.count == 0:
+            return float("nan")
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else float("nan"),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts)),
+        }
+
+
+class RateMeter():
+    """ Events per second over a sliding window; each record is one (time, count) entry so batches are cheap """
+
+    def __init__(self, window_seconds: float = RATE_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._events: Deque[Tuple[float, float]] = deque()
+        self._total = 0.0
+
+    def _trim(self, now: float):
+        while self._events and now - self._events[0][0] > self.window_seconds:
+            self._total -= self._events.popleft()[1]
+
+    def record(self, n: float, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        self._events.append((now, n))
+        self._total += n
+        self._trim(now)
+
+    def rate(self, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        self._trim(now)
+        if not self._events:
+            return 0.0
+        # a window that has not filled up yet is measured from its first event
+        span = min(self.window_seconds, max(now - self._events[0][0], 1e-3))
+        return self._total / span
+
+
+class Metrics():
+    """
+    Thread-safe registry of counters, latency histograms and rates
+
+    Everything is keyed by a metric name plus keyword labels (eg. inc("ib_errors_total", code=162)). Recording is a
+    dict lookup and a few additions under one lock, cheap enough to leave on in the IB callbacks and the pricing path.
+    snapshot() returns everything as plain dicts and to_json / to_prometheus export it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.rates: Dict[str, RateMeter] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def mark(self, name: str, n: float = 1):
+        """ Adds n events to the rate meter name (eg. bars ingested) """
+
+        with self._lock:
+            meter = self.rates.get(name)
+            if meter is None:
+                meter = self.rates[name] = RateMeter()
+            meter.record(n)
+
+    def timed(self, name: str, **labels):
+        """ Decorator that observes the wall time of every call of the wrapped function into histogram name """
+
+        def decorate(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+            return wrapper
+        return decorate
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters.clear()
+            self.histograms.clear()
+            self.rates.clear()
+
+    def snapshot(self) -> Dict:
+        """ Copy of every metric as plain dicts; label tuples are flattened to 'name=value,...' keys """
+
+        def key_text(key: Labels) -> str:
+            return ",".join(f"{name}={value}" for name, value in key)
+
+        with self._lock:
+            return {
+                "uptime_seconds": time.time() - self.started,
+                "counters": {name: {key_text(key): value for key, value in series.items()}
+                             for name, series in self.counters.items()},
+                "histograms": {name: {key_text(key): histogram.to_dict() for key, histogram in series.items()}
+                               for name, series in self.histograms.items()},
+                "rates": {name: meter.rate() for name, meter in self.rates.items()},
+            }
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self) -> str:
+        """ Every metric in the Prometheus text exposition format """
+
+        def label_text(key: Labels, extra: Labels = ()) -> str:
+            pairs = key + extra
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+        def header(name: str, kind: str):
+            if name in HELP:
+                lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        lines = []
+        with self._lock:
+            for name, series in self.counters.items():
+                header(name, "counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{label_text(key)} {value}")
+
+            for name, series in self.histograms.items():
+                header(name, "histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, n in zip([*map(str, histogram.buckets), "+Inf"], histogram.counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{label_text(key, (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{label_text(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{label_text(key)} {histogram.count}")
+
+            for name, meter in self.rates.items():
+                header(name, "gauge")
+                lines.append(f"{name} {meter.rate()}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """ A few lines for a status log: request latency, bars/sec, errors and pricing times """
+
+        snap = self.snapshot()
+        lines = []
+        for key, h in snap["histograms"].get("ib_request_seconds", {}).items():
+            lines.append(f"IB {key or 'requests'}: {h['count']} done, p50 {h['p50'] * 1e3:.0f} ms, p95 {h['p95'] * 1e3:.0f} ms")
+        if "ib_bars_per_second" in snap["rates"]:
+            bars = sum(snap["counters"].get("ib_bars_total", {}).values())
+            lines.append(f"Bars: {bars:,.0f} total, {snap['rates']['ib_bars_per_second']:,.0f}/s")
+        errors = snap["counters"].get("ib_errors_total", {})
+        if errors:
+            lines.append("IB errors: " + ", ".join(f"{key.split('=')[-1]} x{count:.0f}" for key, count in errors.items()))
+        timeouts = sum(snap["counters"].get("ib_timeouts_total", {}).values())
+        if timeouts:
+            lines.append(f"Timeouts: {timeouts:.0f}")
+        for key, h in snap["histograms"].get("pricing_seconds", {}).items():
+            lines.append(f"{key.split('=')[-1]}: {h['count']} calls, mean {h['mean'] * 1e3:.2f} ms, max {h['max'] * 1e3:.2f} ms")
+        return "\n".join(lines) if lines else "No metrics recorded yet"
+
+
+# the registry the IB client and the pricing functions record into unless they are given their own
+METRICS = Metrics()
+
+
+class Profiler():
+    """
+    On/off switch for a profiler around whatever runs between start() and stop()
+
+    kind is 'cprofile' (standard library, deterministic) or 'pyinstrument' (sampling, lower overhead; needs the
+    pyinstrument package); by default pyinstrument is used when it is installed and cProfile otherwise. Both only see
+    the thread that called start(), so start it on the thread doing the work you want to look at. stop() returns the
+    report as text.
+    """
+
+    def __init__(self, kind: Optional[str] = None):
+        if kind is None:
+            kind = "pyinstrument" if importlib.util.find_spec("pyinstrument") is not None else "cprofile"
+        if kind not in ("cprofile", "pyinstrument"):
+            raise ValueError(f"Unknown profiler {kind}; use 'cprofile' or 'pyinstrument'")
+        self.kind = kind
+        self._profiler = None
+
+    @property
+    def running(self) -> bool:
+        return self._profiler is not None
+
+    def start(self):
+        if self.running:
+            return
+        if self.kind == "pyinstrument":
+            try:
+                from pyinstrument import Profiler as SamplingProfiler
+            except ImportError:
+                raise ImportError("The pyinstrument profiler needs the pyinstrument package installed; use 'cprofile' instead")
+            self._profiler = SamplingProfiler()
+            self._profiler.start()
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self, limit: int = 25) -> str:
+        """ Stops profiling and returns the report (the top limit functions by cumulative time for cProfile) """
+
+        if not self.running:
+            return ""
+        profiler, self._profiler = self._profiler, None
+
+        if self.kind == "pyinstrument":
+            profiler.stop()
+            return profiler.output_text()
+
+        profiler.disable()
+        import pstats
+
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def toggle(self) -> Optional[str]:
+        """ Starts the profiler if it is off; stops it and returns the report if it is on """
+
+        if self.running:
+            return self.stop()
+        self.start()
+        return None
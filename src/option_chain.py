@@ -0,0 +1,90 @@
+import threading
+import time
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+class OptionChain():
+    """ Option chain definition for one underlying: the listed expiries and strikes from reqSecDefOptParams """
+
+    def __init__(self, symbol: str, underlying_con_id: int, exchange: str, trading_class: str, multiplier: str,
+                 expirations: Iterable[str], strikes: Iterable[float]):
+        self.symbol = symbol.upper()
+        self.underlying_con_id = underlying_con_id
+        self.exchange = exchange
+        self.trading_class = trading_class
+        self.multiplier = multiplier
+        self.expirations: List[str] = sorted(expirations)           # IB format YYYYMMDD
+        self.strikes = np.array(sorted(strikes), dtype=np.float64)
+
+    def expiry_dates(self) -> List[date]:
+        return [datetime.strptime(expiry, "%Y%m%d").date() for expiry in self.expirations]
+
+    def next_expiry(self, after: Optional[date] = None) -> str:
+        """
+        First expiry strictly after the given date (eg. the earnings date, so the straddle is still alive for the
+        post-event crush); defaults to the first expiry after today
+        """
+
+        after = after or date.today()
+        for expiry, expiry_date in zip(self.expirations, self.expiry_dates()):
+            if expiry_date > after:
+                return expiry
+        raise ValueError(f"No {self.symbol} expiry after {after}")
+
+    def nearest_strikes(self, spot: float, n: int = 1) -> np.ndarray:
+        """ The n listed strikes closest to spot, sorted by strike """
+
+        order = np.argsort(np.abs(self.strikes - spot), kind="stable")[:n]
+        return np.sort(self.strikes[order])
+
+
+def select_atm_straddle(chain: OptionChain, spot: float, event_date: Optional[date] = None) -> Tuple[str, float, int]:
+    """
+    Picks the ATM straddle for the first expiry after event_date
+
+    Returns (expiry, strike, days_to_expiry); days to expiry are counted from today
+    """
+
+    expiry = chain.next_expiry(after=event_date)
+    strike = float(chain.nearest_strikes(spot, 1)[0])
+    days_to_expiry = (datetime.strptime(expiry, "%Y%m%d").date() - date.today()).days
+    return expiry, strike, days_to_expiry
+
+
+class OptionChainCache():
+    """
+    In-memory cache of option chain definitions per underlying with a time to live
+
+    Chain discovery (contract details + reqSecDefOptParams) is the slow part of selecting a straddle and listed
+    expiries/strikes only change a few times a day, so lookups within ttl seconds reuse the last chain.
+    """
+
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+        self._chains: Dict[str, Tuple[float, OptionChain]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str) -> Optional[OptionChain]:
+        with self._lock:
+            entry = self._chains.get(symbol.upper())
+            if entry is None:
+                return None
+            stored_at, chain = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._chains[symbol.upper()]
+                return None
+            return chain
+
+    def put(self, chain: OptionChain):
+        with self._lock:
+            self._chains[chain.symbol] = (time.monotonic(), chain)
+
+    def invalidate(self, symbol: Optional[str] = None):
+        with self._lock:
+            if symbol is None:
+                self._chains.clear()
+            else:
+                self._chains.pop(symbol.upper(), None)
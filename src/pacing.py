@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Hashable, Optional
+
+
+class RequestPacer():
+    """
+    Keeps historical data requests under IB's pacing limits
+
+    Requests block in acquire() until sending them would not break any of the limits and call release() when they
+    complete. The defaults follow the IB historical data limitations:
+        - no more than max_requests requests in any window_seconds period (60 per 10 minutes)
+        - no more than max_in_flight simultaneous open requests (50)
+        - no more than burst_requests requests for the same contract and tick type within burst_seconds (6 per 2 seconds)
+        - no identical requests within identical_seconds (15 seconds)
+
+    IB only enforces the 60 per 10 minute limit for bars of 30 seconds or less; pass max_requests=None to turn it off
+    """
+
+    def __init__(self, max_requests: Optional[int] = 60, window_seconds: float = 600, max_in_flight: int = 50,
+                 burst_requests: int = 5, burst_seconds: float = 2, identical_seconds: float = 15):
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.max_in_flight = max_in_flight
+        self.burst_requests = burst_requests
+        self.burst_seconds = burst_seconds
+        self.identical_seconds = identical_seconds
+
+        self._cond = threading.Condition()
+        self._sent: Deque[float] = deque()                  # send times of every request in the current window
+        self._bursts: Dict[Hashable, Deque[float]] = {}     # send times per (contract, tick type)
+        self._identical: Dict[Hashable, float] = {}         # last send time per full request signature
+        self._in_flight = 0
+
+    def _wait_time(self, now: float, key: Hashable, signature: Hashable) -> float:
+        """ How long until a request with this key/signature may be sent (0 if it can go now) """
+
+        while self._sent and now - self._sent[0] >= self.window_seconds:
+            self._sent.popleft()
+
+        wait = 0.0
+        if self.max_requests is not None and len(self._sent) >= self.max_requests:
+            wait = max(wait, self._sent[0] + self.window_seconds - now)
+
+        burst = self._bursts.get(key)
+        if burst is not None:
+            while burst and now - burst[0] >= self.burst_seconds:
+                burst.popleft()
+            if len(burst) >= self.burst_requests:
+                wait = max(wait, burst[0] + self.burst_seconds - now)
+
+        last = self._identical.get(signature)
+        if last is not None and now - last < self.identical_seconds:
+            wait = max(wait, last + self.identical_seconds - now)
+
+        return wait
+
+    def acquire(self, key: Hashable = None, signature: Hashable = None, timeout: float = None) -> bool:
+        """
+        Blocks until a request may be sent; key groups requests by contract and tick type and signature identifies
+        the full request. Returns False if the timeout passed first
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self._wait_time(now, key, signature)
+                if self._in_flight >= self.max_in_flight:
+                    wait = None     # wait until a release() wakes us
+
+                if wait == 0.0:
+                    break
+
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        return False
+                    wait = remaining if wait is None else min(wait, remaining)
+
+                self._cond.wait(wait)
+
+            self._sent.append(now)
+            self._bursts.setdefault(key, deque()).append(now)
+            if signature is not None:
+                if len(self._identical) > 1024:
+                    self._identical = {sig: t for sig, t in self._identical.items() if now - t < self.identical_seconds}
+                self._identical[signature] = now
+            self._in_flight += 1
+            return True
+
+    def release(self):
+        """ Marks a request as complete (finished, failed or cancelled) """
+
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._cond.notify_all()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
@@ -0,0 +1,199 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from src.utils import black_scholes_straddle
+
+STRADDLE_FIELDS = ("call", "put", "straddle", "delta", "gamma", "vega", "theta")
+
+# below this many points the pool round trip costs more than it saves
+MIN_PARALLEL_SIZE = 200_000
+
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pool_lock = threading.Lock()
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool of the given size shared by every parallel call asking for that many workers
+
+    There is one pool per worker count, and pools are only shut down at exit, so a caller asking for a different size
+    never pulls the pool out from under another thread that is still submitting to it.
+    """
+
+    with _pool_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            # spawned rather than forked since callers (the dashboard's worker pool) run other threads
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers,
+                                                         mp_context=multiprocessing.get_context("spawn"))
+        return pool
+
+
+@atexit.register
+def shutdown_pool():
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _pools.clear()
+
+
+# (shared memory name, shape, dtype str) for arrays, or the plain value for scalars
+_ArraySpec = Tuple[str, Tuple[int, ...], str]
+
+
+class SharedResult(Mapping):
+    """
+    Result arrays of a parallel evaluation, living in the shared memory the workers wrote them into
+
+    Behaves like a read-only dict of field -> array, so callers use it the same way as the dict the serial kernel
+    returns. The shared memory names are unlinked as soon as the workers are done, so nothing is left behind in
+    /dev/shm; the mapping itself is released by close() (or when the result is garbage collected).
+    """
+
+    def __init__(self, blocks: Dict[str, shared_memory.SharedMemory], shape: Tuple[int, ...]):
+        self._blocks = blocks
+        self._arrays = {field: np.ndarray(shape, dtype=np.float64, buffer=block.buf) for field, block in blocks.items()}
+
+    def __getitem__(self, field):
+        return self._arrays[field]
+
+    def __iter__(self):
+        return iter(self._arrays)
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def close(self):
+        """ Releases the shared memory; arrays taken from this result must not be used afterwards """
+
+        self._arrays = {}
+        for block in self._blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                pass    # someone still holds a view; the mapping goes away with it
+        self._blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+def _share(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, _ArraySpec]:
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def _attach(spec: _ArraySpec) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name, track=False)
+    return block, np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def _straddle_worker(inputs: Dict[str, object], outputs: Dict[str, _ArraySpec], start: int, stop: int):
+    """ Runs in a pool process: prices points [start, stop) of the flattened inputs straight into the output blocks """
+
+    blocks, args = [], []
+    for name in ("S", "K", "T", "r", "sigma"):
+        spec = inputs[name]
+        if isinstance(spec, tuple):
+            block, array = _attach(spec)
+            blocks.append(block)
+            args.append(array[start:stop])
+        else:
+            args.append(spec)
+
+    result = black_scholes_straddle(*args)
+
+    for field, spec in outputs.items():
+        block, array = _attach(spec)
+        blocks.append(block)
+        array[start:stop] = result[field]
+
+    # drop every view into the blocks before closing them
+    del args, array, result
+    for block in blocks:
+        block.close()
+
+
+def parallel_straddle(S, K, T, r, sigma, workers: Optional[int] = None, min_parallel_size: int = MIN_PARALLEL_SIZE,
+                      max_task_points: Optional[int] = None):
+    """
+    Prices straddles across a process pool; same inputs and outputs as utils.black_scholes_straddle
+
+    Array inputs are broadcast to a common shape and placed in shared memory once instead of being pickled to every
+    worker (scalars are passed as is). Each worker prices a contiguous slice and writes it directly into the shared
+    output arrays, so the result is reassembled without any copies and comes back as a SharedResult of arrays with
+    the broadcast shape.
+
+    Falls back to the serial kernel (returning a plain dict) for a single worker or fewer than min_parallel_size points.
+    max_task_points caps the slice a single task prices, which bounds the kernel temporaries in each worker.
+    """
+
+    workers = workers or default_workers()
+    values = {"S": S, "K": K, "T": T, "r": r, "sigma": sigma}
+    shape = np.broadcast_shapes(*(np.shape(v) for v in values.values()))
+    n = int(np.prod(shape))
+
+    if workers <= 1 or n < min_parallel_size:
+        result = black_scholes_straddle(S, K, T, r, sigma)
+        return {field: np.broadcast_to(result[field], shape) for field in STRADDLE_FIELDS}
+
+    blocks, out_blocks = [], {}
+    try:
+        inputs = {}
+        for name, value in values.items():
+            if np.ndim(value) == 0:
+                inputs[name] = float(value)
+            else:
+                flat = np.ascontiguousarray(np.broadcast_to(np.asarray(value, dtype=np.float64), shape)).reshape(-1)
+                block, inputs[name] = _share(flat)
+                blocks.append(block)
+
+        for field in STRADDLE_FIELDS:
+            out_blocks[field] = shared_memory.SharedMemory(create=True, size=n * 8)
+        outputs = {field: (block.name, (n,), "<f8") for field, block in out_blocks.items()}
+
+        # a few slices per worker keeps the cores busy if some slices finish early
+        n_tasks = workers * 4
+        if max_task_points is not None:
+            n_tasks = max(n_tasks, -(-n // max_task_points))
+        bounds = np.linspace(0, n, n_tasks + 1, dtype=np.int64)
+        pool = get_pool(workers)
+        futures = [pool.submit(_straddle_worker, inputs, outputs, int(start), int(stop))
+                   for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        for future in futures:
+            future.result()
+    except BaseException:
+        for block in out_blocks.values():
+            block.close()
+            block.unlink()
+        raise
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    # the workers are done with the names; the mappings stay valid until the result is closed
+    for block in out_blocks.values():
+        block.unlink()
+
+    return SharedResult(out_blocks, shape)
@@ -0,0 +1,228 @@
+from datetime import date, datetime
+from typing import Dict, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.analysis import RISK_FREE_RATE
+from src.utils import black_scholes_greeks
+
+LEG_FIELDS = ("strike", "quantity", "multiplier", "entry_price", "iv")
+RISK_FIELDS = ("value", "pnl", "delta", "gamma", "vega", "theta")
+
+# per underlying market inputs can be one number for the whole book or a dict of underlying -> number
+MarketInput = Union[float, Dict[str, float]]
+
+
+def _to_day(expiry) -> np.datetime64:
+    if isinstance(expiry, str):
+        expiry = datetime.strptime(expiry, "%Y%m%d").date()
+    return np.datetime64(expiry, "D")
+
+
+class PositionBook():
+    """
+    Option legs across many underlyings stored as a structure of arrays
+
+    Every leg is one slot in a set of parallel arrays (underlying code, strike, expiry, call/put, signed quantity,
+    multiplier, entry price and iv) that grow by doubling like the bar buffer. Repricing the book is one kernel call
+    over all legs and the per underlying aggregation is a bincount over the underlying codes, so the cost of a
+    reprice or a shock does not depend on how the legs are spread across names.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self._size = 0
+        self.underlyings = []                     # code -> symbol
+        self._codes: Dict[str, int] = {}
+        self._underlying = np.empty(capacity, dtype=np.int64)
+        self._expiry = np.empty(capacity, dtype="datetime64[D]")
+        self._is_call = np.empty(capacity, dtype=bool)
+        self._cols = {field: np.empty(capacity, dtype=np.float64) for field in LEG_FIELDS}
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self):
+        capacity = max(1, 2 * len(self._underlying))
+        self._underlying = np.resize(self._underlying, capacity)
+        self._expiry = np.resize(self._expiry, capacity)
+        self._is_call = np.resize(self._is_call, capacity)
+        for field in LEG_FIELDS:
+            self._cols[field] = np.resize(self._cols[field], capacity)
+
+    def _code(self, underlying: str) -> int:
+        underlying = underlying.upper()
+        code = self._codes.get(underlying)
+        if code is None:
+            code = self._codes[underlying] = len(self.underlyings)
+            self.underlyings.append(underlying)
+        return code
+
+    def add_leg(self, underlying: str, strike: float, expiry, right: str, quantity: float, multiplier: float = 100,
+                entry_price: float = np.nan, iv: float = np.nan) -> int:
+        """
+        Adds one leg and returns its index
+
+        expiry is a date or an IB format YYYYMMDD string, right is 'C' or 'P', quantity is signed (negative for short)
+        and entry_price is the per share premium paid or received. iv is the leg's own iv (decimal); legs without one
+        use the underlying's iv passed to reprice.
+        """
+
+        if right.upper() not in ("C", "P"):
+            raise ValueError(f"right must be 'C' or 'P', got {right}")
+
+        i = self._size
+        if i == len(self._underlying):
+            self._grow()
+
+        self._underlying[i] = self._code(underlying)
+        self._expiry[i] = _to_day(expiry)
+        self._is_call[i] = right.upper() == "C"
+        values = (strike, quantity, multiplier, entry_price, iv)
+        for field, value in zip(LEG_FIELDS, values):
+            self._cols[field][i] = value
+        self._size = i + 1
+        return i
+
+    def add_straddle(self, underlying: str, strike: float, expiry, quantity: float, multiplier: float = 100,
+                     entry_price: float = np.nan, iv: float = np.nan):
+        """ Adds the call and put of a straddle; entry_price is the straddle premium and is split evenly between the legs """
+
+        leg_price = entry_price / 2
+        return (self.add_leg(underlying, strike, expiry, "C", quantity, multiplier, leg_price, iv),
+                self.add_leg(underlying, strike, expiry, "P", quantity, multiplier, leg_price, iv))
+
+    def column(self, field: str) -> np.ndarray:
+        """ View on the live part of a leg column """
+
+        if field == "underlying":
+            return self._underlying[:self._size]
+        if field == "expiry":
+            return self._expiry[:self._size]
+        if field == "is_call":
+            return self._is_call[:self._size]
+        return self._cols[field][:self._size]
+
+    def legs(self) -> pd.DataFrame:
+        """ The book as one row per leg """
+
+        n = self._size
+        return pd.DataFrame({
+            "underlying": np.array(self.underlyings, dtype=object)[self._underlying[:n]] if n else [],
+            "expiry": self._expiry[:n],
+            "right": np.where(self._is_call[:n], "C", "P"),
+            **{field: self._cols[field][:n] for field in LEG_FIELDS},
+        })
+
+    def _per_underlying(self, values: MarketInput, name: str) -> np.ndarray:
+        """ Broadcasts a per underlying input to an array indexed by underlying code """
+
+        if not isinstance(values, dict):
+            return np.full(len(self.underlyings), float(values))
+
+        by_symbol = {symbol.upper(): value for symbol, value in values.items()}
+        missing = [symbol for symbol in self.underlyings if symbol not in by_symbol]
+        if missing:
+            raise ValueError(f"No {name} for {', '.join(missing)}")
+        return np.array([by_symbol[symbol] for symbol in self.underlyings], dtype=np.float64)
+
+    def _market(self, spots: MarketInput, ivs: Optional[MarketInput], today: Optional[date], days_forward: float):
+        """ Per leg spot, iv, year fraction to expiry and alive mask """
+
+        n = self._size
+        codes = self._underlying[:n]
+        leg_iv = self._cols["iv"][:n]
+
+        spot = self._per_underlying(spots, "spot")[codes]
+        iv = np.where(np.isnan(leg_iv), self._per_underlying(np.nan if ivs is None else ivs, "iv")[codes], leg_iv)
+
+        today = np.datetime64(today or date.today(), "D")
+        days = (self._expiry[:n] - today).astype(np.float64) - days_forward
+        alive = days > 0
+        return spot, iv, np.where(alive, days, 1.0) / 365.0, alive
+
+    def reprice(self, spots: MarketInput, ivs: Optional[MarketInput] = None, r: float = RISK_FREE_RATE,
+                today: Optional[date] = None, spot_shock: MarketInput = 0.0, iv_shock: MarketInput = 0.0,
+                days_forward: float = 0) -> Dict:
+        """
+        Reprices every leg in one pass and aggregates the risk per underlying and for the whole book
+
+        spots and ivs are per underlying (legs with their own iv ignore ivs). spot_shock is a decimal move of the
+        underlying and iv_shock a decimal change of the iv relative to its level (eg. -0.4 for a 40% crush), both either
+        for the whole book or per underlying; days_forward ages every leg. Expired legs are valued at intrinsic.
+
+        Greeks are position greeks: delta in shares, gamma in shares per $1, vega in $ per vol point and theta in $ per
+        day, all scaled by quantity and multiplier. pnl is against the entry prices (nan for legs without one).
+
+        Returns {'legs': dict of per leg arrays, 'by_underlying': df indexed by underlying, 'total': dict}
+        """
+
+        n = self._size
+        codes = self._underlying[:n]
+        strike = self._cols["strike"][:n]
+        is_call = self._is_call[:n]
+
+        spot, iv, T, alive = self._market(spots, ivs, today, days_forward)
+        spot = spot * (1.0 + self._per_underlying(spot_shock, "spot shock")[codes])
+        iv = iv * (1.0 + self._per_underlying(iv_shock, "iv shock")[codes])
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            greeks = black_scholes_greeks(spot, strike, T, r, iv)
+
+        price = _leg_price(greeks, spot, strike, is_call, alive)
+        expired_delta = np.where(is_call, (spot > strike) * 1.0, (spot < strike) * -1.0)
+        delta = np.where(alive, np.where(is_call, greeks["call_delta"], greeks["put_delta"]), expired_delta)
+        theta = np.where(alive, np.where(is_call, greeks["call_theta"], greeks["put_theta"]), 0.0)
+
+        size = self._cols["quantity"][:n] * self._cols["multiplier"][:n]
+        legs = {
+            "price": price,
+            "value": price * size,
+            "pnl": (price - self._cols["entry_price"][:n]) * size,
+            "delta": delta * size,
+            "gamma": np.where(alive, greeks["gamma"], 0.0) * size,
+            "vega": np.where(alive, greeks["vega"], 0.0) * size,
+            "theta": theta * size,
+        }
+
+        n_underlyings = len(self.underlyings)
+        by_underlying = pd.DataFrame({field: np.bincount(codes, weights=legs[field], minlength=n_underlyings)
+                                      for field in RISK_FIELDS}, index=pd.Index(self.underlyings, name="underlying"))
+        total = {field: float(legs[field].sum()) for field in RISK_FIELDS}
+        return {"legs": legs, "by_underlying": by_underlying, "total": total}
+
+    def shock_grid(self, spots: MarketInput, ivs: Optional[MarketInput] = None, spot_shocks=(0.0,), iv_shocks=(0.0,),
+                   r: float = RISK_FREE_RATE, today: Optional[date] = None, days_forward: float = 0) -> pd.DataFrame:
+        """
+        Book value change for every (spot shock, iv shock) pair applied to all underlyings at once
+
+        Every scenario for every leg is priced in one broadcast kernel call; returns a df of the book PnL relative to
+        the unshocked book with the iv shocks as rows and the spot shocks as columns
+        """
+
+        spot_shocks = np.asarray(spot_shocks, dtype=np.float64)
+        iv_shocks = np.asarray(iv_shocks, dtype=np.float64)
+        base = self.reprice(spots, ivs, r, today, days_forward=days_forward)["total"]["value"]
+
+        n = self._size
+        strike = self._cols["strike"][:n]
+        is_call = self._is_call[:n]
+        size = self._cols["quantity"][:n] * self._cols["multiplier"][:n]
+        spot, iv, T, alive = self._market(spots, ivs, today, days_forward)
+
+        # axes: (iv shock, spot shock, leg)
+        S = spot * (1.0 + spot_shocks[None, :, None])
+        sigma = iv * (1.0 + iv_shocks[:, None, None])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            greeks = black_scholes_greeks(S, strike, T, r, sigma)
+
+        value = (_leg_price(greeks, S, strike, is_call, alive) * size).sum(axis=-1)
+        return pd.DataFrame(value - base, index=pd.Index(iv_shocks, name="iv_shock"),
+                            columns=pd.Index(spot_shocks, name="spot_shock"))
+
+
+def _leg_price(greeks, spot, strike, is_call, alive):
+    """ Call or put price per leg, intrinsic for expired legs """
+
+    intrinsic = np.where(is_call, np.maximum(spot - strike, 0.0), np.maximum(strike - spot, 0.0))
+    return np.where(alive, np.where(is_call, greeks["call"], greeks["put"]), intrinsic)
@@ -0,0 +1,111 @@
+import numpy as np
+
+from src.parallel import MIN_PARALLEL_SIZE, parallel_straddle
+from src.utils import black_scholes_straddle
+
+# default working memory budget for a single grid evaluation (bytes)
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# rough number of float64 temporaries the straddle kernel keeps alive per grid point
+_KERNEL_TEMPORARIES = 24
+
+GRID_FIELDS = ("straddle", "pnl_long", "pnl_short", "delta", "gamma", "vega", "theta")
+
+
+def _straddle_block(S, K, T, r, sigma):
+    """ Prices a block of the grid; points at or past expiry are valued at intrinsic with no time value greeks """
+
+    if T > 0:
+        return black_scholes_straddle(S, K, T, r, sigma)
+
+    shape = np.broadcast_shapes(np.shape(S), np.shape(sigma))
+    S = np.broadcast_to(S, shape)
+    zeros = np.zeros(shape)
+
+    return {
+        "straddle": np.abs(S - K),
+        "delta": np.sign(S - K),
+        "gamma": zeros,
+        "vega": zeros,
+        "theta": zeros,
+    }
+
+
+def scenario_grid(strike, entry_price, spots, ivs, days_to_expiry, r=0.05, memory_budget=DEFAULT_MEMORY_BUDGET,
+                  workers=1):
+    """
+    Evaluates the straddle over the full spot x IV x days-to-expiry cube in batched numpy calls
+
+    spots, ivs (decimal, annualized) and days_to_expiry are 1D axes; entry_price is the straddle price paid/received
+    when the position was opened and is used for the long and short PnL.
+
+    The dense outputs are allocated once and the grid is priced in blocks so the kernel temporaries never exceed
+    memory_budget bytes. Every output array has shape (len(days_to_expiry), len(ivs), len(spots)).
+
+    With more than one worker (opt in, eg. parallel.default_workers() for one per core) and at least
+    parallel.MIN_PARALLEL_SIZE unexpired points, the cube is priced on the shared memory process pool instead, in
+    tasks sized to the same memory budget.
+
+    Returns a dict with the axes ("spot", "iv", "dte") and the arrays in GRID_FIELDS
+    """
+
+    spots = np.atleast_1d(np.asarray(spots, dtype=np.float64))
+    ivs = np.atleast_1d(np.asarray(ivs, dtype=np.float64))
+    dtes = np.atleast_1d(np.asarray(days_to_expiry, dtype=np.float64))
+
+    if spots.ndim != 1 or ivs.ndim != 1 or dtes.ndim != 1:
+        raise ValueError("spots, ivs and days_to_expiry must be 1D axes")
+
+    n_dte, n_iv, n_spot = len(dtes), len(ivs), len(spots)
+    shape = (n_dte, n_iv, n_spot)
+    out = {field: np.empty(shape) for field in GRID_FIELDS}
+
+    # work out how many grid points we can price at once and turn that into a block of iv rows x spot columns
+    max_points = max(1, int(memory_budget) // (8 * _KERNEL_TEMPORARIES))
+    spot_block = min(n_spot, max_points)
+    iv_block = max(1, min(n_iv, max_points // spot_block))
+
+    workers = workers or 1
+    live = dtes > 0
+    pooled = np.zeros(n_dte, dtype=bool)
+    if workers > 1 and live.sum() * n_iv * n_spot >= MIN_PARALLEL_SIZE:
+        priced = parallel_straddle(spots[None, None, :], strike, dtes[live, None, None] / 365.0, r, ivs[None, :, None],
+                                   workers=workers, max_task_points=max_points)
+        try:
+            for field in ("straddle", "delta", "gamma", "vega", "theta"):
+                out[field][live] = priced[field]
+        finally:
+            if hasattr(priced, "close"):
+                priced.close()
+        pooled = live
+
+    for d, dte in enumerate(dtes):
+        if pooled[d]:
+            continue    # already priced on the pool; expired slices still go through the intrinsic path below
+        T = dte / 365.0
+
+        for i0 in range(0, n_iv, iv_block):
+            i1 = min(i0 + iv_block, n_iv)
+            sigma = ivs[i0:i1, None]
+
+            for s0 in range(0, n_spot, spot_block):
+                s1 = min(s0 + spot_block, n_spot)
+                block = _straddle_block(spots[None, s0:s1], strike, T, r, sigma)
+
+                for field in ("straddle", "delta", "gamma", "vega", "theta"):
+                    out[field][d, i0:i1, s0:s1] = block[field]
+
+    # pnl is a cheap elementwise pass over the finished price cube
+    np.subtract(out["straddle"], entry_price, out=out["pnl_long"])
+    np.negative(out["pnl_long"], out=out["pnl_short"])
+
+    out["spot"] = spots
+    out["iv"] = ivs
+    out["dte"] = dtes
+
+    return out
+
+
+def spot_moves(spot, max_move_pct, n):
+    """ Helper for building a symmetric spot axis of n points within +/- max_move_pct (decimal) of the current spot """
+    return spot * (1.0 + np.linspace(-max_move_pct, max_move_pct, n))
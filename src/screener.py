@@ -0,0 +1,390 @@
+"""
+Earnings universe screener: ranks upcoming events by the expected edge of selling the ATM straddle
+
+For every symbol in a universe file (symbol, event_date and optionally timing 'amc'/'bmo', one row per earnings
+date) it pulls daily spot and IV bars through IBApp, computes the IV rank and percentile, prices the ATM straddle for
+the next event the same way the dashboard does (price_straddle) to get the implied move, and replays the realized
+move and IV crush of every past event in the file onto today's straddle. Names are ranked by the average short
+straddle PnL of that replay as a fraction of the premium:
+
+    uv run python -m src.screener universe.csv --out ranked.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from src.analysis import RISK_FREE_RATE, price_straddle
+from src.backtest import AFTER_CLOSE, align_daily_bars, backtest_events
+from src.bar_cache import DEFAULT_CACHE_DIR, trim_to_duration
+from src.option_chain import select_atm_straddle
+from src.utils import black_scholes_straddle
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+DEFAULT_STATE_PATH = DEFAULT_CACHE_DIR.parent / "screener_state.json"
+
+# sessions the IV rank and percentile are measured over (one year of daily bars)
+IV_RANK_WINDOW = 252
+
+WHAT_TO_SHOW = ("TRADES", "OPTION_IMPLIED_VOLATILITY")
+BAR_SIZE = "1 day"
+
+
+def iv_rank(iv: np.ndarray, window: int = IV_RANK_WINDOW) -> Dict[str, float]:
+    """
+    IV rank and percentile of the last value over the last window values
+
+    Rank is where the current IV sits between the window's low and high (0 at the low, 1 at the high); percentile is
+    the fraction of the earlier sessions with a lower IV
+    """
+
+    history = np.asarray(iv, dtype=np.float64)[-window:]
+    current = history[-1]
+    low, high = history.min(), history.max()
+    return {
+        "iv_rank": float((current - low) / (high - low)) if high > low else float("nan"),
+        "iv_percentile": float((history[:-1] < current).mean()) if len(history) > 1 else float("nan"),
+    }
+
+
+def replay_past_events(spot: float, strike: float, iv: float, days_to_expiry: int, straddle: float,
+                       past: pd.DataFrame, r: float = RISK_FREE_RATE) -> Dict[str, float]:
+    """
+    Short straddle PnL of today's straddle under each past event's realized move and IV crush
+
+    past is backtest_events output; every event's signed spot move (exit / entry spot) and IV ratio (exit / entry IV)
+    is applied to the current spot and IV, held for as many days as the event was, and all of them are priced in one
+    kernel call. The mean is the expected edge; with no past events everything is NaN.
+    """
+
+    if len(past) == 0:
+        nan = float("nan")
+        return {"expected_pnl_short": nan, "expected_edge": nan, "win_rate_short": nan, "worst_pnl_short": nan}
+
+    moves = past["exit_spot"].to_numpy() / past["entry_spot"].to_numpy()
+    crushes = past["exit_iv"].to_numpy() / past["entry_iv"].to_numpy()
+    held_days = (past["exit_date"] - past["entry_date"]).dt.days.to_numpy()
+
+    new_spot = spot * moves
+    T_exit = np.maximum(days_to_expiry - held_days, 0) / 365.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        exit_ = black_scholes_straddle(new_spot, np.full(len(past), strike), np.maximum(T_exit, 1e-10), r, iv * crushes)
+    exit_price = np.where(T_exit > 0, exit_["straddle"], np.abs(new_spot - strike))
+
+    pnl_short = straddle - exit_price
+    return {
+        "expected_pnl_short": float(pnl_short.mean()),
+        "expected_edge": float(pnl_short.mean() / straddle),
+        "win_rate_short": float((pnl_short > 0).mean()),
+        "worst_pnl_short": float(pnl_short.min()),
+    }
+
+
+def split_events(events: pd.DataFrame, today: Optional[date] = None) -> Dict[str, Dict]:
+    """
+    Groups a universe by symbol into its next event (or None) and a df of its past events
+
+    Events dated today count as upcoming so a name reporting tonight is screened rather than backtested
+    """
+
+    import pandas as pd
+
+    events = events.copy()
+    events["symbol"] = events["symbol"].str.upper().str.strip()
+    if "timing" not in events.columns:
+        events["timing"] = AFTER_CLOSE
+    events["timing"] = events["timing"].fillna(AFTER_CLOSE).str.lower()
+    events["event_date"] = pd.to_datetime(events["event_date"]).dt.normalize()
+    today = pd.Timestamp(today if today is not None else date.today())
+
+    universe = {}
+    for symbol, group in events.sort_values("event_date").groupby("symbol", sort=False):
+        upcoming = group[group["event_date"] >= today]
+        universe[symbol] = {
+            "next": upcoming.iloc[0] if len(upcoming) else None,
+            "past": group[group["event_date"] < today][["symbol", "event_date", "timing"]],
+        }
+    return universe
+
+
+def fingerprint(bars: pd.DataFrame, entry: Dict, params: Dict) -> str:
+    """ Hash of everything a symbol's screen result depends on: its aligned bars, its events and the run parameters """
+
+    import pandas as pd
+
+    digest = hashlib.sha1(pd.util.hash_pandas_object(bars, index=True).to_numpy().tobytes())
+    events = [str(d.date()) for d in entry["past"]["event_date"]] + list(entry["past"]["timing"])
+    if entry["next"] is not None:
+        events += [str(entry["next"]["event_date"].date()), entry["next"]["timing"]]
+    digest.update(json.dumps([events, params], sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class ScreenerState():
+    """
+    Fingerprint and result of every symbol from the last run, kept in a JSON file
+
+    A symbol whose fingerprint has not changed is served from here instead of being priced again (and, when its bars
+    are current in the bar cache, without any IB request at all)
+    """
+
+    def __init__(self, path: Optional[os.PathLike] = None):
+        self.path = Path(path) if path is not None else DEFAULT_STATE_PATH
+        self._lock = threading.Lock()
+        self.symbols: Dict[str, Dict] = {}
+        if self.path.exists():
+            try:
+                self.symbols = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                self.symbols = {}     # a corrupt state file just means every symbol is screened again
+
+    def get(self, symbol: str, fingerprint: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self.symbols.get(symbol)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return None
+        return dict(entry["result"])
+
+    def put(self, symbol: str, fingerprint: str, result: Dict):
+        with self._lock:
+            self.symbols[symbol] = {"fingerprint": fingerprint, "result": result}
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            text = json.dumps(self.symbols, default=str)
+
+        # write to a temp file and swap it in so an interrupted save never loses the last state
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(text)
+        os.replace(tmp, self.path)
+
+
+def cached_bars(bar_cache, symbol: str, durationStr: str) -> Optional[pd.DataFrame]:
+    """
+    Aligned daily bars straight from the bar cache, or None if either series needs a top-up from IB
+
+    Only series whose last cached bar is a completed session are served (see BarCache.top_up_duration); a bar dated
+    today may have been cached mid session, so the current day is always fetched again.
+    """
+
+    if bar_cache is None:
+        return None
+
+    frames = {}
+    for what in WHAT_TO_SHOW:
+        if bar_cache.top_up_duration(symbol, what, BAR_SIZE, durationStr) is not None:
+            return None
+        frames[what] = trim_to_duration(bar_cache.load(symbol, what, BAR_SIZE), durationStr)
+    return align_daily_bars(frames["TRADES"], frames["OPTION_IMPLIED_VOLATILITY"])
+
+
+def screen_universe(ib_app, events: pd.DataFrame, days_to_expiry: Optional[int] = None, use_chain: bool = True,
+                    durationStr: str = "2 Y", window: int = IV_RANK_WINDOW, r: float = RISK_FREE_RATE,
+                    state: Optional[ScreenerState] = None, max_workers: int = 8, timeout: float = 60) -> Iterator[Dict]:
+    """
+    Screens every symbol of a universe and yields one result dict per symbol as soon as it is ready
+
+    Symbols whose cached daily bars end with a completed session are screened first without any IB request; the rest
+    are fetched with IBApp.fetch_historical_batch and handed to a thread pool (for the chain lookup and pricing) in
+    completion order. With a state, a symbol whose fingerprint matches the last run is returned from the state with
+    'cached' set. Failed symbols come back as {'symbol', 'error'} so one bad name never stops the screen.
+    """
+
+    if not use_chain and days_to_expiry is None:
+        raise ValueError("days_to_expiry is required when the option chain is not used")
+
+    universe = split_events(events)
+    today = date.today()
+    params = {"days_to_expiry": days_to_expiry, "use_chain": use_chain, "duration": durationStr, "window": window,
+              "r": r, "today": today}
+
+    def screen_symbol(symbol, bars):
+        if len(bars) == 0:
+            return {"symbol": symbol, "error": "No overlapping price and IV bars"}
+
+        entry = universe[symbol]
+        key = fingerprint(bars, entry, params) if state is not None else None
+        if state is not None:
+            result = state.get(symbol, key)
+            if result is not None:
+                result["cached"] = True
+                return result
+
+        event_date = entry["next"]["event_date"].date() if entry["next"] is not None else None
+        spot = float(bars["close_spot"].iloc[-1])
+        iv = float(bars["close_iv"].iloc[-1])
+        strike, dte, expiry = spot, days_to_expiry, None
+        if use_chain:
+            chain = ib_app.get_option_chain(symbol)
+            expiry, strike, dte = select_atm_straddle(chain, spot, event_date)
+
+        straddle = price_straddle(spot, strike, iv, dte, r)["straddle"]
+        past = backtest_events({symbol: bars}, entry["past"], dte, r)
+
+        result = {
+            "symbol": symbol,
+            "event_date": str(event_date) if event_date is not None else None,
+            "timing": entry["next"]["timing"] if entry["next"] is not None else None,
+            "spot": spot,
+            "iv": iv,
+            **iv_rank(bars["close_iv"].to_numpy(), window),
+            "expiry": expiry,
+            "strike": strike,
+            "days_to_expiry": dte,
+            "straddle": straddle,
+            "implied_move": straddle / spot,
+            "past_events": len(past),
+            "avg_realized_move": float(past["realized_move"].mean()) if len(past) else float("nan"),
+            "max_realized_move": float(past["realized_move"].max()) if len(past) else float("nan"),
+            "avg_past_implied_move": float(past["implied_move"].mean()) if len(past) else float("nan"),
+            "avg_iv_crush": float(1.0 - (past["exit_iv"] / past["entry_iv"]).mean()) if len(past) else float("nan"),
+            **replay_past_events(spot, strike, iv, dte, straddle, past, r),
+        }
+        realized = result["avg_realized_move"]
+        result["move_ratio"] = result["implied_move"] / realized if realized > 0 else float("nan")
+        if state is not None:
+            state.put(symbol, key, result)
+        return dict(result, cached=False)
+
+    bar_cache = getattr(ib_app, "bar_cache", None)
+    to_fetch = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {}
+            for symbol in universe:
+                bars = cached_bars(bar_cache, symbol, durationStr)
+                if bars is None:
+                    to_fetch.append(symbol)
+                else:
+                    futures[symbol] = pool.submit(screen_symbol, symbol, bars)
+
+            for symbol, frames, error in ib_app.fetch_historical_batch(to_fetch, WHAT_TO_SHOW, timeout=timeout,
+                                                                     durationStr=durationStr, barSizeSetting=BAR_SIZE):
+                if error is not None:
+                    yield _error_result(symbol, error)
+                else:
+                    futures[symbol] = pool.submit(screen_symbol, symbol,
+                                                  align_daily_bars(frames["TRADES"], frames["OPTION_IMPLIED_VOLATILITY"]))
+
+                # hand back whatever has already finished so results stream out while the fetch continues
+                for done_symbol in [s for s, f in futures.items() if f.done()]:
+                    yield _result_or_error(done_symbol, futures.pop(done_symbol))
+
+            symbol_of = {future: symbol for symbol, future in futures.items()}
+            for future in as_completed(symbol_of):
+                yield _result_or_error(symbol_of[future], future)
+    finally:
+        if state is not None:
+            state.save()
+
+
+def _result_or_error(symbol: str, future) -> Dict:
+    try:
+        return future.result()
+    except Exception as e:
+        return _error_result(symbol, e)
+
+
+def _error_result(symbol: str, error: Exception) -> Dict:
+    return {"symbol": symbol.upper(), "error": getattr(error, "message", str(error))}
+
+
+def rank_results(results: List[Dict]) -> pd.DataFrame:
+    """ Screen results as a df ranked by expected edge (names without past events last, failed names dropped) """
+
+    import pandas as pd
+
+    ranked = pd.DataFrame([result for result in results if "error" not in result])
+    if len(ranked) == 0:
+        return ranked
+    ranked = ranked.sort_values(["expected_edge", "move_ratio"], ascending=False, na_position="last", ignore_index=True)
+    ranked.insert(0, "rank", np.arange(1, len(ranked) + 1))
+    return ranked
+
+
+def format_result(result: Dict) -> str:
+    if "error" in result:
+        return f"{result['symbol']}: {result['error']}"
+
+    line = (f"{result['symbol']}: IV {result['iv']:.0%} (rank {result['iv_rank']:.2f}), "
+            f"implied move {result['implied_move']:.1%}")
+    if result["past_events"]:
+        line += (f" vs {result['avg_realized_move']:.1%} realized over {result['past_events']} events, "
+                 f"edge {result['expected_edge']:+.0%}")
+    return line + (" (unchanged)" if result.get("cached") else "")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("universe", type=Path, help="CSV with symbol, event_date (YYYY-MM-DD) and optionally timing (amc/bmo)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default="7497")
+    parser.add_argument("--clients", type=int, default=1,
+                        help="Number of TWS client sessions (clientIds 1..N) to spread the requests over (default: 1)")
+    parser.add_argument("--duration", default="2 Y", help="History of daily bars to pull (default: 2 Y)")
+    parser.add_argument("--window", type=int, default=IV_RANK_WINDOW,
+                        help=f"Sessions for IV rank and percentile (default: {IV_RANK_WINDOW})")
+    parser.add_argument("--dte", type=int, help="Days to expiry; with --no-chain the strike is the spot price")
+    parser.add_argument("--no-chain", action="store_true", help="Do not look up option chains (needs --dte)")
+    parser.add_argument("--state", type=Path, default=DEFAULT_STATE_PATH,
+                        help="Fingerprint file used to skip unchanged symbols (default: ~/.cache/iv_crush/screener_state.json)")
+    parser.add_argument("--full", action="store_true", help="Screen every symbol again even if its inputs are unchanged")
+    parser.add_argument("--top", type=int, default=10, help="Number of ranked names to print (default: 10)")
+    parser.add_argument("--out", type=Path, default=Path("crush_candidates.csv"), help="Output file (.csv or .parquet)")
+    parser.add_argument("--metrics", type=Path, help="Write request latency / throughput / pricing metrics here (.json or .prom)")
+    return parser
+
+
+def main(argv=None):
+    import pandas as pd
+
+    from src.cli import close_app, connect_app, write_metrics, write_results
+
+    args = build_parser().parse_args(argv)
+    if args.no_chain and args.dte is None:
+        raise SystemExit("--no-chain needs --dte")
+
+    events = pd.read_csv(args.universe)
+    missing = {"symbol", "event_date"} - set(events.columns)
+    if missing:
+        raise SystemExit(f"{args.universe} is missing the column(s) {', '.join(sorted(missing))}")
+
+    state = ScreenerState(args.state)
+    if args.full:
+        state.symbols.clear()
+
+    ib_app = connect_app(args.host, args.port, args.clients)
+    results = []
+    try:
+        for result in screen_universe(ib_app, events, days_to_expiry=args.dte, use_chain=not args.no_chain,
+                                      durationStr=args.duration, window=args.window, state=state):
+            print(format_result(result), file=sys.stderr if "error" in result else sys.stdout)
+            results.append(result)
+    finally:
+        close_app(ib_app)
+
+    ranked = rank_results(results)
+    write_results([ranked], args.out)
+    print(f"\nWrote {len(ranked)} ranked names to {args.out}")
+    if len(ranked):
+        columns = ["rank", "symbol", "event_date", "iv_rank", "implied_move", "avg_realized_move", "expected_edge"]
+        print(ranked[columns].head(args.top).to_string(index=False))
+    write_metrics(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
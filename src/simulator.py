@@ -0,0 +1,456 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+import traceback
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ibapi.client import EClient
+from ibapi.common import BarData
+from ibapi.contract import Contract, ContractDetails
+
+from src.bar_cache import bar_size_seconds, duration_seconds
+from src.ib_client import IBApp, contract_key
+from src.pacing import RequestPacer
+from src.streaming import ASK, BID, LAST, OPTION_IMPLIED_VOL
+from src.utils import black_scholes_greeks
+
+SIMULATED_SERVER_VERSION = 157
+
+# error codes and messages the way TWS sends them
+PACING_VIOLATION = (162, "Historical Market Data Service error message:Historical data request pacing violation")
+NO_DATA = (162, "Historical Market Data Service error message:HMDS query returned no data")
+NO_SECURITY = (200, "No security definition has been found for the request")
+NOT_SUBSCRIBED = (354, "Requested market data is not subscribed")
+NOT_CONNECTED = (504, "Not connected")
+CONNECT_FAILED = (502, "Couldn't connect to TWS. Confirm that \"Enable ActiveX and Socket Clients\" is enabled")
+RANDOM_ERRORS = (NO_DATA, NO_SECURITY, NOT_SUBSCRIBED)
+
+# tracebacks kept in callback_failures; the count in stats keeps going
+MAX_CALLBACK_FAILURES = 10
+
+_SESSION_SECONDS = 6.5 * 3600       # regular trading hours, 09:30 to 16:00
+_IV_DAILY = 0.5 / np.sqrt(252)      # TWS sends IV bars in daily units
+
+
+def _series_seed(seed: int, *parts) -> int:
+    return zlib.crc32("|".join(map(str, (seed,) + parts)).encode())
+
+
+def base_price(symbol: str, seed: int = 0) -> float:
+    """ Deterministic starting price of a simulated underlying """
+    return 20.0 + _series_seed(seed, symbol.upper()) % 480
+
+
+class SimulatedIBApp(IBApp):
+    """
+    IBApp wired to an in-process stand-in for TWS instead of a socket
+
+    The EClient request methods are answered by a simulated server running on its own "reader" thread, so callbacks
+    arrive asynchronously on a different thread exactly like they do from a live TWS. Historical requests replay the
+    recorded frames given in bars (keyed by (symbol, whatToShow)) or otherwise a deterministic synthetic random walk
+    per symbol, after latency (+ uniform jitter) seconds and, with bars_per_second, spread out at that rate.
+
+    Failures are injected at configurable rates: error_rate answers a request with one of the usual IB errors,
+    drop_rate never answers it (to exercise timeouts) and pacing_violation_rate rejects it as a pacing violation.
+    With enforce_pacing the server also applies IB's historical data pacing rules itself (60 requests of <= 30 sec
+    bars per 10 minutes, 6 requests per contract and tick type per 2 seconds, no identical requests within 15
+    seconds, 50 open requests) and rejects whatever breaks them with error 162, so the client side pacer is tested
+    against the real limits. Everything is counted in stats.
+
+    Everything random is drawn from seed, so a run with the same requests in the same order is reproducible.
+    """
+
+    def __init__(self, bars: Optional[Dict[Tuple[str, str], pd.DataFrame]] = None, latency: float = 0.05,
+                 jitter: float = 0.0, bars_per_second: Optional[float] = None, error_rate: float = 0.0,
+                 drop_rate: float = 0.0, pacing_violation_rate: float = 0.0, enforce_pacing: bool = True,
+                 refuse_connection: bool = False, tick_interval: float = 0.25, seed: int = 0, **kwargs):
+        super().__init__(**kwargs)
+
+        self.recorded = {(symbol.upper(), what): df for (symbol, what), df in (bars or {}).items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.bars_per_second = bars_per_second
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.pacing_violation_rate = pacing_violation_rate
+        self.enforce_pacing = enforce_pacing
+        self.refuse_connection = refuse_connection
+        self.tick_interval = tick_interval
+        self.seed = seed
+
+        self.stats = {"requests": 0, "bars_sent": 0, "errors": 0, "pacing_violations": 0, "dropped": 0, "cancelled": 0,
+                      "callback_failures": 0}
+        # tracebacks of the first few callbacks that raised (a raise in an IBApp callback is a client bug)
+        self.callback_failures: List[str] = []
+        self._stats_lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+        # IB's limits as the server sees them; small bars count towards the 60 per 10 minutes rule
+        self._small_bar_pacer = RequestPacer()
+        self._large_bar_pacer = RequestPacer(max_requests=None)
+        self._open_requests: Dict[int, Optional[RequestPacer]] = {}     # reqId -> server pacer slot it holds
+        self._cancelled = set()
+        self._streams = set()
+        self._series_cache: Dict[tuple, List[BarData]] = {}
+
+        # the simulated reader thread works through a heap of (due time, seq, callback, args)
+        self._events: list = []
+        self._seq = itertools.count()
+        self._events_cond = threading.Condition()
+        self._reader: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._stopped.set()
+
+    # ---- simulated connection ----
+
+    def connect(self, host, port, clientId):
+        self.host, self.port, self.clientId = host, port, clientId
+        if self.refuse_connection:
+            self.error(-1, *CONNECT_FAILED)
+            raise OSError(CONNECT_FAILED[1])
+
+        # a reader left over from a dropped connection has to be gone before the stop flag is cleared for the new one
+        if self._reader is not None and self._reader is not threading.current_thread():
+            self._reader.join()
+
+        self._stopped.clear()
+        self.serverVersion_ = SIMULATED_SERVER_VERSION
+        self.connTime = datetime.now().strftime("%Y%m%d %H:%M:%S")
+        self.setConnState(EClient.CONNECTED)
+        self._reader = threading.Thread(target=self._reader_loop, daemon=True)
+        self._reader.start()
+        self._schedule(self._delay(), self.nextValidId, 1)
+
+    def run(self):
+        """ connect_ib runs this on its connection thread; like EClient.run it returns once the connection is gone """
+        self._stopped.wait()
+
+    def isConnected(self):
+        return not self._stopped.is_set()
+
+    def disconnect(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        with self._events_cond:
+            self._events.clear()
+            self._events_cond.notify_all()
+        self.setConnState(EClient.DISCONNECTED)
+        self.connectionClosed()
+
+    def drop_connection(self):
+        """ Simulates TWS going away (restart, network drop): error 1100 and then the connection closes """
+
+        self.error(-1, 1100, "Connectivity between IB and Trader Workstation has been lost.")
+        self.disconnect()
+
+    def _not_connected(self, reqId) -> bool:
+        """ Like EClient, a request made without a connection is answered right away with error 504 instead of being sent """
+
+        if self.isConnected():
+            return False
+        self.error(reqId, *NOT_CONNECTED)
+        return True
+
+    # ---- simulated reader thread ----
+
+    def _delay(self) -> float:
+        with self._rng_lock:
+            return self.latency + (self._rng.uniform(0.0, self.jitter) if self.jitter else 0.0)
+
+    def _roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < rate
+
+    def _schedule(self, delay: float, fn: Callable, *args):
+        with self._events_cond:
+            heapq.heappush(self._events, (time.monotonic() + delay, next(self._seq), fn, args))
+            self._events_cond.notify()
+
+    def _reader_loop(self):
+        while not self._stopped.is_set():
+            with self._events_cond:
+                if not self._events:
+                    self._events_cond.wait(0.1)
+                    continue
+                due, _, fn, args = self._events[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._events_cond.wait(wait)
+                    continue
+                heapq.heappop(self._events)
+
+            try:
+                fn(*args)
+            except Exception:
+                self._count("callback_failures")
+                with self._stats_lock:
+                    if len(self.callback_failures) < MAX_CALLBACK_FAILURES:
+                        self.callback_failures.append(traceback.format_exc())
+
+    def _count(self, stat: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[stat] += n
+
+    def _send_error(self, reqId: int, error: Tuple[int, str], stat: str = "errors"):
+        self._count(stat)
+        self._schedule(self._delay(), self._error_if_open, reqId, error)
+
+    def _error_if_open(self, reqId, error):
+        self._finish(reqId)
+        self.error(reqId, *error)
+
+    def _finish(self, reqId: int):
+        pacer = self._open_requests.pop(reqId, None)
+        if pacer is not None:
+            pacer.release()
+
+    # ---- historical data ----
+
+    def reqHistoricalData(self, reqId, contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH,
+                          formatDate, keepUpToDate, chartOptions):
+        if self._not_connected(reqId):
+            return
+        self._count("requests")
+
+        if self._roll(self.drop_rate):
+            self._count("dropped")
+            return
+
+        if self._roll(self.pacing_violation_rate) or not self._admit(reqId, contract, whatToShow, durationStr, barSizeSetting):
+            self._send_error(reqId, PACING_VIOLATION, "pacing_violations")
+            return
+
+        self._open_requests.setdefault(reqId, None)
+        if self._roll(self.error_rate):
+            with self._rng_lock:
+                error = self._rng.choice(RANDOM_ERRORS)
+            self._send_error(reqId, error)
+            return
+
+        bars = self._bars_for(contract.symbol, whatToShow, durationStr, barSizeSetting, endDateTime)
+        if not bars:
+            self._send_error(reqId, NO_DATA)
+            return
+
+        delay = self._delay()
+        if not self.bars_per_second:
+            self._schedule(delay, self._deliver, reqId, bars, True)
+            return
+
+        # spread the bars out in chunks of ~10ms worth at the configured rate
+        chunk = max(1, int(self.bars_per_second / 100))
+        for i, start in enumerate(range(0, len(bars), chunk)):
+            last = start + chunk >= len(bars)
+            self._schedule(delay + i * chunk / self.bars_per_second, self._deliver, reqId, bars[start:start + chunk], last)
+
+    def _admit(self, reqId, contract, whatToShow, durationStr, barSizeSetting) -> bool:
+        if not self.enforce_pacing:
+            return True
+
+        pacer = self._small_bar_pacer if bar_size_seconds(barSizeSetting) <= 30 else self._large_bar_pacer
+        key = (contract_key(contract), whatToShow)
+        if not pacer.acquire(key=key, signature=(key, durationStr, barSizeSetting), timeout=0):
+            return False
+        self._open_requests[reqId] = pacer
+        return True
+
+    def _deliver(self, reqId, bars, last):
+        if reqId in self._cancelled:
+            if last:
+                self._cancelled.discard(reqId)
+            return
+
+        for bar in bars:
+            self.historicalData(reqId, bar)
+        self._count("bars_sent", len(bars))
+
+        if last:
+            self._finish(reqId)
+            self.historicalDataEnd(reqId, "", "")
+
+    def cancelHistoricalData(self, reqId):
+        if reqId not in self._open_requests:
+            return
+        self._count("cancelled")
+        self._cancelled.add(reqId)
+        self._finish(reqId)
+
+    def _bars_for(self, symbol: str, whatToShow: str, durationStr: str, barSizeSetting: str, endDateTime: str) -> List[BarData]:
+        symbol = symbol.upper()
+        key = (symbol, whatToShow, durationStr, barSizeSetting, endDateTime[:8])
+        bars = self._series_cache.get(key)
+        if bars is None:
+            recorded = self.recorded.get((symbol, whatToShow))
+            if recorded is not None:
+                bars = _frame_to_bars(recorded, durationStr, barSizeSetting)
+            else:
+                end = datetime.strptime(endDateTime[:8], "%Y%m%d").date() if endDateTime else date.today()
+                bars = synthetic_bars(symbol, whatToShow, durationStr, barSizeSetting, end, self.seed)
+            self._series_cache[key] = bars
+        return bars
+
+    # ---- contract details, option chains and market data ----
+
+    def reqContractDetails(self, reqId, contract):
+        if self._not_connected(reqId):
+            return
+        self._count("requests")
+        if self._roll(self.error_rate):
+            self._send_error(reqId, NO_SECURITY)
+            return
+
+        details = ContractDetails()
+        details.contract = Contract()
+        details.contract.symbol = contract.symbol.upper()
+        details.contract.secType = contract.secType
+        details.contract.exchange = contract.exchange
+        details.contract.currency = contract.currency
+        details.contract.conId = _series_seed(self.seed, contract.symbol.upper()) % 10**8
+
+        delay = self._delay()
+        self._schedule(delay, self.contractDetails, reqId, details)
+        self._schedule(delay, self.contractDetailsEnd, reqId)
+
+    def reqSecDefOptParams(self, reqId, underlyingSymbol, futFopExchange, underlyingSecType, underlyingConId):
+        if self._not_connected(reqId):
+            return
+        self._count("requests")
+        spot = base_price(underlyingSymbol, self.seed)
+        step = 1.0 if spot < 100 else 5.0
+        strikes = {float(k) for k in np.arange(round(spot * 0.7 / step) * step, spot * 1.3, step)}
+
+        # weekly expiries on the next eight fridays
+        today = date.today()
+        first_friday = today + timedelta(days=(4 - today.weekday()) % 7 or 7)
+        expirations = {(first_friday + timedelta(weeks=i)).strftime("%Y%m%d") for i in range(8)}
+
+        delay = self._delay()
+        self._schedule(delay, self.securityDefinitionOptionParameter, reqId, "SMART", underlyingConId,
+                       underlyingSymbol.upper(), "100", expirations, strikes)
+        self._schedule(delay, self.securityDefinitionOptionParameterEnd, reqId)
+
+    def _quote(self, contract) -> float:
+        """ Last price of the simulated contract: the underlying's base price or a Black-Scholes option price """
+
+        spot = base_price(contract.symbol, self.seed)
+        if contract.secType != "OPT":
+            return spot
+
+        expiry = datetime.strptime(contract.lastTradeDateOrContractMonth, "%Y%m%d").date()
+        T = max((expiry - date.today()).days, 1) / 365.0
+        greeks = black_scholes_greeks(spot, contract.strike, T, 0.05, _IV_DAILY * np.sqrt(252))
+        return float(greeks["call"] if contract.right == "C" else greeks["put"])
+
+    def _send_ticks(self, reqId, price, generic_iv):
+        spread = max(0.01, round(price * 0.002, 2))
+        self.tickPrice(reqId, BID, round(price - spread / 2, 2), None)
+        self.tickPrice(reqId, ASK, round(price + spread / 2, 2), None)
+        self.tickPrice(reqId, LAST, round(price, 2), None)
+        if generic_iv:
+            self.tickGeneric(reqId, OPTION_IMPLIED_VOL, _IV_DAILY * np.sqrt(252))
+
+    def reqMktData(self, reqId, contract, genericTickList, snapshot, regulatorySnapshot, mktDataOptions):
+        if self._not_connected(reqId):
+            return
+        self._count("requests")
+        if self._roll(self.error_rate):
+            self._send_error(reqId, NOT_SUBSCRIBED)
+            return
+
+        price = self._quote(contract)
+        generic_iv = "106" in genericTickList.split(",")
+        delay = self._delay()
+        self._schedule(delay, self._send_ticks, reqId, price, generic_iv)
+        if snapshot:
+            self._schedule(delay, self.tickSnapshotEnd, reqId)
+            return
+
+        self._streams.add(reqId)
+        self._schedule(delay + self.tick_interval, self._stream_tick, reqId, price, generic_iv)
+
+    def _stream_tick(self, reqId, price, generic_iv):
+        if reqId not in self._streams:
+            return
+        with self._rng_lock:
+            price *= 1.0 + self._rng.gauss(0.0, 0.0005)
+        self._send_ticks(reqId, price, generic_iv)
+        self._schedule(self.tick_interval, self._stream_tick, reqId, price, generic_iv)
+
+    def cancelMktData(self, reqId):
+        self._streams.discard(reqId)
+
+
+def synthetic_bars(symbol: str, whatToShow: str, durationStr: str, barSizeSetting: str, end: date,
+                   seed: int = 0) -> List[BarData]:
+    """
+    Regular trading hours bars for the duration ending on end: a random walk around the symbol's base price for
+    TRADES and around a 50% annualized IV (in TWS's daily units) for OPTION_IMPLIED_VOLATILITY. The same arguments
+    always produce the same bars.
+    """
+
+    span_days = max(1, int(np.ceil(duration_seconds(durationStr) / 86400)))
+    bar_seconds = bar_size_seconds(barSizeSetting)
+
+    end = np.datetime64(end, "D")
+    days = np.arange(end - span_days + 1, end + 1, dtype="datetime64[D]")
+    days = days[np.is_busday(days)]
+    if len(days) == 0:
+        return []
+
+    daily = bar_seconds >= 86400
+    if daily:
+        stamps = days.astype("datetime64[s]")
+    else:
+        offsets = np.arange(0, _SESSION_SECONDS, bar_seconds).astype("timedelta64[s]")
+        stamps = (days.astype("datetime64[s]")[:, None] + np.timedelta64(9 * 3600 + 30 * 60, "s") + offsets).ravel()
+
+    rng = np.random.default_rng(_series_seed(seed, symbol.upper(), whatToShow, barSizeSetting))
+    n = len(stamps)
+    if whatToShow == "OPTION_IMPLIED_VOLATILITY":
+        level, step = _IV_DAILY, 0.002 * np.sqrt(bar_seconds / 86400)
+    else:
+        level, step = base_price(symbol, seed), 0.02 * np.sqrt(min(bar_seconds, 86400) / 86400)
+
+    close = level * np.exp(np.cumsum(rng.normal(0.0, step, n)))
+    open_ = np.concatenate([[level], close[:-1]])
+    high = np.maximum(open_, close) * (1.0 + np.abs(rng.normal(0.0, step / 2, n)))
+    low = np.minimum(open_, close) * (1.0 - np.abs(rng.normal(0.0, step / 2, n)))
+    volume = rng.integers(100, 10_000, n) if whatToShow == "TRADES" else np.zeros(n, dtype=np.int64)
+
+    text = np.datetime_as_string(stamps, unit="s")
+    bars = []
+    for i in range(n):
+        bar = BarData()
+        bar.date = text[i][:10].replace("-", "") if daily else f"{text[i][:10].replace('-', '')}  {text[i][11:]}"
+        bar.open, bar.high, bar.low, bar.close = float(open_[i]), float(high[i]), float(low[i]), float(close[i])
+        bar.volume = int(volume[i])
+        bars.append(bar)
+    return bars
+
+
+def _frame_to_bars(df: pd.DataFrame, durationStr: str, barSizeSetting: str) -> List[BarData]:
+    """ Recorded bars (a df indexed by date with open/high/low/close/volume) as TWS would send them """
+
+    if len(df):
+        df = df[df.index >= df.index[-1] - pd.Timedelta(seconds=duration_seconds(durationStr))]
+    daily = bar_size_seconds(barSizeSetting) >= 86400
+
+    bars = []
+    for stamp, row in zip(df.index, df.itertuples(index=False)):
+        bar = BarData()
+        bar.date = stamp.strftime("%Y%m%d") if daily else stamp.strftime("%Y%m%d  %H:%M:%S")
+        bar.open, bar.high, bar.low, bar.close = row.open, row.high, row.low, row.close
+        bar.volume = getattr(row, "volume", 0)
+        bars.append(bar)
+    return bars
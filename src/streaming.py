@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+# IB tick types we use for live repricing
+BID, ASK, LAST, CLOSE = 1, 2, 4, 9
+DELAYED_BID, DELAYED_ASK, DELAYED_LAST, DELAYED_CLOSE = 66, 67, 68, 75
+OPTION_IMPLIED_VOL = 24     # generic tick 106 on the underlying, annualized decimal
+
+
+class TickCoalescer():
+    """
+    Bounded, coalescing hand-off between the IB reader thread and the GUI
+
+    The reader thread put()s every tick keyed by (reqId, tickType). Only the latest value per key is kept, so when
+    ticks arrive faster than the GUI redraws the stale ones are overwritten instead of queueing up. The number of keys
+    is bounded by maxsize; if it is exceeded the least recently updated key is dropped. The GUI drain()s the latest
+    values on its own (throttled) schedule.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._latest: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.received = 0       # every tick put()
+        self.dropped = 0        # ticks overwritten or evicted before being drained
+
+    def put(self, key: Hashable, value: float):
+        with self._lock:
+            self.received += 1
+            if key in self._latest:
+                self.dropped += 1
+                self._latest.move_to_end(key)
+            self._latest[key] = value
+
+            if len(self._latest) > self.maxsize:
+                self._latest.popitem(last=False)
+                self.dropped += 1
+
+    def drain(self) -> Dict[Hashable, float]:
+        """ Returns the latest value for every key updated since the last drain """
+
+        with self._lock:
+            latest = dict(self._latest)
+            self._latest.clear()
+        return latest
+
+    def __len__(self):
+        return len(self._latest)
+
+
+def mid_from_ticks(ticks: Dict[int, float]) -> Optional[float]:
+    """ Mid price from the latest ticks of one contract (live or delayed bid/ask, then last); None if unusable """
+
+    for bid_type, ask_type in ((BID, ASK), (DELAYED_BID, DELAYED_ASK)):
+        bid, ask = ticks.get(bid_type, -1), ticks.get(ask_type, -1)
+        if bid > 0 and ask > 0:
+            return 0.5 * (bid + ask)
+    for tick_type in (LAST, DELAYED_LAST):
+        price = ticks.get(tick_type, -1)
+        if price > 0:
+            return price
+    return None
@@ -0,0 +1,242 @@
+from datetime import date, datetime
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
+
+from src.analysis import RISK_FREE_RATE
+from src.exceptions import NoDataError
+from src.implied_vol import chain_implied_volatility
+from src.utils import black_scholes_straddle
+
+
+def days_until(expirations: Sequence[str], today: Optional[date] = None) -> np.ndarray:
+    """ Calendar days from today to each IB format (YYYYMMDD) expiry """
+
+    today = today or date.today()
+    return np.array([(datetime.strptime(expiry, "%Y%m%d").date() - today).days for expiry in expirations], dtype=np.float64)
+
+
+class VolCurve():
+    """
+    ATM implied vol per expiry, interpolated linearly in total variance (iv^2 * T) between expiries
+
+    Interpolating variance rather than vol keeps forward variance non-negative for a sane curve; before the first and
+    after the last expiry the vol is held flat.
+    """
+
+    def __init__(self, days: Sequence[float], ivs: Sequence[float]):
+        days = np.asarray(days, dtype=np.float64)
+        ivs = np.asarray(ivs, dtype=np.float64)
+        ok = np.isfinite(days) & np.isfinite(ivs) & (days > 0)
+        if not ok.any():
+            raise ValueError("VolCurve needs at least one expiry with a positive days to expiry and a finite iv")
+
+        order = np.argsort(days[ok])
+        self.days = days[ok][order]
+        self.ivs = ivs[ok][order]
+        self.total_variance = self.ivs ** 2 * self.days / 365.0
+
+    def __call__(self, days) -> np.ndarray:
+        """ Annualized iv (decimal) for any days to expiry, scalar or array """
+
+        days = np.asarray(days, dtype=np.float64)
+        T = np.maximum(days, 0.0) / 365.0
+        variance = np.interp(days, self.days, self.total_variance)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            iv = np.sqrt(variance / T)
+        iv = np.where(days <= self.days[0], self.ivs[0], iv)
+        return np.where(days >= self.days[-1], self.ivs[-1], iv)
+
+    def forward_vol(self, start_days: float, end_days: float) -> float:
+        """ Vol implied for the period between two expiries, from the difference in total variance """
+
+        T0, T1 = start_days / 365.0, end_days / 365.0
+        variance = float(self(end_days)) ** 2 * T1 - float(self(start_days)) ** 2 * T0
+        return float(np.sqrt(max(variance, 0.0) / (T1 - T0)))
+
+
+class RateCurve():
+    """
+    Continuously compounded zero rates per tenor (days), interpolated linearly in r * T (flat forwards between points)
+    and held flat outside the given tenors
+    """
+
+    def __init__(self, days: Sequence[float], rates: Sequence[float]):
+        order = np.argsort(days)
+        self.days = np.asarray(days, dtype=np.float64)[order]
+        self.rates = np.asarray(rates, dtype=np.float64)[order]
+
+    @classmethod
+    def flat(cls, rate: float = RISK_FREE_RATE):
+        return cls([365.0], [rate])
+
+    def __call__(self, days) -> np.ndarray:
+        days = np.asarray(days, dtype=np.float64)
+        integrated = np.interp(days, self.days, self.rates * self.days)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rate = integrated / days
+        rate = np.where(days <= self.days[0], self.rates[0], rate)
+        return np.where(days >= self.days[-1], self.rates[-1], rate)
+
+
+# anything priced here takes either a constant or a curve for iv and r
+Curve = Union[float, VolCurve, RateCurve]
+
+
+def _on_curve(curve: Curve, days: np.ndarray) -> np.ndarray:
+    if callable(curve):
+        return curve(days)
+    return np.full(np.shape(days), float(curve))
+
+
+def decay_path(spot: float, strike: float, days_to_expiry: float, iv: Curve, r: Curve = RISK_FREE_RATE,
+               steps_per_day: int = 1, entry_price: Optional[float] = None) -> Dict[str, np.ndarray]:
+    """
+    Straddle value and greeks from entry to expiry at a constant spot, day by day (steps_per_day=1) or finer
+    (eg. 24 for hourly)
+
+    iv and r are constants or curves; with a VolCurve the straddle rolls down the term structure as it ages (the iv at
+    each step is the curve's iv for the remaining days). The whole path is priced as one time axis in a single kernel
+    call; the last step is expiry and is valued at intrinsic. decay is the value lost since entry (entry_price if
+    given, else the model price at entry).
+    """
+
+    n_steps = int(np.ceil(days_to_expiry * steps_per_day))
+    elapsed = np.minimum(np.arange(n_steps + 1) / steps_per_day, days_to_expiry)
+    remaining = days_to_expiry - elapsed
+
+    ivs = _on_curve(iv, remaining)
+    rates = _on_curve(r, remaining)
+    T = remaining / 365.0
+    alive = T > 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        priced = black_scholes_straddle(spot, strike, np.where(alive, T, 1.0), rates, ivs)
+
+    straddle = np.where(alive, priced["straddle"], abs(spot - strike))
+    path = {
+        "days_elapsed": elapsed,
+        "days_to_expiry": remaining,
+        "iv": ivs,
+        "r": rates,
+        "straddle": straddle,
+        "delta": np.where(alive, priced["delta"], np.sign(spot - strike)),
+    }
+    for greek in ("gamma", "vega", "theta"):
+        path[greek] = np.where(alive, priced[greek], 0.0)
+
+    path["decay"] = (straddle[0] if entry_price is None else entry_price) - straddle
+    return path
+
+
+def implied_event_move(front_iv: float, front_days: float, back_iv: float, back_days: float) -> Dict[str, float]:
+    """
+    Splits the front expiry's variance into a diffusive part and a one day event jump, assuming the back expiry sees
+    the same event and the same diffusive vol
+
+    Returns the diffusive vol (roughly where the front iv should crush to after the event) and the sd of the event
+    move as a decimal. When the front iv is not elevated relative to the back the event move comes out as 0.
+    """
+
+    T_front, T_back = front_days / 365.0, back_days / 365.0
+    if T_back <= T_front:
+        raise ValueError("The back expiry has to be after the front expiry")
+
+    diffusive_variance = (back_iv ** 2 * T_back - front_iv ** 2 * T_front) / (T_back - T_front)
+    diffusive_variance = max(diffusive_variance, 0.0)
+    event_variance = max(front_iv ** 2 * T_front - diffusive_variance * T_front, 0.0)
+
+    return {"diffusive_iv": float(np.sqrt(diffusive_variance)), "event_move": float(np.sqrt(event_variance))}
+
+
+def calendar_crush(spot: float, strike: float, front_days: float, back_days: float, front_iv: float, back_iv: float,
+                   spot_moves=0.0, front_crush=None, back_crush=None, hold_days: float = 1,
+                   r: Curve = RISK_FREE_RATE) -> Dict[str, np.ndarray]:
+    """
+    Calendar straddle through the event: short the front expiry straddle and long the back expiry straddle
+
+    front_crush and back_crush are decimal drops in each expiry's iv after the event (eg. 0.5 and 0.15); by default the
+    front iv crushes to the diffusive vol from implied_event_move and the back iv drops by the share of its variance
+    the event accounted for. spot_moves, front_crush and back_crush broadcast against each other, so passing arrays
+    on different axes evaluates a whole grid in one pass.
+
+    Returns the entry prices, the post-event prices and the PnL of each leg and of the calendar (per 1 lot of each)
+    """
+
+    if front_crush is None or back_crush is None:
+        event = implied_event_move(front_iv, front_days, back_iv, back_days)
+        post_back_iv = np.sqrt(max(back_iv ** 2 * back_days - event["event_move"] ** 2 * 365.0, 0.0) / back_days)
+        front_crush = 1.0 - event["diffusive_iv"] / front_iv if front_crush is None else front_crush
+        back_crush = 1.0 - post_back_iv / back_iv if back_crush is None else back_crush
+
+    spot_moves, front_crush, back_crush = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64)
+                                                                 for a in (spot_moves, front_crush, back_crush)))
+    front_r = float(_on_curve(r, np.float64(front_days)))
+    back_r = float(_on_curve(r, np.float64(back_days)))
+
+    # price both legs at entry, then the post-event grid for each leg in one call
+    front_entry = black_scholes_straddle(spot, strike, front_days / 365.0, front_r, front_iv)["straddle"]
+    back_entry = black_scholes_straddle(spot, strike, back_days / 365.0, back_r, back_iv)["straddle"]
+
+    new_spot = spot * (1.0 + spot_moves)
+    front_left = max(front_days - hold_days, 0)
+    back_left = max(back_days - hold_days, 0)
+
+    if front_left > 0:
+        front_exit = black_scholes_straddle(new_spot, strike, front_left / 365.0, front_r, front_iv * (1.0 - front_crush))["straddle"]
+    else:
+        front_exit = np.abs(new_spot - strike)
+    if back_left > 0:
+        back_exit = black_scholes_straddle(new_spot, strike, back_left / 365.0, back_r, back_iv * (1.0 - back_crush))["straddle"]
+    else:
+        back_exit = np.abs(new_spot - strike)
+
+    pnl_front = front_entry - front_exit        # short leg
+    pnl_back = back_exit - back_entry           # long leg
+
+    return {
+        "spot_move": spot_moves,
+        "front_crush": front_crush,
+        "back_crush": back_crush,
+        "front_entry": float(front_entry),
+        "back_entry": float(back_entry),
+        "calendar_entry": float(back_entry - front_entry),
+        "front_exit": front_exit,
+        "back_exit": back_exit,
+        "pnl_front": pnl_front,
+        "pnl_back": pnl_back,
+        "pnl": pnl_front + pnl_back,
+    }
+
+
+def atm_vol_curve(ib_app, chain, spot: float, max_expiries: int = 6, r: float = RISK_FREE_RATE,
+                  today: Optional[date] = None) -> VolCurve:
+    """
+    Builds a VolCurve from the quoted ATM straddles of the first max_expiries expiries of an option chain
+
+    Each expiry's iv is the average of the call and put iv backed out of their mid prices; expiries without usable
+    quotes are skipped.
+    """
+
+    strike = float(chain.nearest_strikes(spot, 1)[0])
+    expirations = [expiry for expiry, days in zip(chain.expirations, days_until(chain.expirations, today)) if days > 0]
+
+    days, ivs = [], []
+    for expiry in expirations[:max_expiries]:
+        try:
+            quotes = ib_app.get_straddle_quotes(chain, expiry, strike)
+        except NoDataError:
+            continue
+
+        expiry_days = float(days_until([expiry], today)[0])
+        call_iv, put_iv = chain_implied_volatility(quotes["call"], quotes["put"], spot, strike, expiry_days / 365.0, r)
+        leg_ivs = [float(iv) for iv in (call_iv, put_iv) if np.isfinite(iv)]
+        if leg_ivs:
+            days.append(expiry_days)
+            ivs.append(np.mean(leg_ivs))
+
+    if not days:
+        raise NoDataError(f"No quoted ATM straddles for {chain.symbol}")
+    return VolCurve(days, ivs)
@@ -1,17 +1,129 @@
+import math
+
 import numpy as np
-from scipy.stats import norm
+
+_INV_SQRT_2PI = 1.0 / np.sqrt(2.0 * np.pi)
+_SQRT_HALF = math.sqrt(0.5)
+
+# up to this many points the normal cdf goes through math.erfc, past it scipy's vectorized ndtr is worth importing
+SMALL_CDF_SIZE = 64
+
+_erfc = np.frompyfunc(math.erfc, 1, 1)
+_scipy_ndtr = None
+
+
+def ndtr(x):
+    """
+    Standard normal cdf, N(x) = erfc(-x / sqrt(2)) / 2
+
+    Pricing a straddle or backing out the iv of a couple of legs only ever needs a handful of points, which math.erfc
+    handles at full double precision, so scipy (a couple hundred ms to import) is only loaded the first time a large
+    array like a scenario grid or a Monte Carlo run comes through.
+    """
+
+    global _scipy_ndtr
+
+    x = np.asarray(x, dtype=np.float64)
+    if x.size <= SMALL_CDF_SIZE:
+        return 0.5 * np.asarray(_erfc(-x * _SQRT_HALF), dtype=np.float64)
+
+    if _scipy_ndtr is None:
+        from scipy.special import ndtr as _scipy_ndtr
+    return _scipy_ndtr(x)
+
+
+def _norm_pdf(x):
+    return _INV_SQRT_2PI * np.exp(-0.5 * x * x)
+
+
+def black_scholes_greeks(S, K, T, r, sigma):
+    """
+    Fused Black-Scholes kernel that prices the call and put and computes all of the greeks in one pass
+
+    All inputs can be scalars or numpy arrays (they are broadcast against each other). d1, d2, sqrt(T), the discount factor
+    and the normal cdf/pdf values are computed once and shared between every output instead of being recomputed per greek.
+
+    Returns a dict of arrays with keys: call, put, call_delta, put_delta, gamma, vega, call_theta, put_theta
+    (vega is per 1 vol point and theta is per calendar day, same units as the single greek functions below)
+    """
+
+    S = np.asarray(S, dtype=np.float64)
+    K = np.asarray(K, dtype=np.float64)
+    T = np.asarray(T, dtype=np.float64)
+    r = np.asarray(r, dtype=np.float64)
+    sigma = np.asarray(sigma, dtype=np.float64)
+
+    # shared intermediates
+    sqrt_T = np.sqrt(T)
+    sig_sqrt_T = sigma * sqrt_T
+    d1 = (np.log(S / K) + (r + 0.5 * sigma * sigma) * T) / sig_sqrt_T
+    d2 = d1 - sig_sqrt_T
+    disc_K = K * np.exp(-r * T)
+
+    N_d1 = ndtr(d1)
+    N_d2 = ndtr(d2)
+    pdf_d1 = _norm_pdf(d1)
+
+    # N(-x) = 1 - N(x) so we do not need to evaluate the cdf again for the put side
+    call = S * N_d1 - disc_K * N_d2
+    # put-call parity; for deep out of the money puts it cancels to a rounding error that can dip below zero
+    put = np.maximum(call - S + disc_K, 0.0)
+
+    call_delta = N_d1
+    put_delta = N_d1 - 1.0
+
+    gamma = pdf_d1 / (S * sig_sqrt_T)
+    vega = S * pdf_d1 * sqrt_T / 100
+
+    decay = -S * pdf_d1 * sigma / (2 * sqrt_T)
+    r_disc_K = r * disc_K
+    call_theta = (decay - r_disc_K * N_d2) / 365
+    put_theta = (decay + r_disc_K * (1.0 - N_d2)) / 365
+
+    return {
+        "call": call,
+        "put": put,
+        "call_delta": call_delta,
+        "put_delta": put_delta,
+        "gamma": gamma,
+        "vega": vega,
+        "call_theta": call_theta,
+        "put_theta": put_theta,
+    }
+
+
+def black_scholes_straddle(S, K, T, r, sigma):
+    """
+    Prices a straddle (1 call + 1 put at the same strike) with the fused kernel
+
+    Returns the call and put prices along with the straddle price and the combined straddle greeks
+    (delta, gamma, vega and theta are the sum of the exposure of the call contract and the put contract)
+    """
+
+    g = black_scholes_greeks(S, K, T, r, sigma)
+
+    return {
+        "call": g["call"],
+        "put": g["put"],
+        "straddle": g["call"] + g["put"],
+        "delta": g["call_delta"] + g["put_delta"],
+        "gamma": 2 * g["gamma"],
+        "vega": 2 * g["vega"],
+        "theta": g["call_theta"] + g["put_theta"],
+    }
+
 
 def black_scholes_call(S, K, T, r, sigma):
     d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * np.sqrt(T))
     d2 = d1 - sigma * np.sqrt(T)
-    call = K * np.exp(-r * T) * norm.cdf(-d2) - S * norm.cdf(-d1)
+    call = S * ndtr(d1) - K * np.exp(-r * T) * ndtr(d2)
     return call
 
 
 def black_scholes_put(S, K, T, r, sigma):
     d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * np.sqrt(T))
     d2 = d1 - sigma * np.sqrt(T)
-    put = K * np.exp(-r * T) * norm.cdf(-d2) - S * norm.cdf(-d1)
+    put = K * np.exp(-r * T) * ndtr(-d2) - S * ndtr(-d1)
     return put
 
 
@@ -19,31 +131,31 @@ def calculate_delta(S, K, T, r, sigma, type="call"):
     d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * np.sqrt(T))
 
     if type == 'call':
-        delta = norm.cdf(d1)
+        delta = ndtr(d1)
     else:
-        delta = -norm.cdf(-d1)
+        delta = -ndtr(-d1)
 
     return delta
 
 
 def calculate_gamma(S, K, T, r, sigma):
     d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * np.sqrt(T))
-    gamma = norm.pdf(d1) / (S * sigma * np.sqrt(T))
+    gamma = _norm_pdf(d1) / (S * sigma * np.sqrt(T))
     return gamma
 
 
 def calculate_vega(S, K, T, r, sigma):
     d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * np.sqrt(T))
-    vega =  S * norm.pdf(d1) * np.sqrt(T) / 100
+    vega =  S * _norm_pdf(d1) * np.sqrt(T) / 100
     return vega
 
 
 def calculate_theta(S, K, T, r, sigma, type="call"):
     d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * np.sqrt(T))
     d2 = d1 - sigma * np.sqrt(T)
-        
+
     if type == 'call':
-        theta = (-S * norm.pdf(d1) * sigma / (2 * np.sqrt(T)) - r * K * np.exp(-r * T) * norm.cdf(d2)) / 365
+        theta = (-S * _norm_pdf(d1) * sigma / (2 * np.sqrt(T)) - r * K * np.exp(-r * T) * ndtr(d2)) / 365
     else:
-        theta = (-S * norm.pdf(d1) * sigma / (2 * np.sqrt(T)) + r * K * np.exp(-r * T) * norm.cdf(-d2)) / 365
-    return theta
\ No newline at end of file
+        theta = (-S * _norm_pdf(d1) * sigma / (2 * np.sqrt(T)) + r * K * np.exp(-r * T) * ndtr(-d2)) / 365
+    return theta
@@ -0,0 +1,181 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from typing import Callable, Dict, List, Optional
+
+
+class TaskHandle():
+    """ Handle for a task submitted to the TkExecutor; used to cancel it and to check on it """
+
+    def __init__(self, description: str, on_success: Optional[Callable], on_error: Optional[Callable], on_cancel: Optional[Callable]):
+        self.description = description
+        self.on_success = on_success
+        self.on_error = on_error
+        self.on_cancel = on_cancel
+        self.future = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+
+class TkExecutor():
+    """
+    Runs blocking work (IB requests, heavy pricing) on a thread pool and hands the results back to the Tk main thread
+
+    Tk widgets must only be touched from the main thread, so workers never call back into the GUI directly. Finished
+    tasks are pushed onto a queue and a pump scheduled with root.after drains it on the main thread, calling
+    on_success(result) or on_error(exception) there. The pump only runs while tasks are outstanding.
+    """
+
+    def __init__(self, root, max_workers: int = 4, poll_ms: int = 50, on_progress: Optional[Callable] = None):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.on_progress = on_progress      # called with the list of pending task descriptions whenever it changes
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tk-worker")
+        self._results = queue.Queue()
+        self._pending: Dict[int, TaskHandle] = {}
+        self._pump_id = None
+
+    def submit(self, fn: Callable, *args, on_success: Optional[Callable] = None, on_error: Optional[Callable] = None,
+               on_cancel: Optional[Callable] = None, description: str = "", **kwargs) -> TaskHandle:
+        """ Runs fn(*args, **kwargs) on a worker thread; must be called from the Tk main thread """
+
+        handle = TaskHandle(description or getattr(fn, "__name__", "task"), on_success, on_error, on_cancel)
+        handle.future = self._pool.submit(fn, *args, **kwargs)
+        self._pending[id(handle)] = handle
+
+        # the done callback runs on the worker thread so all it does is queue the handle for the pump
+        handle.future.add_done_callback(lambda _future, handle=handle: self._results.put(handle))
+
+        self._notify_progress()
+        self._schedule_pump()
+        return handle
+
+    def gather(self, calls: List[tuple], on_success: Optional[Callable] = None, on_error: Optional[Callable] = None,
+               on_cancel: Optional[Callable] = None, description: str = "") -> List[TaskHandle]:
+        """
+        Runs several (fn, *args) calls concurrently and calls on_success with the list of results once all of them are done
+
+        If any call fails, the remaining calls are cancelled and on_error is called once with the first exception.
+        on_cancel is called once if the group is cancelled from outside (eg. cancel_all)
+        """
+
+        results = [None] * len(calls)
+        remaining = [len(calls)]
+        failed = [False]
+        handles = []
+
+        def make_success(idx):
+            def _success(result):
+                results[idx] = result
+                remaining[0] -= 1
+                if remaining[0] == 0 and not failed[0] and on_success is not None:
+                    on_success(results)
+            return _success
+
+        def _cancel():
+            if failed[0]:
+                return
+            failed[0] = True
+            for handle in handles:
+                self.cancel(handle, notify=False)
+            if on_cancel is not None:
+                on_cancel()
+
+        def _error(e):
+            if failed[0]:
+                return
+            failed[0] = True
+            for handle in handles:
+                self.cancel(handle, notify=False)
+            if on_error is not None:
+                on_error(e)
+
+        for idx, (fn, *args) in enumerate(calls):
+            desc = f"{description} [{idx + 1}/{len(calls)}]" if description else ""
+            handles.append(self.submit(fn, *args, on_success=make_success(idx), on_error=_error,
+                                       on_cancel=_cancel, description=desc))
+
+        return handles
+
+    def cancel(self, handle: TaskHandle, notify: bool = True):
+        """
+        Cancels a task. Tasks that have not started yet are removed from the pool; tasks that are already running
+        keep going on their worker (they can watch handle.cancel_event) but their result is discarded
+        """
+
+        if handle.cancelled or id(handle) not in self._pending:
+            return
+
+        handle.cancel_event.set()
+        handle.future.cancel()
+        self._pending.pop(id(handle), None)
+
+        if notify and handle.on_cancel is not None:
+            handle.on_cancel()
+
+        self._notify_progress()
+
+    def cancel_all(self):
+        for handle in list(self._pending.values()):
+            self.cancel(handle)
+
+    @property
+    def pending(self) -> List[str]:
+        return [handle.description for handle in self._pending.values()]
+
+    def shutdown(self):
+        self.cancel_all()
+        if self._pump_id is not None:
+            self.root.after_cancel(self._pump_id)
+            self._pump_id = None
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _schedule_pump(self):
+        if self._pump_id is None:
+            self._pump_id = self.root.after(self.poll_ms, self._pump)
+
+    def _pump(self):
+        """ Drains finished tasks on the main thread and dispatches their callbacks """
+
+        self._pump_id = None
+        changed = False
+
+        while True:
+            try:
+                handle = self._results.get_nowait()
+            except queue.Empty:
+                break
+
+            # cancelled tasks were already removed from pending and their results are dropped
+            if self._pending.pop(id(handle), None) is None:
+                continue
+            changed = True
+
+            try:
+                result = handle.future.result()
+            except CancelledError:
+                continue
+            except Exception as e:
+                if handle.on_error is not None:
+                    handle.on_error(e)
+                continue
+
+            if handle.on_success is not None:
+                handle.on_success(result)
+
+        if changed:
+            self._notify_progress()
+
+        if self._pending:
+            self._schedule_pump()
+
+    def _notify_progress(self):
+        if self.on_progress is not None:
+            self.on_progress(self.pending)